@@ -66,6 +66,7 @@ def encodeFmdlAntiBlur(fmdl):
 		output.vertices = mesh.vertices.copy()
 		output.faces = mesh.faces.copy()
 		output.boneGroup = mesh.boneGroup
+		output.boneInfluences = mesh.boneInfluences
 		output.alphaFlags = 128 | (mesh.alphaFlags & 32)
 		output.shadowFlags = 1
 		output.vertexFields = mesh.vertexFields
@@ -0,0 +1,1124 @@
+from . import FmdlFile, FmdlFloat16
+import itertools
+import numpy
+
+#
+# NumPy-based implementations of the fmdl geometry codecs.
+#
+# FmdlFile decodes and encodes geometry one vertex at a time, which is by far
+# the most expensive part of reading and writing large meshes. The functions in
+# this module process all vertices of a mesh at once, as arrays. FmdlFile uses
+# them when NumPy is available, and falls back on its own pure-Python
+# implementations otherwise; both produce identical results.
+#
+
+
+
+#
+# For each vertex datum type, the allowed datum formats, and the numpy dtype
+# of a single datum in each format. float16 data is read as its bit patterns,
+# and decoded by FmdlFloat16.
+#
+DATUM_DTYPES = {
+	FmdlFile.FmdlFile.FmdlVertexDatumType.position: {
+		FmdlFile.FmdlFile.FmdlVertexDatumFormat.tripleFloat32: ('<f4', 3),
+	},
+	FmdlFile.FmdlFile.FmdlVertexDatumType.boneWeights: {
+		FmdlFile.FmdlFile.FmdlVertexDatumFormat.quadFloat8: ('u1', 4),
+	},
+	FmdlFile.FmdlFile.FmdlVertexDatumType.normal: {
+		FmdlFile.FmdlFile.FmdlVertexDatumFormat.quadFloat16: ('<u2', 4),
+	},
+	FmdlFile.FmdlFile.FmdlVertexDatumType.color: {
+		FmdlFile.FmdlFile.FmdlVertexDatumFormat.quadFloat8: ('u1', 4),
+	},
+	FmdlFile.FmdlFile.FmdlVertexDatumType.boneIndices: {
+		FmdlFile.FmdlFile.FmdlVertexDatumFormat.quadInt8: ('u1', 4),
+	},
+	FmdlFile.FmdlFile.FmdlVertexDatumType.uv0: {
+		FmdlFile.FmdlFile.FmdlVertexDatumFormat.doubleFloat16: ('<u2', 2),
+		FmdlFile.FmdlFile.FmdlVertexDatumFormat.doubleFloat32: ('<f4', 2),
+	},
+	FmdlFile.FmdlFile.FmdlVertexDatumType.uv1: {
+		FmdlFile.FmdlFile.FmdlVertexDatumFormat.doubleFloat16: ('<u2', 2),
+		FmdlFile.FmdlFile.FmdlVertexDatumFormat.doubleFloat32: ('<f4', 2),
+	},
+	FmdlFile.FmdlFile.FmdlVertexDatumType.uv2: {
+		FmdlFile.FmdlFile.FmdlVertexDatumFormat.doubleFloat16: ('<u2', 2),
+		FmdlFile.FmdlFile.FmdlVertexDatumFormat.doubleFloat32: ('<f4', 2),
+	},
+	FmdlFile.FmdlFile.FmdlVertexDatumType.uv3: {
+		FmdlFile.FmdlFile.FmdlVertexDatumFormat.doubleFloat16: ('<u2', 2),
+		FmdlFile.FmdlFile.FmdlVertexDatumFormat.doubleFloat32: ('<f4', 2),
+	},
+	FmdlFile.FmdlFile.FmdlVertexDatumType.tangent: {
+		FmdlFile.FmdlFile.FmdlVertexDatumFormat.quadFloat16: ('<u2', 4),
+	},
+}
+
+UV_DATUM_TYPES = FmdlFile.FmdlFile.UV_DATUM_TYPES
+
+def datumDtype(datumType, datumFormat):
+	return numpy.dtype(FmdlFile.FmdlFile.vertexDatumFormat(DATUM_DTYPES, datumType, datumFormat))
+
+#
+# Interpret the vertex buffer area of a mesh, described by a mesh format as
+# returned by FmdlFile.parseMeshFormatAssignments(), as a collection of strided
+# arrays. Returns a map from datum type to (values, encodings), where values is
+# a vertexCount x N array of the datum components, and encodings is an array
+# of the vertexCount raw byte strings of the datum.
+#
+# The returned arrays are views into vertexBuffer; no data is copied.
+#
+def decodeVertexData(vertexBuffer, format, vertexCount):
+	output = {}
+	for (datumType, datumFormat, offset, increment) in format:
+		dtype = datumDtype(datumType, datumFormat)
+		try:
+			values = numpy.ndarray((vertexCount, ), dtype, vertexBuffer, offset, (increment, ))
+			encodings = numpy.ndarray((vertexCount, ), numpy.dtype('V%d' % dtype.itemsize), vertexBuffer, offset, (increment, ))
+		except (TypeError, ValueError):
+			raise FmdlFile.InvalidFmdl("Vertex buffer too small for %d vertices" % vertexCount)
+		output[datumType] = (values, encodings)
+	return output
+
+#
+# Build the Vertex and VertexEncoding objects for a mesh, identical to the
+# ones FmdlFile.parseVertices() would construct, and the BoneInfluences of the
+# mesh if it has bone mappings. Returns (vertices, vertex encodings, bone
+# influences or None).
+#
+def parseVertices(vertexBuffer, format, boneGroup, vertexCount):
+	data = decodeVertexData(vertexBuffer, format, vertexCount)
+	
+	vertices = [FmdlFile.FmdlFile.Vertex() for i in range(vertexCount)]
+	vertexEncodings = [FmdlFile.FmdlFile.VertexEncoding() for i in range(vertexCount)]
+	for (vertex, vertexEncoding) in zip(vertices, vertexEncodings):
+		vertexEncoding.vertex = vertex
+	
+	Vector2 = FmdlFile.FmdlFile.Vector2
+	Vector3 = FmdlFile.FmdlFile.Vector3
+	Vector4 = FmdlFile.FmdlFile.Vector4
+	
+	if FmdlFile.FmdlFile.FmdlVertexDatumType.position in data:
+		#
+		# Loops of the same vertex share their position encoding. Keep a single
+		# copy of each. The positions themselves are not shared: vertices
+		# only share a position object if they are known to be loops of the
+		# same vertex, see FmdlSplitVertexEncoding.
+		#
+		positionEncodings = {}
+		(values, encodings) = data[FmdlFile.FmdlFile.FmdlVertexDatumType.position]
+		for (vertex, vertexEncoding, (x, y, z), encoding) in zip(vertices, vertexEncodings, values.tolist(), encodings.tolist()):
+			vertex.position = Vector3(x, y, z)
+			vertexEncoding.position = positionEncodings.setdefault(encoding, encoding)
+	
+	if FmdlFile.FmdlFile.FmdlVertexDatumType.normal in data:
+		(values, encodings) = data[FmdlFile.FmdlFile.FmdlVertexDatumType.normal]
+		for (vertex, vertexEncoding, (x, y, z, w), encoding) in zip(vertices, vertexEncodings, FmdlFloat16.decode(values).tolist(), encodings.tolist()):
+			vertex.normal = Vector4(x, y, z, w)
+			vertexEncoding.normal = encoding
+	
+	if FmdlFile.FmdlFile.FmdlVertexDatumType.tangent in data:
+		(values, encodings) = data[FmdlFile.FmdlFile.FmdlVertexDatumType.tangent]
+		for (vertex, vertexEncoding, (x, y, z, w), encoding) in zip(vertices, vertexEncodings, FmdlFloat16.decode(values).tolist(), encodings.tolist()):
+			vertex.tangent = Vector4(x, y, z, w)
+			vertexEncoding.tangent = encoding
+	
+	if FmdlFile.FmdlFile.FmdlVertexDatumType.color in data:
+		(values, encodings) = data[FmdlFile.FmdlFile.FmdlVertexDatumType.color]
+		for (vertex, vertexEncoding, color, encoding) in zip(vertices, vertexEncodings, (values / 255.0).tolist(), encodings.tolist()):
+			vertex.color = color
+			vertexEncoding.color = encoding
+	
+	for datumType in UV_DATUM_TYPES:
+		if datumType not in data:
+			continue
+		(values, encodings) = data[datumType]
+		if values.dtype == numpy.dtype('<u2'):
+			values = FmdlFloat16.decode(values)
+		for (vertex, vertexEncoding, (u, v), encoding) in zip(vertices, vertexEncodings, values.tolist(), encodings.tolist()):
+			vertex.uv.append(Vector2(u, v))
+			vertexEncoding.uv.append(encoding)
+	
+	if FmdlFile.FmdlFile.FmdlVertexDatumType.boneWeights in data and FmdlFile.FmdlFile.FmdlVertexDatumType.boneIndices in data:
+		(boneWeights, boneWeightEncodings) = data[FmdlFile.FmdlFile.FmdlVertexDatumType.boneWeights]
+		(boneIndices, boneIndexEncodings) = data[FmdlFile.FmdlFile.FmdlVertexDatumType.boneIndices]
+		
+		#
+		# Most vertices share their bone weighting with many others, so each
+		# distinct weighting is decoded only once, into a bone mapping shared
+		# by all those vertices.
+		#
+		bones = boneGroup.bones
+		decodedMappings = {}
+		for (vertex, vertexEncoding, weightEncoding, indexEncoding) in zip(vertices, vertexEncodings, boneWeightEncodings.tolist(), boneIndexEncodings.tolist()):
+			key = weightEncoding + indexEncoding
+			if key not in decodedMappings:
+				boneMapping = {}
+				boneMappingEncoding = []
+				for i in range(4):
+					weight = weightEncoding[i]
+					index = indexEncoding[i]
+					if weight > 0:
+						if not index < len(bones):
+							#
+							# This happens a fair few times in real models.
+							# Let's just ignore the bone weighting instead.
+							#
+							continue
+						
+						boneMapping[bones[index]] = weight / 255.0
+						boneMappingEncoding.append((bones[index], weight))
+				decodedMappings[key] = (FmdlFile.FmdlFile.BoneMapping(boneMapping), tuple(boneMappingEncoding))
+			
+			(vertex.boneMapping, vertexEncoding.boneMapping) = decodedMappings[key]
+		
+		boneWeights = numpy.array(boneWeights, dtype = numpy.uint8)
+		boneIndices = numpy.array(boneIndices, dtype = numpy.uint8)
+		boneWeights[boneIndices >= len(bones)] = 0
+		boneInfluences = BoneInfluences(bones, *compactBoneMappings(boneIndices, boneWeights))
+	else:
+		boneInfluences = None
+	
+	return (vertices, vertexEncodings, boneInfluences)
+
+#
+# Decode the faces of a mesh into a faceCount x 3 array of vertex indices.
+# The returned array is a view into vertexBuffer.
+#
+def decodeFaces(vertexBuffer, vertexBufferOffset, firstFaceVertexIndex, faceVertexCount, vertexCount):
+	faceCount = (faceVertexCount + 2) // 3
+	try:
+		faces = numpy.ndarray((faceCount, 3), numpy.dtype('<u2'), vertexBuffer, vertexBufferOffset + firstFaceVertexIndex * 2, (6, 2))
+	except (TypeError, ValueError):
+		raise FmdlFile.InvalidFmdl("Face buffer too small for %d faces" % faceCount)
+	if faceCount > 0 and int(faces.max()) >= vertexCount:
+		raise FmdlFile.InvalidFmdl("Invalid vertex referenced by face")
+	return faces
+
+#
+# Decode the faces of a mesh into an F x 3 uint16 array, for
+# FmdlFile.parseFaces(). Unlike decodeFaces(), the result does not refer to
+# vertexBuffer.
+#
+def parseFaces(vertexBuffer, vertexBufferOffset, firstFaceVertexIndex, faceVertexCount, vertexCount):
+	return numpy.array(decodeFaces(vertexBuffer, vertexBufferOffset, firstFaceVertexIndex, faceVertexCount, vertexCount), dtype = numpy.uint16)
+
+
+#
+# Encode the bone mappings of a list of vertices, identically to
+# FmdlFile.encodeBoneMapping(), all at once. Returns (bones, boneIDs,
+# boneWeights), where bones is a list of the distinct bones used, and boneIDs
+# and boneWeights are N x 4 arrays holding the encoded bone mapping of each
+# vertex as indices into bones and 8-bit weights, in encoding order, padded
+# with zero weights.
+#
+def encodeBoneMappings(boneMappings):
+	#
+	# Loops of the same vertex usually share their bone mapping object, so
+	# each distinct object is only encoded once.
+	#
+	mappingIDs = {}
+	uniqueMappings = []
+	vertexMappingIDs = []
+	for boneMapping in boneMappings:
+		key = id(boneMapping)
+		if key not in mappingIDs:
+			mappingIDs[key] = len(uniqueMappings)
+			uniqueMappings.append(boneMapping)
+		vertexMappingIDs.append(mappingIDs[key])
+	
+	boneIDs = {}
+	flatBoneIDs = [boneIDs.setdefault(bone, len(boneIDs)) for bone in itertools.chain.from_iterable(boneMapping.keys() for boneMapping in uniqueMappings)]
+	bones = [None for bone in boneIDs]
+	for (bone, boneID) in boneIDs.items():
+		bones[boneID] = bone
+	
+	counts = [len(boneMapping) for boneMapping in uniqueMappings]
+	width = max([4] + counts)
+	(mappingBoneIDs, mappingWeights) = influenceArrays(
+		counts,
+		flatBoneIDs,
+		list(itertools.chain.from_iterable(boneMapping.values() for boneMapping in uniqueMappings)),
+		width,
+		numpy.int64,
+		numpy.float64,
+	)
+	
+	#
+	# Order the bones of each vertex by decreasing weight, then decreasing
+	# bone name, keeping ties in mapping order, like the sort in
+	# encodeBoneMapping().
+	#
+	nameRanks = {}
+	for name in sorted(set(bone.name for bone in bones)):
+		nameRanks[name] = len(nameRanks)
+	boneNameRanks = [nameRanks[bone.name] for bone in bones]
+	(orderedBoneIDs, orderedWeights) = selectBoneWeights(mappingBoneIDs, mappingWeights, width, boneNameRanks, counts)
+	
+	(encodedBoneIDs, encodedWeights) = quantizeBoneWeights(orderedBoneIDs, orderedWeights, counts)
+	vertexMappingIDs = numpy.array(vertexMappingIDs, dtype = numpy.int64)
+	return (bones, encodedBoneIDs[vertexMappingIDs], encodedWeights[vertexMappingIDs])
+
+
+
+#
+# Bone influence arrays.
+#
+# Vertex.boneMapping is a dict from bone to weight, and
+# VertexEncoding.boneMapping a list of (bone, 8-bit weight) pairs, per vertex.
+# For operations on the bone influences of a whole mesh, the functions below
+# hold them in a pair of fixed-width arrays instead: an N x K array of bone
+# indices, into a bone group or another list of bones, and an N x K array of
+# weights. Entries with weight 0 are unused; their bone index is meaningless.
+#
+
+def boneIndexDtype(boneCount):
+	if boneCount <= 1 << 8:
+		return numpy.uint8
+	return numpy.uint16
+
+#
+# Fill N x width arrays with the (bone index, weight) pairs of N rows, in row
+# order, leaving unused entries 0.
+#
+def influenceArrays(rowCounts, flatBoneIndices, flatWeights, width, indexDtype, weightDtype):
+	rowCount = len(rowCounts)
+	counts = numpy.array(rowCounts, dtype = numpy.int64)
+	boneIndices = numpy.zeros((rowCount, width), dtype = indexDtype)
+	boneWeights = numpy.zeros((rowCount, width), dtype = weightDtype)
+	if len(flatBoneIndices) > 0:
+		rows = numpy.repeat(numpy.arange(rowCount), counts)
+		slots = numpy.arange(len(rows)) - (numpy.cumsum(counts) - counts)[rows]
+		boneIndices[rows, slots] = flatBoneIndices
+		boneWeights[rows, slots] = flatWeights
+	return (boneIndices, boneWeights)
+
+#
+# Scale the weights of each row so that they add up to 1. Rows without any
+# weight are left at 0.
+#
+def normalizeBoneWeights(boneWeights):
+	boneWeights = numpy.asarray(boneWeights, dtype = numpy.float64)
+	totals = boneWeights.sum(axis = 1, keepdims = True)
+	return numpy.divide(boneWeights, totals, out = numpy.zeros(boneWeights.shape), where = totals > 0)
+
+#
+# Order the entries of each row by decreasing weight, then by decreasing
+# boneRanks[bone index] if boneRanks is given, keeping ties in column order,
+# and keep the first count of them. If rowCounts is given, only the first
+# rowCounts[i] entries of row i are in use, and the others order last.
+# Returns N x count arrays.
+#
+def selectBoneWeights(boneIndices, boneWeights, count = 4, boneRanks = None, rowCounts = None):
+	boneIndices = numpy.asarray(boneIndices)
+	boneWeights = numpy.asarray(boneWeights)
+	keys = [-boneWeights.astype(numpy.float64)]
+	if boneRanks is not None:
+		keys.insert(0, -numpy.asarray(boneRanks, dtype = numpy.int64)[boneIndices])
+	if rowCounts is not None:
+		keys.append(numpy.arange(boneWeights.shape[1])[None, :] >= numpy.asarray(rowCounts, dtype = numpy.int64)[:, None])
+	order = numpy.lexsort(keys, axis = 1)[:, :count]
+	rows = numpy.arange(len(boneWeights))[:, None]
+	selectedIndices = numpy.zeros((len(boneWeights), count), dtype = boneIndices.dtype)
+	selectedWeights = numpy.zeros((len(boneWeights), count), dtype = boneWeights.dtype)
+	selectedIndices[:, :order.shape[1]] = boneIndices[rows, order]
+	selectedWeights[:, :order.shape[1]] = boneWeights[rows, order]
+	return (selectedIndices, selectedWeights)
+
+#
+# Round bone weights to the 8-bit weights stored in fmdl files, like
+# FmdlFile.encodeBoneMapping(). boneIndices and boneWeights are N x K arrays
+# holding the rowCounts[i] bones of each row i ordered by decreasing weight,
+# as returned by selectBoneWeights(). The first 4 bones of each row are kept,
+# and their weights are rounded such that together they preserve the total
+# weight of all bones of the row up to a single rounding error. Returns N x 4
+# bone index and uint8 weight arrays, with the nonzero weights first.
+#
+def quantizeBoneWeights(boneIndices, boneWeights, rowCounts):
+	rowCount = len(boneWeights)
+	width = max(boneWeights.shape[1], 4)
+	orderedWeights = numpy.zeros((rowCount, width), dtype = numpy.float64)
+	orderedIndices = numpy.zeros((rowCount, width), dtype = boneIndices.dtype)
+	orderedWeights[:, :boneWeights.shape[1]] = boneWeights
+	orderedIndices[:, :boneIndices.shape[1]] = boneIndices
+	counts = numpy.asarray(rowCounts, dtype = numpy.int64)
+	
+	#
+	# Sums are accumulated one column at a time, so that they add up the
+	# weights in the same order, and therefore to the same value, as
+	# encodeBoneMapping() does.
+	#
+	totalWeight = numpy.zeros(rowCount, dtype = numpy.float64)
+	selectedWeight = numpy.zeros(rowCount, dtype = numpy.float64)
+	for i in range(width):
+		totalWeight = totalWeight + orderedWeights[:, i]
+		if i < 4:
+			selectedWeight = selectedWeight + orderedWeights[:, i]
+	selectedCount = numpy.minimum(counts, 4)
+	
+	remainingIntegralWeight = numpy.trunc(totalWeight * 255 + 0.5)
+	remainingSelectedWeight = selectedWeight
+	encodedWeights = numpy.zeros((rowCount, 4), dtype = numpy.float64)
+	for i in range(4):
+		weight = orderedWeights[:, i]
+		isLast = selectedCount == i + 1
+		isDivided = (selectedCount > i + 1) & ~(remainingSelectedWeight <= 0)
+		
+		encodedWeights[isLast, i] = numpy.clip(remainingIntegralWeight[isLast], 0, 255)
+		
+		dividedWeight = numpy.trunc((weight[isDivided] / remainingSelectedWeight[isDivided]) * remainingIntegralWeight[isDivided] + 0.5)
+		dividedWeight = numpy.clip(dividedWeight, 0, 255)
+		encodedWeights[isDivided, i] = dividedWeight
+		remainingIntegralWeight[isDivided] -= dividedWeight
+		remainingSelectedWeight[isDivided] -= weight[isDivided]
+	
+	return compactBoneMappings(orderedIndices[:, :4], encodedWeights.astype(numpy.uint8))
+
+#
+# Translate bone indices into sourceBones into indices of the same bones in
+# another bone group, given as a map from bone to index. Every bone with a
+# nonzero weight must be in the target bone group.
+#
+def remapBoneIndices(boneIndices, boneWeights, sourceBones, targetBoneGroupIndices):
+	used = boneWeights > 0
+	targetIndices = numpy.zeros(max(len(sourceBones), 1), dtype = boneIndexDtype(len(targetBoneGroupIndices)))
+	for boneIndex in numpy.unique(boneIndices[used]).tolist():
+		bone = sourceBones[boneIndex]
+		if bone not in targetBoneGroupIndices:
+			raise ValueError("Bone '%s' not in target bone group" % bone.name)
+		targetIndices[boneIndex] = targetBoneGroupIndices[bone]
+	return numpy.where(used, targetIndices[boneIndices], 0).astype(targetIndices.dtype)
+
+#
+# The bone influences of the vertices of a mesh, as they are stored in the
+# vertex buffer: N x 4 arrays of indices into bones, and of 8-bit weights, with
+# the nonzero weights of each vertex first, in the order of its
+# VertexEncoding.boneMapping.
+#
+class BoneInfluences:
+	def __init__(self, bones, boneIndices, boneWeights):
+		self.bones = bones
+		self.boneIndices = boneIndices
+		self.boneWeights = boneWeights
+	
+	def select(self, rows):
+		rows = numpy.asarray(rows, dtype = numpy.int64)
+		return BoneInfluences(self.bones, self.boneIndices[rows], self.boneWeights[rows])
+	
+	#
+	# The same bone influences, as indices into $bones.
+	#
+	def remap(self, bones):
+		boneGroupIndices = {}
+		for i in range(len(bones)):
+			boneGroupIndices[bones[i]] = i
+		return BoneInfluences(bones, remapBoneIndices(self.boneIndices, self.boneWeights, self.bones, boneGroupIndices), self.boneWeights)
+	
+	#
+	# The VertexEncoding.boneMapping of each vertex. Vertices with the same
+	# bone influences get lists of the same tuples.
+	#
+	def encodedBoneMappings(self):
+		(mappingIDs, mappingCount) = groupRows(numpy.concatenate((self.boneIndices, self.boneWeights.astype(self.boneIndices.dtype)), axis = 1))
+		mappings = [None] * mappingCount
+		for (mappingID, boneIndices, boneWeights) in zip(mappingIDs.tolist(), self.boneIndices.tolist(), self.boneWeights.tolist()):
+			if mappings[mappingID] is None:
+				mappings[mappingID] = [(self.bones[boneIndex], weight) for (boneIndex, weight) in zip(boneIndices, boneWeights) if weight > 0]
+		return [list(mappings[mappingID]) for mappingID in mappingIDs.tolist()]
+
+#
+# The BoneInfluences of a FmdlFile.Mesh, indexing mesh.boneGroup.bones. They
+# are kept in mesh.boneInfluences, and computed from the vertex encoding or
+# the vertices of the mesh if they are not there yet.
+#
+def meshBoneArrays(mesh):
+	bones = mesh.boneGroup.bones
+	boneInfluences = mesh.boneInfluences
+	if boneInfluences is None:
+		boneGroupIndices = {}
+		for i in range(len(bones)):
+			boneGroupIndices[bones[i]] = i
+		if mesh.vertexEncoding is not None:
+			(boneIndices, boneWeights) = encodedBoneArrays([encodedVertex.boneMapping for encodedVertex in mesh.vertexEncoding], boneGroupIndices)
+		else:
+			(encodedBones, boneIDs, boneWeights) = encodeBoneMappings([vertex.boneMapping for vertex in mesh.vertices])
+			boneIndices = remapBoneIndices(boneIDs, boneWeights, encodedBones, boneGroupIndices)
+		boneInfluences = BoneInfluences(bones, boneIndices, boneWeights)
+	elif boneInfluences.bones != bones:
+		boneInfluences = boneInfluences.remap(bones)
+	mesh.boneInfluences = boneInfluences
+	return boneInfluences
+
+#
+# The bone influences of a list of VertexEncoding.boneMapping lists, as N x 4
+# bone index and uint8 weight arrays, as stored in the vertex buffer.
+# boneGroupIndices maps each bone to its index.
+#
+def encodedBoneArrays(encodedBoneMappings, boneGroupIndices):
+	counts = [len(boneMapping) for boneMapping in encodedBoneMappings]
+	if len(counts) > 0 and max(counts) > 4:
+		raise ValueError("Encoded bone mapping with more than 4 bones")
+	pairs = list(itertools.chain.from_iterable(encodedBoneMappings))
+	return influenceArrays(
+		counts,
+		[boneGroupIndices[bone] for (bone, weight) in pairs],
+		[weight for (bone, weight) in pairs],
+		4,
+		boneIndexDtype(len(boneGroupIndices)),
+		numpy.uint8,
+	)
+
+#
+# The sorted distinct bone indices with a nonzero weight.
+#
+def usedBoneIndices(boneIndices, boneWeights):
+	return numpy.unique(numpy.asarray(boneIndices)[numpy.asarray(boneWeights) > 0])
+
+#
+# Group the bone influences by bone and weight. Returns a list of
+# (bone index, weight, row indices) triples, ordered by bone index and weight,
+# covering every entry with a nonzero weight.
+#
+def groupBoneInfluences(boneIndices, boneWeights):
+	(rows, columns) = numpy.nonzero(numpy.asarray(boneWeights) > 0)
+	flatBoneIndices = numpy.asarray(boneIndices)[rows, columns]
+	flatWeights = numpy.asarray(boneWeights)[rows, columns]
+	order = numpy.lexsort((rows, flatWeights, flatBoneIndices))
+	rows = rows[order]
+	flatBoneIndices = flatBoneIndices[order]
+	flatWeights = flatWeights[order]
+	
+	boundaries = numpy.flatnonzero((flatBoneIndices[1:] != flatBoneIndices[:-1]) | (flatWeights[1:] != flatWeights[:-1])) + 1
+	starts = [0] + boundaries.tolist()
+	ends = boundaries.tolist() + [len(rows)]
+	if len(rows) == 0:
+		return []
+	return [
+		(int(flatBoneIndices[start]), flatWeights[start].item(), rows[start : end].tolist())
+		for (start, end) in zip(starts, ends)
+	]
+
+#
+# Build an N x width float64 array from N rows of width numbers each. Much
+# faster than numpy.array() on a list of tuples.
+#
+def rowArray(rows, rowCount, width):
+	return numpy.fromiter(itertools.chain.from_iterable(rows), numpy.float64, rowCount * width).reshape((rowCount, width))
+
+#
+# Encode all vertex data except bone mappings of a list of vertices, as
+# FmdlFile.encodeVertices() would. Returns a map from datum type to an
+# N x (datum size) uint8 array of the encoded data of each vertex.
+#
+def encodeVertexData(vertices, vertexFields):
+	output = {}
+	vertexCount = len(vertices)
+	
+	positions = rowArray([
+		(vertex.position.x, vertex.position.y, vertex.position.z) for vertex in vertices
+	], vertexCount, 3)
+	output[FmdlFile.FmdlFile.FmdlVertexDatumType.position] = positions.astype('<f4')
+	
+	if vertexFields.hasNormal:
+		normals = rowArray((vertex.normal for vertex in vertices), vertexCount, 4)
+		output[FmdlFile.FmdlFile.FmdlVertexDatumType.normal] = FmdlFloat16.encode(normals).astype('<u2')
+	
+	if vertexFields.hasTangent:
+		tangents = rowArray((vertex.tangent for vertex in vertices), vertexCount, 4)
+		output[FmdlFile.FmdlFile.FmdlVertexDatumType.tangent] = FmdlFloat16.encode(tangents).astype('<u2')
+	
+	if vertexFields.hasColor:
+		colors = numpy.trunc(rowArray((vertex.color for vertex in vertices), vertexCount, 4) * 255 + 0.5)
+		if vertexCount > 0 and (colors.min() < 0 or colors.max() > 255):
+			raise FmdlFile.InvalidFmdl("Vertex color out of range")
+		output[FmdlFile.FmdlFile.FmdlVertexDatumType.color] = colors.astype(numpy.uint8)
+	
+	for i in range(min(vertexFields.uvCount, 4)):
+		uvs = rowArray((vertex.uv[i] for vertex in vertices), vertexCount, 2)
+		if vertexFields.highPrecisionUv:
+			output[UV_DATUM_TYPES[i]] = uvs.astype('<f4')
+		else:
+			output[UV_DATUM_TYPES[i]] = FmdlFloat16.encode(uvs).astype('<u2')
+	
+	for datumType in output:
+		values = numpy.ascontiguousarray(output[datumType])
+		output[datumType] = values.view(numpy.uint8).reshape((len(values), -1))
+	return output
+
+#
+# Collect the vertex data of a list of FmdlFile.VertexEncoding objects, in the
+# format returned by encodeVertexData().
+#
+def encodedVertexData(encodedVertices, vertexFields):
+	def joinEncodings(encodings):
+		return numpy.frombuffer(b''.join(encodings), dtype = numpy.uint8).reshape((len(encodedVertices), -1))
+	
+	output = {}
+	output[FmdlFile.FmdlFile.FmdlVertexDatumType.position] = joinEncodings([encodedVertex.position for encodedVertex in encodedVertices])
+	if vertexFields.hasNormal:
+		output[FmdlFile.FmdlFile.FmdlVertexDatumType.normal] = joinEncodings([encodedVertex.normal for encodedVertex in encodedVertices])
+	if vertexFields.hasTangent:
+		output[FmdlFile.FmdlFile.FmdlVertexDatumType.tangent] = joinEncodings([encodedVertex.tangent for encodedVertex in encodedVertices])
+	if vertexFields.hasColor:
+		output[FmdlFile.FmdlFile.FmdlVertexDatumType.color] = joinEncodings([encodedVertex.color for encodedVertex in encodedVertices])
+	for i in range(min(vertexFields.uvCount, 4)):
+		output[UV_DATUM_TYPES[i]] = joinEncodings([encodedVertex.uv[i] for encodedVertex in encodedVertices])
+	
+	return output
+
+#
+# Build FmdlFile.VertexEncoding objects for a list of vertices, identical to
+# the ones FmdlFile.encodeVertices() would construct. If the BoneInfluences of
+# the vertices are known, their bone mappings are taken from those instead of
+# being encoded again.
+#
+def encodeVertices(vertices, vertexFields, boneInfluences = None):
+	data = encodeVertexData(vertices, vertexFields)
+	encodings = {}
+	for datumType in data:
+		values = data[datumType]
+		encodings[datumType] = values.view(numpy.dtype('V%d' % values.shape[1])).reshape((-1, )).tolist()
+	
+	vertexEncodings = [FmdlFile.FmdlFile.VertexEncoding() for vertex in vertices]
+	for (vertex, vertexEncoding, position) in zip(vertices, vertexEncodings, encodings[FmdlFile.FmdlFile.FmdlVertexDatumType.position]):
+		vertexEncoding.vertex = vertex
+		vertexEncoding.position = position
+	if vertexFields.hasNormal:
+		for (vertexEncoding, normal) in zip(vertexEncodings, encodings[FmdlFile.FmdlFile.FmdlVertexDatumType.normal]):
+			vertexEncoding.normal = normal
+	if vertexFields.hasTangent:
+		for (vertexEncoding, tangent) in zip(vertexEncodings, encodings[FmdlFile.FmdlFile.FmdlVertexDatumType.tangent]):
+			vertexEncoding.tangent = tangent
+	if vertexFields.hasColor:
+		for (vertexEncoding, color) in zip(vertexEncodings, encodings[FmdlFile.FmdlFile.FmdlVertexDatumType.color]):
+			vertexEncoding.color = color
+	for i in range(min(vertexFields.uvCount, 4)):
+		for (vertexEncoding, uv) in zip(vertexEncodings, encodings[UV_DATUM_TYPES[i]]):
+			vertexEncoding.uv.append(uv)
+	
+	if vertexFields.hasBoneMapping and boneInfluences is not None:
+		for (vertexEncoding, boneMapping) in zip(vertexEncodings, boneInfluences.encodedBoneMappings()):
+			vertexEncoding.boneMapping = boneMapping
+	elif vertexFields.hasBoneMapping:
+		(bones, boneIDs, boneWeights) = encodeBoneMappings([vertex.boneMapping for vertex in vertices])
+		for (vertexEncoding, vertexBoneIDs, vertexBoneWeights) in zip(vertexEncodings, boneIDs.tolist(), boneWeights.tolist()):
+			vertexEncoding.boneMapping = [
+				(bones[boneID], weight) for (boneID, weight) in zip(vertexBoneIDs, vertexBoneWeights) if weight > 0
+			]
+	
+	return vertexEncodings
+
+#
+# Write encoded vertex data, as returned by encodeVertexData(), into the vertex
+# position and vertex data buffers of an fmdl file, interleaved according to
+# formatEntries as returned by FmdlFile.addMeshFormatAssignment().
+#
+def writeVertexData(data, vertexCount, formatEntries, positionBufferEntrySize, dataBufferEntrySize, buffer, positionBufferOffset, dataBufferOffset):
+	if vertexCount == 0:
+		return
+	
+	entrySizes = [positionBufferEntrySize, dataBufferEntrySize]
+	bufferOffsets = [positionBufferOffset, dataBufferOffset]
+	for bufferID in range(2):
+		entries = [(datumType, datumFormat, offset) for (entryBufferID, datumType, datumFormat, offset) in formatEntries if entryBufferID == bufferID]
+		if len(entries) == 0:
+			continue
+		
+		dtype = numpy.dtype({
+			'names': ['datum%d' % datumType for (datumType, datumFormat, offset) in entries],
+			'formats': [('u1', datumDtype(datumType, datumFormat).itemsize) for (datumType, datumFormat, offset) in entries],
+			'offsets': [offset for (datumType, datumFormat, offset) in entries],
+			'itemsize': entrySizes[bufferID],
+		})
+		vertexBuffer = numpy.ndarray((vertexCount, ), dtype, buffer, bufferOffsets[bufferID])
+		for (datumType, datumFormat, offset) in entries:
+			vertexBuffer['datum%d' % datumType] = data[datumType]
+
+#
+# Encode the vertices and faces of a mesh, a FmdlFile.Mesh or a MeshArrays,
+# straight into the buffers of an fmdl file being written. Produces the same
+# bytes as FmdlFile.addVertices() and FmdlFile.addFaces() on the output of
+# FmdlFile.encodeVertices().
+#
+def addMesh(mesh, formatEntries, positionBufferEntrySize, dataBufferEntrySize, boneGroupIndices, buffer, positionBufferOffset, dataBufferOffset, faceBufferOffset):
+	if isinstance(mesh, MeshArrays):
+		vertices = None
+		data = mesh.vertexData()
+	elif mesh.vertexEncoding == None:
+		vertices = mesh.vertices
+		data = encodeVertexData(vertices, mesh.vertexFields)
+	else:
+		vertices = [encodedVertex.vertex for encodedVertex in mesh.vertexEncoding]
+		data = encodedVertexData(mesh.vertexEncoding, mesh.vertexFields)
+	if mesh.vertexFields.hasBoneMapping:
+		boneInfluences = meshBoneArrays(mesh)
+		data[FmdlFile.FmdlFile.FmdlVertexDatumType.boneIndices] = remapBoneIndices(boneInfluences.boneIndices, boneInfluences.boneWeights, boneInfluences.bones, boneGroupIndices).astype(numpy.uint8)
+		data[FmdlFile.FmdlFile.FmdlVertexDatumType.boneWeights] = boneInfluences.boneWeights
+	
+	writeVertexData(data, mesh.vertexCount(), formatEntries, positionBufferEntrySize, dataBufferEntrySize, buffer, positionBufferOffset, dataBufferOffset)
+	
+	if vertices is None:
+		faces = mesh.faceIndices
+	else:
+		faces = meshFaceIndices(mesh, vertices)
+	if len(faces) == 0:
+		return
+	if int(faces.max()) > 0xffff:
+		raise FmdlFile.InvalidFmdl("Too many vertices in mesh")
+	numpy.ndarray(faces.shape, numpy.dtype('<u2'), buffer, faceBufferOffset)[...] = faces
+
+#
+# The faces of a FmdlFile.Mesh as an F x 3 array of indices into $vertices.
+#
+def meshFaceIndices(mesh, vertices):
+	if mesh.faceIndices is not None:
+		return numpy.asarray(mesh.faceIndices).reshape((-1, 3))
+	vertexIndices = {}
+	for i in range(len(vertices)):
+		vertexIndices[vertices[i]] = i
+	return numpy.array([
+		(vertexIndices[face.vertices[0]], vertexIndices[face.vertices[1]], vertexIndices[face.vertices[2]]) for face in mesh.faces
+	], dtype = numpy.int64).reshape((-1, 3))
+
+
+
+#
+# A read-only sequence of objects that are constructed on first access, and
+# then kept, so that every access to the same index yields the same object.
+# Used to hand out FmdlFile objects for array-backed data to code that expects
+# lists of them.
+#
+class LazyList:
+	def __init__(self, length, build):
+		self.items = [None] * length
+		self.build = build
+	
+	def __len__(self):
+		return len(self.items)
+	
+	def __getitem__(self, index):
+		if isinstance(index, slice):
+			return [self[i] for i in range(*index.indices(len(self.items)))]
+		if index < 0:
+			index += len(self.items)
+		item = self.items[index]
+		if item is None:
+			item = self.build(index)
+			self.items[index] = item
+		return item
+	
+	def __iter__(self):
+		for i in range(len(self.items)):
+			yield self[i]
+	
+	def copy(self):
+		return list(self)
+
+
+
+#
+# Structure-of-arrays counterpart of FmdlFile.Mesh.
+#
+# Where FmdlFile.Mesh holds a Vertex object per vertex, MeshArrays holds each
+# vertex datum of all vertices of the mesh in a single array:
+# - positions: N x 3 floats; float32 as stored in fmdl files for parsed
+#   meshes, or the float64 positions of the vertices of a converted
+#   FmdlFile.Mesh
+# - normals, tangents: N x 4 float16, or None
+# - colors: N x 4 uint8, or None
+# - uvs: a list of N x 2 arrays, one per uv map; float32 if
+#   vertexFields.highPrecisionUv is set, float16 otherwise
+# - boneInfluences: the BoneInfluences of the vertices, indexing
+#   boneGroup.bones, or None
+# - faceIndices: F x 3 vertex indices
+# Apart from positions, all data is held in the precision it is stored in in
+# fmdl files, so that it is written back exactly as it was read.
+#
+# In a FmdlFile.Mesh, several vertices can share their position object, which
+# marks them as loops of the same vertex. positionIDs records this: vertices
+# with the same position ID share a position. If positionIDs is None, all
+# vertices have distinct positions.
+#
+# FmdlFile.readFile(arrays = True) reads meshes as MeshArrays, and
+# FmdlFile.writeFile(), FmdlSplitVertexEncoding.encodeFmdlVertexLoopPreservation()
+# and FmdlMeshSplitting.encodeFmdlSplitMeshes() process them as arrays. For
+# other code, vertices, faces and vertexEncoding hand out the objects a
+# FmdlFile.Mesh would hold, constructed on first access. These are a read-only
+# view: the arrays are not updated when they are edited.
+#
+class MeshArrays:
+	def __init__(self):
+		self.boneGroup = None
+		self.materialInstance = None
+		self.alphaFlags = None
+		self.shadowFlags = None
+		self.vertexFields = None
+		self.extensionHeaders = set()
+		
+		self.positions = None
+		self.positionIDs = None
+		self.normals = None
+		self.tangents = None
+		self.colors = None
+		self.uvs = []
+		self.boneInfluences = None
+		self.faceIndices = None
+		self.objectLists = None
+	
+	def vertexCount(self):
+		return len(self.positions)
+	
+	def faceCount(self):
+		return len(self.faceIndices)
+	
+	def copyMeshProperties(self, mesh):
+		self.boneGroup = mesh.boneGroup
+		self.materialInstance = mesh.materialInstance
+		self.alphaFlags = mesh.alphaFlags
+		self.shadowFlags = mesh.shadowFlags
+		self.vertexFields = mesh.vertexFields
+		self.extensionHeaders = mesh.extensionHeaders.copy()
+	
+	#
+	# Build a MeshArrays from the vertex and face buffers of a mesh in an fmdl
+	# file. Mirrors parseVertices() and parseFaces(). The arrays are copies;
+	# they do not refer to vertexBuffer.
+	#
+	@staticmethod
+	def parse(vertexBuffer, format, boneGroup, vertexCount, vertexBufferOffset, firstFaceVertexIndex, faceVertexCount):
+		data = decodeVertexData(vertexBuffer, format, vertexCount)
+		
+		meshArrays = MeshArrays()
+		meshArrays.boneGroup = boneGroup
+		
+		if FmdlFile.FmdlFile.FmdlVertexDatumType.position not in data:
+			raise FmdlFile.InvalidFmdl("Vertex format without position data")
+		meshArrays.positions = numpy.array(data[FmdlFile.FmdlFile.FmdlVertexDatumType.position][0], dtype = numpy.float32)
+		
+		if FmdlFile.FmdlFile.FmdlVertexDatumType.normal in data:
+			meshArrays.normals = numpy.array(data[FmdlFile.FmdlFile.FmdlVertexDatumType.normal][0], dtype = '<u2').view('<f2')
+		if FmdlFile.FmdlFile.FmdlVertexDatumType.tangent in data:
+			meshArrays.tangents = numpy.array(data[FmdlFile.FmdlFile.FmdlVertexDatumType.tangent][0], dtype = '<u2').view('<f2')
+		if FmdlFile.FmdlFile.FmdlVertexDatumType.color in data:
+			meshArrays.colors = numpy.array(data[FmdlFile.FmdlFile.FmdlVertexDatumType.color][0], dtype = numpy.uint8)
+		for datumType in UV_DATUM_TYPES:
+			if datumType in data:
+				values = data[datumType][0]
+				if values.dtype == numpy.dtype('<u2'):
+					meshArrays.uvs.append(numpy.array(values, dtype = '<u2').view('<f2'))
+				else:
+					meshArrays.uvs.append(numpy.array(values, dtype = numpy.float32))
+		
+		if FmdlFile.FmdlFile.FmdlVertexDatumType.boneWeights in data and FmdlFile.FmdlFile.FmdlVertexDatumType.boneIndices in data:
+			boneWeights = numpy.array(data[FmdlFile.FmdlFile.FmdlVertexDatumType.boneWeights][0], dtype = numpy.uint8)
+			boneIndices = numpy.array(data[FmdlFile.FmdlFile.FmdlVertexDatumType.boneIndices][0], dtype = numpy.uint8)
+			#
+			# Bone indices outside the bone group happen a fair few times in
+			# real models. Ignore those bone weightings, like parseVertices().
+			#
+			boneWeights[boneIndices >= len(boneGroup.bones)] = 0
+			meshArrays.boneInfluences = BoneInfluences(boneGroup.bones, *compactBoneMappings(boneIndices, boneWeights))
+		
+		meshArrays.faceIndices = parseFaces(vertexBuffer, vertexBufferOffset, firstFaceVertexIndex, faceVertexCount, vertexCount)
+		return meshArrays
+	
+	#
+	# Build a MeshArrays holding the data of a FmdlFile.Mesh, as it would be
+	# written to an fmdl file.
+	#
+	@staticmethod
+	def fromMesh(mesh):
+		meshArrays = MeshArrays()
+		meshArrays.copyMeshProperties(mesh)
+		
+		if mesh.vertexEncoding is None:
+			vertices = mesh.vertices
+			data = encodeVertexData(vertices, mesh.vertexFields)
+		else:
+			vertices = [encodedVertex.vertex for encodedVertex in mesh.vertexEncoding]
+			data = encodedVertexData(mesh.vertexEncoding, mesh.vertexFields)
+		meshArrays.setVertexData(data)
+		
+		meshArrays.positions = rowArray([
+			(vertex.position.x, vertex.position.y, vertex.position.z) for vertex in vertices
+		], len(vertices), 3)
+		positionIDs = {}
+		meshArrays.positionIDs = numpy.array([
+			positionIDs.setdefault(vertex.position, len(positionIDs)) for vertex in vertices
+		], dtype = numpy.uint32)
+		
+		if mesh.vertexFields.hasBoneMapping:
+			meshArrays.boneInfluences = meshBoneArrays(mesh)
+		meshArrays.faceIndices = meshFaceIndices(mesh, vertices)
+		return meshArrays
+	
+	#
+	# Set the vertex data from encoded vertex data, in the format returned by
+	# encodeVertexData().
+	#
+	def setVertexData(self, data):
+		vertexFields = self.vertexFields
+		self.positions = numpy.array(data[FmdlFile.FmdlFile.FmdlVertexDatumType.position]).view('<f4')
+		if vertexFields.hasNormal:
+			self.normals = numpy.array(data[FmdlFile.FmdlFile.FmdlVertexDatumType.normal]).view('<f2')
+		if vertexFields.hasTangent:
+			self.tangents = numpy.array(data[FmdlFile.FmdlFile.FmdlVertexDatumType.tangent]).view('<f2')
+		if vertexFields.hasColor:
+			self.colors = numpy.array(data[FmdlFile.FmdlFile.FmdlVertexDatumType.color])
+		self.uvs = []
+		for i in range(min(vertexFields.uvCount, 4)):
+			self.uvs.append(numpy.array(data[UV_DATUM_TYPES[i]]).view('<f4' if vertexFields.highPrecisionUv else '<f2'))
+	
+	#
+	# Encode all vertex data except bone mappings, in the format returned by
+	# encodeVertexData().
+	#
+	def vertexData(self):
+		vertexFields = self.vertexFields
+		output = {}
+		output[FmdlFile.FmdlFile.FmdlVertexDatumType.position] = self.positions.astype('<f4')
+		if vertexFields.hasNormal:
+			output[FmdlFile.FmdlFile.FmdlVertexDatumType.normal] = self.normals.astype('<f2')
+		if vertexFields.hasTangent:
+			output[FmdlFile.FmdlFile.FmdlVertexDatumType.tangent] = self.tangents.astype('<f2')
+		if vertexFields.hasColor:
+			output[FmdlFile.FmdlFile.FmdlVertexDatumType.color] = self.colors.astype(numpy.uint8)
+		for i in range(min(vertexFields.uvCount, 4)):
+			output[UV_DATUM_TYPES[i]] = self.uvs[i].astype('<f4' if vertexFields.highPrecisionUv else '<f2')
+		
+		for datumType in output:
+			values = numpy.ascontiguousarray(output[datumType])
+			output[datumType] = values.view(numpy.uint8).reshape((len(values), -1))
+		return output
+	
+	#
+	# A MeshArrays holding the vertices $rows of this mesh, in that order, and
+	# the faces $faceIndices, which index $rows.
+	#
+	def select(self, rows, faceIndices):
+		rows = numpy.asarray(rows, dtype = numpy.int64)
+		output = MeshArrays()
+		output.copyMeshProperties(self)
+		output.positions = self.positions[rows]
+		if self.positionIDs is not None:
+			output.positionIDs = self.positionIDs[rows]
+		if self.normals is not None:
+			output.normals = self.normals[rows]
+		if self.tangents is not None:
+			output.tangents = self.tangents[rows]
+		if self.colors is not None:
+			output.colors = self.colors[rows]
+		output.uvs = [uv[rows] for uv in self.uvs]
+		if self.boneInfluences is not None:
+			output.boneInfluences = self.boneInfluences.select(rows)
+		output.faceIndices = faceIndices
+		return output
+	
+	@property
+	def vertices(self):
+		return self.buildObjectLists()[0]
+	
+	@property
+	def vertexEncoding(self):
+		return self.buildObjectLists()[1]
+	
+	@property
+	def faces(self):
+		return self.buildObjectLists()[2]
+	
+	#
+	# The Vertex, VertexEncoding and Face objects of the mesh, as LazyLists.
+	# Vertices with the same position ID share a position object, and
+	# vertices with the same bone influences a bone mapping.
+	#
+	def buildObjectLists(self):
+		if self.objectLists is not None:
+			return self.objectLists
+		
+		Vector2 = FmdlFile.FmdlFile.Vector2
+		Vector3 = FmdlFile.FmdlFile.Vector3
+		Vector4 = FmdlFile.FmdlFile.Vector4
+		
+		boneMappings = []
+		def boneMapping(index):
+			if len(boneMappings) == 0:
+				(mappingIDs, mappingCount) = groupRows(numpy.concatenate((
+					self.boneInfluences.boneIndices,
+					self.boneInfluences.boneWeights.astype(self.boneInfluences.boneIndices.dtype),
+				), axis = 1))
+				boneMappings.append(mappingIDs)
+				boneMappings.append([None] * mappingCount)
+			mappingID = int(boneMappings[0][index])
+			if boneMappings[1][mappingID] is None:
+				boneMappingEncoding = tuple(
+					(self.boneInfluences.bones[boneIndex], weight)
+					for (boneIndex, weight) in zip(self.boneInfluences.boneIndices[index].tolist(), self.boneInfluences.boneWeights[index].tolist())
+					if weight > 0
+				)
+				boneMappings[1][mappingID] = (
+					FmdlFile.FmdlFile.BoneMapping((bone, weight / 255.0) for (bone, weight) in boneMappingEncoding),
+					boneMappingEncoding,
+				)
+			return boneMappings[1][mappingID]
+		
+		positions = {}
+		def buildVertex(index):
+			vertex = FmdlFile.FmdlFile.Vertex()
+			positionID = index if self.positionIDs is None else int(self.positionIDs[index])
+			if positionID not in positions:
+				positions[positionID] = Vector3(*self.positions[index].tolist())
+			vertex.position = positions[positionID]
+			if self.normals is not None:
+				vertex.normal = Vector4(*self.normals[index].tolist())
+			if self.tangents is not None:
+				vertex.tangent = Vector4(*self.tangents[index].tolist())
+			if self.colors is not None:
+				vertex.color = (self.colors[index] / 255.0).tolist()
+			for uv in self.uvs:
+				vertex.uv.append(Vector2(*uv[index].tolist()))
+			if self.boneInfluences is not None:
+				vertex.boneMapping = boneMapping(index)[0]
+			return vertex
+		vertices = LazyList(self.vertexCount(), buildVertex)
+		
+		data = {}
+		def buildVertexEncoding(index):
+			if len(data) == 0:
+				data.update(self.vertexData())
+			vertexEncoding = FmdlFile.FmdlFile.VertexEncoding()
+			vertexEncoding.vertex = vertices[index]
+			vertexEncoding.position = data[FmdlFile.FmdlFile.FmdlVertexDatumType.position][index].tobytes()
+			if self.vertexFields.hasNormal:
+				vertexEncoding.normal = data[FmdlFile.FmdlFile.FmdlVertexDatumType.normal][index].tobytes()
+			if self.vertexFields.hasTangent:
+				vertexEncoding.tangent = data[FmdlFile.FmdlFile.FmdlVertexDatumType.tangent][index].tobytes()
+			if self.vertexFields.hasColor:
+				vertexEncoding.color = data[FmdlFile.FmdlFile.FmdlVertexDatumType.color][index].tobytes()
+			for i in range(min(self.vertexFields.uvCount, 4)):
+				vertexEncoding.uv.append(data[UV_DATUM_TYPES[i]][index].tobytes())
+			if self.boneInfluences is not None:
+				vertexEncoding.boneMapping = boneMapping(index)[1]
+			return vertexEncoding
+		vertexEncodings = LazyList(self.vertexCount(), buildVertexEncoding)
+		
+		def buildFace(index):
+			(index1, index2, index3) = self.faceIndices[index].tolist()
+			return FmdlFile.FmdlFile.Face(vertices[index1], vertices[index2], vertices[index3])
+		faces = LazyList(self.faceCount(), buildFace)
+		
+		self.objectLists = (vertices, vertexEncodings, faces)
+		return self.objectLists
+	
+	#
+	# Encode this mesh with the vertex-loop-preservation encoding. Equivalent to
+	# FmdlSplitVertexEncoding.encodeMeshVertexLoopPreservation(), which
+	# describes the encoding, but on the arrays. Returns a new MeshArrays.
+	#
+	def encodeVertexLoopPreservation(self):
+		vertexCount = self.vertexCount()
+		data = self.vertexData()
+		
+		keys = [data[FmdlFile.FmdlFile.FmdlVertexDatumType.position]]
+		if self.vertexFields.hasBoneMapping:
+			keys.append(self.boneInfluences.boneIndices.astype('<u2').view(numpy.uint8))
+			keys.append(self.boneInfluences.boneWeights.astype(numpy.uint8))
+		encodings = []
+		if self.vertexFields.hasNormal:
+			encodings.append(data[FmdlFile.FmdlFile.FmdlVertexDatumType.normal])
+		if self.vertexFields.hasColor:
+			encodings.append(data[FmdlFile.FmdlFile.FmdlVertexDatumType.color])
+		for i in range(min(self.vertexFields.uvCount, 4)):
+			encodings.append(data[UV_DATUM_TYPES[i]])
+		if self.vertexFields.hasTangent:
+			encodings.append(data[FmdlFile.FmdlFile.FmdlVertexDatumType.tangent])
+		
+		#
+		# Positions and topological keys are numbered in order of first
+		# occurrence, nontopological encodings in increasing order.
+		#
+		if self.positionIDs is None:
+			positionIDs = numpy.arange(vertexCount)
+		else:
+			positionIDs = groupRows(self.positionIDs.reshape((-1, 1)))[0].astype(numpy.int64)
+		keyIDs = groupRows(numpy.concatenate(keys, axis = 1))[0].astype(numpy.int64)
+		if len(encodings) > 0:
+			encodingRanks = rowRanks(numpy.concatenate(encodings, axis = 1))
+		else:
+			encodingRanks = numpy.zeros(vertexCount, dtype = numpy.int64)
+		
+		#
+		# Loops of the same vertex with the same nontopological encoding are
+		# collapsed into the first of them.
+		#
+		(loopIDs, loopCount) = groupRows(numpy.stack((positionIDs, encodingRanks), axis = 1))
+		loopRows = numpy.unique(loopIDs, return_index = True)[1]
+		
+		#
+		# Topologically equivalent vertices are ordered by the smallest
+		# nontopological encoding of their loops, decreasingly; vertices come
+		# in order of their topological key; and the loops of a vertex in
+		# order of their nontopological encoding. Vertices have the
+		# topological key of their first loop.
+		#
+		positionCount = int(positionIDs.max()) + 1 if vertexCount > 0 else 0
+		positionKeyIDs = keyIDs[numpy.unique(positionIDs, return_index = True)[1]]
+		positionEncodingRanks = numpy.full(positionCount, vertexCount, dtype = numpy.int64)
+		numpy.minimum.at(positionEncodingRanks, positionIDs, encodingRanks)
+		loopPositionIDs = positionIDs[loopRows]
+		order = numpy.lexsort((
+			encodingRanks[loopRows],
+			loopPositionIDs,
+			-positionEncodingRanks[loopPositionIDs],
+			positionKeyIDs[loopPositionIDs],
+		))
+		rows = loopRows[order]
+		
+		vertexIndices = numpy.zeros(vertexCount, dtype = numpy.int64)
+		vertexIndices[rows] = numpy.arange(len(rows))
+		faceIndices = vertexIndices[loopRows[loopIDs]][numpy.asarray(self.faceIndices, dtype = numpy.int64).reshape((-1, 3))]
+		return self.select(rows, faceIndices)
+
+#
+# Move the nonzero weights of each row of N x 4 bone index and weight arrays to
+# the front, keeping their order, and clear the remaining entries.
+#
+def compactBoneMappings(boneIndices, boneWeights):
+	order = numpy.argsort(boneWeights == 0, axis = 1, kind = 'mergesort')
+	rows = numpy.arange(len(boneWeights))[:, None]
+	boneIndices = boneIndices[rows, order]
+	boneWeights = boneWeights[rows, order]
+	boneIndices[boneWeights == 0] = 0
+	return (boneIndices, boneWeights)
+
+#
+# Assign every distinct row of an N x K array an integer ID, in order of first
+# occurrence. Returns (IDs, number of distinct rows).
+#
+def groupRows(keys):
+	keys = numpy.ascontiguousarray(keys)
+	if len(keys) == 0:
+		return (numpy.zeros(0, dtype = numpy.uint32), 0)
+	if keys.shape[1] == 0:
+		return (numpy.zeros(len(keys), dtype = numpy.uint32), 1)
+	rows = keys.view(numpy.dtype('V%d' % (keys.shape[1] * keys.dtype.itemsize))).reshape((-1, ))
+	(uniqueRows, firstIndices, inverse) = numpy.unique(rows, return_index = True, return_inverse = True)
+	ranks = numpy.empty(len(uniqueRows), dtype = numpy.uint32)
+	ranks[numpy.argsort(firstIndices, kind = 'mergesort')] = numpy.arange(len(uniqueRows), dtype = numpy.uint32)
+	return (ranks[inverse], len(uniqueRows))
+
+#
+# The rank of every row of an N x K uint8 array among the distinct rows, in
+# lexicographical order.
+#
+def rowRanks(keys):
+	if keys.shape[1] == 0:
+		return numpy.zeros(len(keys), dtype = numpy.int64)
+	order = numpy.lexsort(keys.T[::-1])
+	sortedKeys = keys[order]
+	isNew = numpy.ones(len(keys), dtype = bool)
+	isNew[1:] = numpy.any(sortedKeys[1:] != sortedKeys[:-1], axis = 1)
+	ranks = numpy.zeros(len(keys), dtype = numpy.int64)
+	ranks[order] = numpy.cumsum(isNew) - 1
+	return ranks
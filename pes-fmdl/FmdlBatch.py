@@ -0,0 +1,426 @@
+from . import FmdlFile, FmdlAntiBlur, FmdlMeshSplitting, FmdlSplitVertexEncoding, Ftex, Tracing
+import concurrent.futures
+import json
+import os
+import sys
+import time
+import traceback
+
+try:
+	import resource
+except ImportError:
+	resource = None
+
+#
+# Batch processing of many fmdl files, outside of Blender.
+#
+# A batch applies a single operation to each of a list of input files, spread
+# over a pool of worker processes, and yields the result for each file as soon
+# as it is done. Operations only use FmdlFile and the extension codecs, none of
+# which need bpy:
+# - 'validate' reads a file and decodes its extensions, as an import would;
+# - 'roundtrip' also re-encodes its extensions, as an export would, and writes
+#   the result to an output file;
+# - 'split' and 'unsplit' do the same, with mesh splitting always enabled or
+#   disabled when encoding;
+# - 'antiblur' does the same, and adds antiblur meshes to all meshes with a
+#   constant shader, or with one of a list of materials;
+# - 'ftex2dds' converts an ftex texture to a dds file.
+#
+# Each worker process can be given a cap on its address space, so that a single
+# pathological file fails with a MemoryError instead of exhausting the memory
+# of the machine. This cap relies on the resource module, and is not available
+# on Windows.
+#
+
+
+
+class BatchSettings:
+	def __init__(self):
+		self.enableExtensions = True
+		self.enableAntiblur = True
+		self.enableVertexLoopPreservation = True
+		self.enableMeshSplitting = True
+		# One of FmdlMeshSplitting.SPLIT_METHODS.
+		self.meshSplittingMethod = FmdlMeshSplitting.SPLIT_METHOD_BONES
+		# Worker processes for splitting the meshes of a single file.
+		self.meshSplittingWorkers = 1
+		# None uses one worker per cpu.
+		self.workers = None
+		# Maximum address space of a worker process in bytes, or None.
+		self.memoryLimit = None
+		# Material names to add antiblur meshes for, or None for all
+		# materials with a constant shader.
+		self.antiblurMaterials = None
+		# Record tracing spans for each file; see Tracing.
+		self.trace = False
+		# Also record the memory use of each stage, which is slow.
+		self.traceMemory = False
+
+def decodeExtensions(fmdlFile, settings):
+	if settings.enableExtensions and settings.enableMeshSplitting:
+		with Tracing.stage('decodeFmdlSplitMeshes'):
+			fmdlFile = FmdlMeshSplitting.decodeFmdlSplitMeshes(fmdlFile)
+	if settings.enableExtensions and settings.enableVertexLoopPreservation:
+		with Tracing.stage('decodeFmdlVertexLoopPreservation'):
+			fmdlFile = FmdlSplitVertexEncoding.decodeFmdlVertexLoopPreservation(fmdlFile)
+	if settings.enableExtensions and settings.enableAntiblur:
+		with Tracing.stage('decodeFmdlAntiBlur'):
+			fmdlFile = FmdlAntiBlur.decodeFmdlAntiBlur(fmdlFile)
+	return fmdlFile
+
+def encodeExtensions(fmdlFile, settings):
+	if settings.enableExtensions and settings.enableAntiblur:
+		with Tracing.stage('encodeFmdlAntiBlur'):
+			fmdlFile = FmdlAntiBlur.encodeFmdlAntiBlur(fmdlFile)
+	if settings.enableExtensions and settings.enableVertexLoopPreservation:
+		with Tracing.stage('encodeFmdlVertexLoopPreservation'):
+			fmdlFile = FmdlSplitVertexEncoding.encodeFmdlVertexLoopPreservation(fmdlFile)
+	if settings.enableExtensions and settings.enableMeshSplitting:
+		with Tracing.stage('encodeFmdlSplitMeshes'):
+			fmdlFile = FmdlMeshSplitting.encodeFmdlSplitMeshes(fmdlFile, settings.meshSplittingMethod, settings.meshSplittingWorkers)
+	return fmdlFile
+
+#
+# Headers of a parsed file are stored in lower case, and still list the
+# extensions the file was encoded with. Turn a decoded file into one that can
+# be encoded again, like a file built by an export from blender: without file
+# headers, with the mesh headers the export sets, and with an empty bone group
+# for meshes without bones, which a parsed file has none for.
+#
+def exportableFmdl(fmdlFile):
+	exportableHeaders = {header.lower(): header for header in ('Custom-Bounding-Box-Meshes', 'Has-Antiblur-Meshes')}
+	fmdlFile.extensionHeaders = {}
+	for mesh in fmdlFile.meshes:
+		if mesh.boneGroup is None:
+			mesh.boneGroup = FmdlFile.FmdlFile.BoneGroup()
+		mesh.extensionHeaders = set(exportableHeaders[header] for header in mesh.extensionHeaders if header in exportableHeaders)
+	for meshGroup in fmdlFile.meshGroups:
+		meshGroup.extensionHeaders = set()
+	return fmdlFile
+
+def fmdlStatistics(fmdlFile):
+	return {
+		'bones': len(fmdlFile.bones),
+		'materialInstances': len(fmdlFile.materialInstances),
+		'meshGroups': len(fmdlFile.meshGroups),
+		'meshes': len(fmdlFile.meshes),
+		'vertices': sum(len(mesh.vertices) for mesh in fmdlFile.meshes),
+		'faces': sum(mesh.faceCount() for mesh in fmdlFile.meshes),
+	}
+
+
+
+#
+# Operations. Each takes an input filename, an output filename or None, and a
+# BatchSettings, and returns a dict of statistics about the file.
+#
+
+def validateFile(inputFilename, outputFilename, settings):
+	fmdlFile = FmdlFile.FmdlFile()
+	fmdlFile.readFile(inputFilename)
+	fmdlFile = decodeExtensions(fmdlFile, settings)
+	return fmdlStatistics(fmdlFile)
+
+#
+# Read a file, decode its extensions, and write it back encoded with the
+# extensions enabled in $settings. $prepare can modify the decoded file in
+# between.
+#
+def rewriteFile(inputFilename, outputFilename, settings, prepare = None):
+	if outputFilename is None:
+		raise ValueError("Rewriting a file needs an output file")
+	fmdlFile = FmdlFile.FmdlFile()
+	fmdlFile.readFile(inputFilename)
+	fmdlFile = exportableFmdl(decodeExtensions(fmdlFile, settings))
+	if prepare is not None:
+		prepare(fmdlFile)
+	statistics = fmdlStatistics(fmdlFile)
+	fmdlFile = encodeExtensions(fmdlFile, settings)
+	
+	makeOutputDirectory(outputFilename)
+	fmdlFile.writeFile(outputFilename)
+	statistics['outputBytes'] = os.path.getsize(outputFilename)
+	return statistics
+
+def makeOutputDirectory(outputFilename):
+	outputDirectory = os.path.dirname(outputFilename)
+	if outputDirectory != '' and not os.path.isdir(outputDirectory):
+		os.makedirs(outputDirectory, exist_ok = True)
+
+def overriddenSettings(settings, **overrides):
+	output = BatchSettings()
+	output.__dict__.update(settings.__dict__)
+	output.__dict__.update(overrides)
+	return output
+
+def roundtripFile(inputFilename, outputFilename, settings):
+	return rewriteFile(inputFilename, outputFilename, settings)
+
+def splitFile(inputFilename, outputFilename, settings):
+	return rewriteFile(inputFilename, outputFilename, overriddenSettings(settings, enableExtensions = True, enableMeshSplitting = True))
+
+def unsplitFile(inputFilename, outputFilename, settings):
+	return rewriteFile(inputFilename, outputFilename, overriddenSettings(settings, enableMeshSplitting = False))
+
+def antiblurFile(inputFilename, outputFilename, settings):
+	def isAntiblurMaterial(materialInstance):
+		if settings.antiblurMaterials is None:
+			return 'constant' in materialInstance.shader.lower()
+		return materialInstance.name in settings.antiblurMaterials
+	
+	def addAntiblurMeshes(fmdlFile):
+		for mesh in fmdlFile.meshes:
+			if isAntiblurMaterial(mesh.materialInstance):
+				mesh.extensionHeaders.add('Has-Antiblur-Meshes')
+	
+	return rewriteFile(inputFilename, outputFilename, overriddenSettings(settings, enableExtensions = True, enableAntiblur = True), addAntiblurMeshes)
+
+def ftexToDdsFile(inputFilename, outputFilename, settings):
+	if outputFilename is None:
+		raise ValueError("Converting a texture needs an output file")
+	makeOutputDirectory(outputFilename)
+	if not Ftex.ftexToDds(inputFilename, outputFilename):
+		if os.path.isfile(outputFilename):
+			os.remove(outputFilename)
+		raise ValueError("Invalid or unsupported ftex file")
+	return {
+		'inputBytes': os.path.getsize(inputFilename),
+		'outputBytes': os.path.getsize(outputFilename),
+	}
+
+OPERATIONS = {
+	'validate': validateFile,
+	'roundtrip': roundtripFile,
+	'split': splitFile,
+	'unsplit': unsplitFile,
+	'antiblur': antiblurFile,
+	'ftex2dds': ftexToDdsFile,
+}
+
+INPUT_EXTENSIONS = {
+	'ftex2dds': '.ftex',
+}
+
+OUTPUT_EXTENSIONS = {
+	'ftex2dds': '.dds',
+}
+
+
+
+def limitMemory(memoryLimit):
+	if memoryLimit is None or resource is None:
+		return
+	(softLimit, hardLimit) = resource.getrlimit(resource.RLIMIT_AS)
+	if hardLimit != resource.RLIM_INFINITY:
+		memoryLimit = min(memoryLimit, hardLimit)
+	if softLimit != memoryLimit:
+		resource.setrlimit(resource.RLIMIT_AS, (memoryLimit, hardLimit))
+
+#
+# Run an operation on a single file, and describe the outcome as a dict that
+# can be stored in a JSON report. Never raises on errors in the file; those are
+# reported in the result instead.
+#
+def processFile(operation, inputFilename, outputFilename, settings):
+	limitMemory(settings.memoryLimit)
+	
+	result = {
+		'input': inputFilename,
+		'output': outputFilename,
+		'operation': operation,
+	}
+	startTime = time.perf_counter()
+	if settings.trace:
+		Tracing.start(settings.traceMemory)
+	try:
+		with Tracing.span(operation, input = inputFilename):
+			result['statistics'] = OPERATIONS[operation](inputFilename, outputFilename, settings)
+		result['status'] = 'ok'
+	except MemoryError:
+		result['status'] = 'error'
+		result['error'] = "Out of memory"
+	except Exception as error:
+		result['status'] = 'error'
+		result['error'] = "%s: %s" % (type(error).__name__, error)
+		result['traceback'] = traceback.format_exc()
+	result['seconds'] = time.perf_counter() - startTime
+	if settings.trace:
+		result['traceEvents'] = Tracing.stop()
+	
+	if resource is not None:
+		# Kilobytes on Linux, the peak over the lifetime of the worker.
+		result['workerMaxRss'] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+	return result
+
+#
+# Run an operation on a list of (input filename, output filename) jobs.
+# Yields the result of each job, as returned by processFile(), in order of
+# completion.
+#
+def runBatch(operation, jobs, settings = None):
+	if settings is None:
+		settings = BatchSettings()
+	if operation not in OPERATIONS:
+		raise ValueError("Unknown batch operation '%s'" % operation)
+	
+	workers = settings.workers
+	if workers is None:
+		workers = os.cpu_count() or 1
+	
+	#
+	# The memory limit applies to the whole process, so it is only ever set
+	# in a worker process, never in the calling process.
+	#
+	if workers == 1 and settings.memoryLimit is None:
+		for (inputFilename, outputFilename) in jobs:
+			yield processFile(operation, inputFilename, outputFilename, settings)
+		return
+	
+	with concurrent.futures.ProcessPoolExecutor(max_workers = workers) as executor:
+		futures = {}
+		for (inputFilename, outputFilename) in jobs:
+			future = executor.submit(processFile, operation, inputFilename, outputFilename, settings)
+			futures[future] = (inputFilename, outputFilename)
+		
+		for future in concurrent.futures.as_completed(futures):
+			try:
+				yield future.result()
+			except Exception as error:
+				#
+				# The worker process died, or the result could not be
+				# transferred back. This also fails all jobs pending in the
+				# pool at that point.
+				#
+				(inputFilename, outputFilename) = futures[future]
+				yield {
+					'input': inputFilename,
+					'output': outputFilename,
+					'operation': operation,
+					'status': 'error',
+					'error': "Worker failed: %s: %s" % (type(error).__name__, error),
+					'seconds': None,
+				}
+
+#
+# Expand a list of files and directories into a sorted list of files with
+# extension $extension. Returns (root, filename) pairs, where root is the
+# directory a filename was found in, or None for files listed explicitly.
+#
+def findFiles(paths, extension = '.fmdl'):
+	output = []
+	for path in paths:
+		if os.path.isdir(path):
+			found = []
+			for (directory, subdirectories, filenames) in os.walk(path):
+				for filename in filenames:
+					if filename.lower().endswith(extension):
+						found.append((path, os.path.join(directory, filename)))
+			output += sorted(found)
+		else:
+			output.append((None, path))
+	return output
+
+#
+# Build (input filename, output filename) jobs for a list of files and
+# directories. Files found in a directory keep their path relative to that
+# directory in outputDirectory. If outputExtension is set, it replaces the
+# extension of output filenames.
+#
+def makeJobs(paths, outputDirectory, inputExtension = '.fmdl', outputExtension = None):
+	jobs = []
+	for (root, filename) in findFiles(paths, inputExtension):
+		if outputDirectory is None:
+			outputFilename = None
+		elif root is None:
+			outputFilename = os.path.join(outputDirectory, os.path.basename(filename))
+		else:
+			outputFilename = os.path.join(outputDirectory, os.path.relpath(filename, root))
+		if outputFilename is not None and outputExtension is not None:
+			outputFilename = os.path.splitext(outputFilename)[0] + outputExtension
+		jobs.append((filename, outputFilename))
+	return jobs
+
+#
+# Build jobs for an operation, with the file extensions it uses.
+#
+def makeOperationJobs(operation, paths, outputDirectory):
+	return makeJobs(
+		paths,
+		outputDirectory,
+		INPUT_EXTENSIONS.get(operation, '.fmdl'),
+		OUTPUT_EXTENSIONS.get(operation, None),
+	)
+
+def writeReport(filename, operation, results, seconds):
+	results = sorted(results, key = (lambda result: result['input']))
+	report = {
+		'operation': operation,
+		'seconds': seconds,
+		'files': len(results),
+		'succeeded': len([result for result in results if result['status'] == 'ok']),
+		'failed': len([result for result in results if result['status'] != 'ok']),
+		'results': results,
+	}
+	with open(filename, 'w') as stream:
+		json.dump(report, stream, indent = '\t', sort_keys = True)
+		stream.write('\n')
+
+
+
+def addBatchArguments(parser):
+	parser.add_argument('paths', nargs = '+', metavar = 'PATH', help = "fmdl files, or directories to search for fmdl files")
+	parser.add_argument('--jobs', '-j', type = int, default = None, help = "number of worker processes (default: one per cpu)")
+	parser.add_argument('--memory-limit', type = int, default = None, metavar = 'MB', help = "maximum address space per worker process, in megabytes")
+	parser.add_argument('--report', default = None, metavar = 'FILE', help = "write a JSON report to FILE")
+	parser.add_argument('--trace', default = None, metavar = 'FILE', help = "write a Chrome trace of the stages of each file to FILE, and print a per-stage summary")
+	parser.add_argument('--trace-memory', action = 'store_true', help = "with --trace, also record the peak and retained memory and the top allocation sites of each stage; slow")
+	parser.add_argument('--no-extensions', action = 'store_true', help = "do not decode or encode any blender-pes-fmdl extensions")
+	parser.add_argument('--no-antiblur', action = 'store_true', help = "do not decode or encode antiblur meshes")
+	parser.add_argument('--no-loop-preservation', action = 'store_true', help = "do not decode or encode split vertices")
+	parser.add_argument('--no-mesh-splitting', action = 'store_true', help = "do not decode or encode split meshes")
+	parser.add_argument('--split-method', default = FmdlMeshSplitting.SPLIT_METHOD_BONES, choices = FmdlMeshSplitting.SPLIT_METHODS, help = "how to split oversized meshes: along the bone hierarchy, or partitioned to minimize duplicated vertices (default: %(default)s)")
+	parser.add_argument('--split-jobs', type = int, default = 1, metavar = 'N', help = "number of worker processes for splitting the oversized meshes of a single file; best combined with -j 1 (default: 1)")
+
+def batchSettings(arguments):
+	settings = BatchSettings()
+	settings.enableExtensions = not arguments.no_extensions
+	settings.enableAntiblur = not arguments.no_antiblur
+	settings.enableVertexLoopPreservation = not arguments.no_loop_preservation
+	settings.enableMeshSplitting = not arguments.no_mesh_splitting
+	settings.meshSplittingMethod = arguments.split_method
+	settings.meshSplittingWorkers = arguments.split_jobs
+	settings.workers = arguments.jobs
+	settings.trace = arguments.trace is not None
+	settings.traceMemory = arguments.trace_memory
+	if arguments.memory_limit is not None:
+		settings.memoryLimit = arguments.memory_limit * 1024 * 1024
+	return settings
+
+#
+# Run a batch, print a line per file as it finishes, and write the report.
+# Returns the number of failed files.
+#
+def runBatchCommand(operation, jobs, settings, reportFilename, stream = sys.stdout, traceFilename = None):
+	startTime = time.perf_counter()
+	results = []
+	traceEvents = []
+	for result in runBatch(operation, jobs, settings):
+		traceEvents += result.pop('traceEvents', [])
+		results.append(result)
+		if result['status'] == 'ok':
+			stream.write("ok     %8.3fs  %s\n" % (result['seconds'], result['input']))
+		else:
+			stream.write("FAILED %s  %s\n" % (' ' * 8, result['input']))
+			stream.write("       %s\n" % result['error'])
+		stream.flush()
+	seconds = time.perf_counter() - startTime
+	
+	failed = len([result for result in results if result['status'] != 'ok'])
+	stream.write("%d files, %d failed, %.1fs\n" % (len(results), failed, seconds))
+	if reportFilename is not None:
+		writeReport(reportFilename, operation, results, seconds)
+	if traceFilename is not None:
+		Tracing.writeChromeTrace(traceFilename, traceEvents)
+		stream.write(Tracing.formatSummary(traceEvents))
+	return failed
@@ -0,0 +1,348 @@
+from . import FmdlFile, FmdlMeshSplitting, FmdlSplitVertexEncoding, FmdlSynthetic, Ftex
+import gc
+import io
+import json
+import os
+import platform
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+
+#
+# Benchmarks of the stages of reading and writing fmdl files, run on
+# synthetic models from FmdlSynthetic.
+#
+# Each benchmark consists of a setup function, which prepares the input of a
+# single run and is not measured, and a run function. A benchmark is run a
+# number of times for its wall time, and once more with tracemalloc enabled
+# for the peak memory allocated by the run. Memory outside the Python
+# allocator, such as memory mapped files, is not included.
+#
+# Some benchmarks also measure properties of their output, such as the number
+# of meshes produced by the mesh splitting benchmarks, so that alternative
+# implementations of a stage can be compared on the quality of their output as
+# well as their speed.
+#
+# Results are plain dicts that can be stored as JSON, and compared against the
+# results of an earlier run to find regressions.
+#
+
+
+
+#
+# Models used by the benchmarks, as keyword arguments to
+# FmdlSynthetic.syntheticFmdl().
+#
+MODELS = [
+	('small', {
+		'vertexCount': 2000,
+		'uvCount': 1,
+		'boneCount': 20,
+	}),
+	('medium', {
+		'vertexCount': 20000,
+		'uvCount': 2,
+		'hasColor': True,
+		'boneCount': 40,
+	}),
+	('large', {
+		'vertexCount': 100000,
+		'uvCount': 2,
+		'highPrecisionUvs': True,
+		'hasColor': True,
+		'boneCount': 80,
+		'meshCount': 2,
+	}),
+]
+
+TEXTURE_SIZE = 512
+
+
+
+#
+# Data shared between the runs of the benchmarks of a single model. Each item
+# is computed when it is first needed. The extension encoders and writeFile()
+# do not modify their input, other than precomputing its vertex encoding, so
+# the models can be reused between runs with their vertex encoding
+# precomputed up front.
+#
+class BenchmarkModel:
+	def __init__(self, name, parameters, directory):
+		self.name = name
+		self.parameters = parameters
+		self.directory = directory
+		self.filename = os.path.join(directory, name + '.fmdl')
+		self.textureFilename = os.path.join(directory, name + '.ftex')
+		self.fmdlCache = None
+		self.loopPreservedFmdlCache = None
+		self.encodedFmdlCache = None
+		self.fileData = None
+	
+	def fmdl(self):
+		if self.fmdlCache is None:
+			self.fmdlCache = FmdlSynthetic.syntheticFmdl(**self.parameters)
+			self.fmdlCache.precomputeVertexEncoding()
+		return self.fmdlCache
+	
+	def loopPreservedFmdl(self):
+		if self.loopPreservedFmdlCache is None:
+			self.loopPreservedFmdlCache = FmdlSplitVertexEncoding.encodeFmdlVertexLoopPreservation(self.fmdl())
+			self.loopPreservedFmdlCache.precomputeVertexEncoding()
+		return self.loopPreservedFmdlCache
+	
+	def encodedFmdl(self):
+		if self.encodedFmdlCache is None:
+			self.encodedFmdlCache = FmdlMeshSplitting.encodeFmdlSplitMeshes(self.loopPreservedFmdl())
+			self.encodedFmdlCache.precomputeVertexEncoding()
+		return self.encodedFmdlCache
+	
+	def data(self):
+		if self.fileData is None:
+			self.encodedFmdl().writeFile(self.filename)
+			with open(self.filename, 'rb') as stream:
+				self.fileData = stream.read()
+		return self.fileData
+	
+	def texture(self):
+		if not os.path.isfile(self.textureFilename):
+			with open(self.textureFilename, 'wb') as stream:
+				stream.write(FmdlSynthetic.syntheticFtex(TEXTURE_SIZE, TEXTURE_SIZE))
+		return self.textureFilename
+
+
+
+def setupReadStream(model):
+	return io.BytesIO(model.data())
+
+def runReadStream(stream):
+	container = FmdlFile.FmdlContainer()
+	container.readStream(stream)
+	return container
+
+def setupParseMeshes(model):
+	container = runReadStream(setupReadStream(model))
+	(strings, extensionHeaders) = FmdlFile.FmdlFile.parseStrings(container)
+	boundingBoxes = FmdlFile.FmdlFile.parseBoundingBoxes(container)
+	bones = FmdlFile.FmdlFile.parseBones(container, strings, boundingBoxes)
+	materialInstances = FmdlFile.FmdlFile.parseMaterialInstances(container, strings)
+	return (container, bones, materialInstances, extensionHeaders)
+
+def runParseMeshes(state):
+	(container, bones, materialInstances, extensionHeaders) = state
+	return FmdlFile.FmdlFile.parseMeshes(container, bones, materialInstances, extensionHeaders)
+
+def setupEncodeVertices(model):
+	return model.fmdl().meshes
+
+def runEncodeVertices(meshes):
+	return [FmdlFile.FmdlFile.encodeVertices(mesh.vertices, mesh.vertexFields) for mesh in meshes]
+
+def setupWriteFile(model):
+	return (model.encodedFmdl(), os.path.join(model.directory, model.name + '-write.fmdl'))
+
+def runWriteFile(state):
+	(fmdlFile, filename) = state
+	fmdlFile.writeFile(filename)
+
+def setupEncodeSplitMeshes(model):
+	return model.loopPreservedFmdl()
+
+def runEncodeSplitMeshes(fmdlFile):
+	return FmdlMeshSplitting.encodeFmdlSplitMeshes(fmdlFile)
+
+def runEncodeSplitMeshesPartition(fmdlFile):
+	return FmdlMeshSplitting.encodeFmdlSplitMeshes(fmdlFile, FmdlMeshSplitting.SPLIT_METHOD_PARTITION)
+
+def setupDecodeSplitMeshes(model):
+	model.data()
+	fmdlFile = FmdlFile.FmdlFile()
+	fmdlFile.readFile(model.filename)
+	return fmdlFile
+
+def runDecodeSplitMeshes(fmdlFile):
+	return FmdlMeshSplitting.decodeFmdlSplitMeshes(fmdlFile)
+
+def setupEncodeVertexLoopPreservation(model):
+	return model.fmdl()
+
+def runEncodeVertexLoopPreservation(fmdlFile):
+	return FmdlSplitVertexEncoding.encodeFmdlVertexLoopPreservation(fmdlFile)
+
+def setupFtexToDds(model):
+	return (model.texture(), os.path.join(model.directory, model.name + '.dds'))
+
+def runFtexToDds(state):
+	(ftexFilename, ddsFilename) = state
+	if not Ftex.ftexToDds(ftexFilename, ddsFilename):
+		raise ValueError("Synthetic ftex file could not be converted")
+
+BENCHMARKS = [
+	('readStream', setupReadStream, runReadStream),
+	('parseMeshes', setupParseMeshes, runParseMeshes),
+	('encodeVertices', setupEncodeVertices, runEncodeVertices),
+	('writeFile', setupWriteFile, runWriteFile),
+	('encodeFmdlSplitMeshes', setupEncodeSplitMeshes, runEncodeSplitMeshes),
+	('encodeFmdlSplitMeshesPartition', setupEncodeSplitMeshes, runEncodeSplitMeshesPartition),
+	('decodeFmdlSplitMeshes', setupDecodeSplitMeshes, runDecodeSplitMeshes),
+	('encodeFmdlVertexLoopPreservation', setupEncodeVertexLoopPreservation, runEncodeVertexLoopPreservation),
+	('ftexToDds', setupFtexToDds, runFtexToDds),
+]
+
+#
+# The number of meshes written, and the number of vertices stored more than
+# once because they occur in multiple submeshes of a split mesh.
+#
+def splitMetrics(fmdlFile, output):
+	return {
+		'meshes': len(output.meshes),
+		'duplicatedVertices': sum(len(mesh.vertices) for mesh in output.meshes) - sum(len(mesh.vertices) for mesh in fmdlFile.meshes),
+	}
+
+#
+# Functions computing the output metrics of a benchmark from the input and
+# output of a run.
+#
+METRICS = {
+	'encodeFmdlSplitMeshes': splitMetrics,
+	'encodeFmdlSplitMeshesPartition': splitMetrics,
+}
+
+
+
+def median(values):
+	values = sorted(values)
+	middle = len(values) // 2
+	if len(values) % 2 == 1:
+		return values[middle]
+	return (values[middle - 1] + values[middle]) / 2
+
+#
+# Run a single benchmark on a model $repeat times, and return its result.
+#
+def runBenchmark(name, setup, run, model, repeat):
+	seconds = []
+	metrics = None
+	for i in range(repeat):
+		state = setup(model)
+		gc.collect()
+		startTime = time.perf_counter()
+		output = run(state)
+		seconds.append(time.perf_counter() - startTime)
+		if metrics is None and name in METRICS:
+			metrics = METRICS[name](state, output)
+		del output
+		del state
+	
+	state = setup(model)
+	gc.collect()
+	tracemalloc.start()
+	output = run(state)
+	(currentBytes, peakBytes) = tracemalloc.get_traced_memory()
+	tracemalloc.stop()
+	del output
+	del state
+	
+	result = {
+		'benchmark': name,
+		'model': model.name,
+		'repeat': repeat,
+		'seconds': {
+			'min': min(seconds),
+			'median': median(seconds),
+			'mean': sum(seconds) / len(seconds),
+		},
+		'peakBytes': peakBytes,
+		'retainedBytes': currentBytes,
+	}
+	if metrics is not None:
+		result['metrics'] = metrics
+	return result
+
+def environment():
+	return {
+		'python': sys.version.split()[0],
+		'implementation': platform.python_implementation(),
+		'platform': platform.platform(),
+		'arrays': FmdlFile.arraysModule() is not None,
+	}
+
+#
+# Run benchmarks on models, selected by name; None selects all of them.
+# $progress, if set, is called with each result as it becomes available.
+#
+def runBenchmarks(modelNames = None, benchmarkNames = None, repeat = 5, progress = None):
+	models = [(name, parameters) for (name, parameters) in MODELS if modelNames is None or name in modelNames]
+	benchmarks = [benchmark for benchmark in BENCHMARKS if benchmarkNames is None or benchmark[0] in benchmarkNames]
+	if modelNames is not None and len(models) != len(set(modelNames)):
+		raise ValueError("Unknown model in %s" % ', '.join(modelNames))
+	if benchmarkNames is not None and len(benchmarks) != len(set(benchmarkNames)):
+		raise ValueError("Unknown benchmark in %s" % ', '.join(benchmarkNames))
+	
+	results = []
+	directory = tempfile.mkdtemp(prefix = 'fmdl-benchmark-')
+	try:
+		for (modelName, parameters) in models:
+			model = BenchmarkModel(modelName, parameters, directory)
+			for (name, setup, run) in benchmarks:
+				result = runBenchmark(name, setup, run, model, repeat)
+				result['parameters'] = parameters
+				results.append(result)
+				if progress is not None:
+					progress(result)
+	finally:
+		shutil.rmtree(directory, ignore_errors = True)
+	
+	return {
+		'environment': environment(),
+		'results': results,
+	}
+
+def writeResults(filename, results):
+	with open(filename, 'w') as stream:
+		json.dump(results, stream, indent = '\t', sort_keys = True)
+		stream.write('\n')
+
+def readResults(filename):
+	with open(filename, 'r') as stream:
+		return json.load(stream)
+
+#
+# Compare benchmark results against a baseline. Returns a list of
+# (benchmark, model, metric, baseline value, current value) for every median
+# time or peak memory that grew by more than a factor $tolerance. Differences
+# below a millisecond or 64 KiB are ignored as noise.
+#
+def regressions(baseline, current, tolerance = 1.2):
+	minimumDifferences = {
+		'seconds': 0.001,
+		'peakBytes': 65536,
+	}
+	
+	baselineResults = {}
+	for result in baseline['results']:
+		baselineResults[(result['benchmark'], result['model'])] = result
+	
+	output = []
+	for result in current['results']:
+		key = (result['benchmark'], result['model'])
+		if key not in baselineResults:
+			continue
+		baselineResult = baselineResults[key]
+		for (metric, baselineValue, currentValue) in [
+			('seconds', baselineResult['seconds']['median'], result['seconds']['median']),
+			('peakBytes', baselineResult['peakBytes'], result['peakBytes']),
+		]:
+			if currentValue > baselineValue * tolerance and currentValue - baselineValue > minimumDifferences[metric]:
+				output.append((result['benchmark'], result['model'], metric, baselineValue, currentValue))
+	return output
+
+def formatResult(result):
+	return "%-34s %-8s %9.4fs %9.1f MB%s" % (
+		result['benchmark'],
+		result['model'],
+		result['seconds']['median'],
+		result['peakBytes'] / (1024 * 1024),
+		''.join("  %s %s" % (metric, value) for (metric, value) in sorted(result.get('metrics', {}).items())),
+	)
@@ -0,0 +1,135 @@
+from . import FmdlBatch, FmdlMeshSplitting, FmdlSplitVertexEncoding, FmdlSynthetic
+import hashlib
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+
+#
+# Check that exporting produces the same bytes in every run, regardless of
+# hash randomization.
+#
+# Each run exports the same input files in a separate python process, with a
+# different PYTHONHASHSEED, using the 'antiblur' batch operation: it decodes
+# each file, adds antiblur meshes, and encodes all extensions again, including
+# vertex loop preservation and mesh splitting, as an export from blender
+# would. The output files of every run are hashed and compared against those
+# of the first run.
+#
+# Without input files, a synthetic model is used that is large enough to need
+# splitting, with antiblur meshes and a custom bounding box for its first
+# material.
+#
+
+
+
+SYNTHETIC_PARAMETERS = {
+	'vertexCount': 30000,
+	'uvCount': 2,
+	'hasColor': True,
+	'boneCount': 80,
+	'meshCount': 2,
+}
+
+SYNTHETIC_ANTIBLUR_MATERIALS = ['synthetic_0']
+
+def writeSyntheticModel(filename):
+	fmdlFile = FmdlSynthetic.syntheticFmdl(**SYNTHETIC_PARAMETERS)
+	# Meshes with several headers are written in header order.
+	fmdlFile.meshes[0].extensionHeaders.add('Custom-Bounding-Box-Meshes')
+	fmdlFile = FmdlSplitVertexEncoding.encodeFmdlVertexLoopPreservation(fmdlFile)
+	fmdlFile = FmdlMeshSplitting.encodeFmdlSplitMeshes(fmdlFile)
+	fmdlFile.writeFile(filename)
+
+def fileDigest(filename):
+	digest = hashlib.sha256()
+	with open(filename, 'rb') as stream:
+		while True:
+			data = stream.read(1 << 20)
+			if len(data) == 0:
+				break
+			digest.update(data)
+	return digest.hexdigest()
+
+#
+# Map from the filenames below $directory, relative to it, to their digests.
+#
+def directoryDigests(directory):
+	digests = {}
+	for (root, directories, filenames) in os.walk(directory):
+		for filename in filenames:
+			path = os.path.join(root, filename)
+			digests[os.path.relpath(path, directory)] = fileDigest(path)
+	return digests
+
+#
+# Export $paths into $outputDirectory in a new python process with hash seed
+# $seed. $arguments are passed on to the batch command. Returns the output of
+# the process, and raises a RuntimeError if it fails.
+#
+def runExport(paths, outputDirectory, seed, arguments):
+	packageDirectory = os.path.dirname(os.path.abspath(__file__))
+	environment = dict(os.environ)
+	environment['PYTHONHASHSEED'] = str(seed)
+	environment['PYTHONPATH'] = os.pathsep.join(
+		[os.path.dirname(packageDirectory)]
+		+ ([environment['PYTHONPATH']] if environment.get('PYTHONPATH', '') != '' else [])
+	)
+	command = (
+		[sys.executable, '-m', os.path.basename(packageDirectory), 'antiblur', '--jobs', '1', '--output-dir', outputDirectory]
+		+ arguments
+		+ ['--']
+		+ paths
+	)
+	process = subprocess.Popen(command, env = environment, stdout = subprocess.PIPE, stderr = subprocess.STDOUT)
+	(output, errors) = process.communicate()
+	output = output.decode('utf-8', 'replace')
+	if process.returncode != 0:
+		raise RuntimeError("Export with PYTHONHASHSEED=%d failed:\n%s" % (seed, output))
+	return output
+
+#
+# Export $paths, or a synthetic model if there are none, $runs times, and
+# compare the digests of the output files. Writes a line per file and run to
+# $stream, and returns the number of files whose output differed between
+# runs.
+#
+def checkDeterminism(paths, runs = 5, splitMethod = FmdlMeshSplitting.SPLIT_METHOD_BONES, splitWorkers = 1, antiblurMaterials = None, stream = sys.stdout):
+	directory = tempfile.mkdtemp(prefix = 'fmdl-determinism-')
+	try:
+		if len(paths) == 0:
+			filename = os.path.join(directory, 'input', 'synthetic.fmdl')
+			FmdlBatch.makeOutputDirectory(filename)
+			writeSyntheticModel(filename)
+			paths = [filename]
+			if antiblurMaterials is None:
+				antiblurMaterials = SYNTHETIC_ANTIBLUR_MATERIALS
+		
+		arguments = ['--split-method', splitMethod, '--split-jobs', str(splitWorkers)]
+		for material in antiblurMaterials or []:
+			arguments += ['--material', material]
+		
+		firstDigests = None
+		differences = set()
+		for seed in range(1, runs + 1):
+			outputDirectory = os.path.join(directory, 'run%d' % seed)
+			runExport([os.path.abspath(path) for path in paths], outputDirectory, seed, arguments)
+			digests = directoryDigests(outputDirectory)
+			if firstDigests is None:
+				firstDigests = digests
+			for filename in sorted(set(digests) | set(firstDigests)):
+				digest = digests.get(filename, '-')
+				if digest != firstDigests.get(filename, '-'):
+					differences.add(filename)
+					status = 'DIFFERENT'
+				else:
+					status = 'same'
+				stream.write("PYTHONHASHSEED=%-4d %s %s %s\n" % (seed, digest[:16], status, filename))
+			shutil.rmtree(outputDirectory, ignore_errors = True)
+		
+		if len(firstDigests) == 0:
+			raise RuntimeError("No files were exported")
+		return len(differences)
+	finally:
+		shutil.rmtree(directory, ignore_errors = True)
@@ -1,44 +1,142 @@
+import collections
 import math
+import mmap
+import os
 import struct
-from struct import pack, pack_into, unpack, unpack_from
+from struct import pack, pack_into, unpack_from
+
+from . import Tracing
 
 class InvalidFmdl(Exception):
 	pass
 
+#
+# FmdlArrays contains NumPy implementations of the expensive per-vertex parts
+# of reading and writing fmdl files. It depends on this module, so it is loaded
+# on first use rather than imported at the top. If NumPy is unavailable, or
+# useArrays is disabled, the pure-Python implementations in this module are
+# used instead.
+#
+useArrays = True
+arraysModuleCache = []
+
+def arraysModule():
+	if not useArrays:
+		return None
+	if len(arraysModuleCache) == 0:
+		try:
+			from . import FmdlArrays
+			arraysModuleCache.append(FmdlArrays)
+		except ImportError:
+			arraysModuleCache.append(None)
+	return arraysModuleCache[0]
+
 class FmdlContainer:
 	MAGIC = b'FMDL'
 	VERSION_2_03 = 0x4001eb85
 	
-	SECTION0_BLOCK_ENTRY_SIZES = {
-		0: 48,
-		1: 8,
-		2: 32,
-		3: 48,
-		4: 16,
-		5: 68,
-		6: 4,
-		7: 4,
-		8: 4,
-		9: 8,
-		10: 8,
-		11: 4,
-		12: 8,
-		13: 32,
-		14: 16,
-		16: 16,
-		17: 8,
-		18: 8,
-		20: 128,
+	class BlockSchema:
+		def __init__(self, name, format, fields):
+			self.name = name
+			self.struct = struct.Struct(format)
+			self.fields = fields
+			self.recordType = collections.namedtuple(name, fields)
+	
+	#
+	# Layout of the entries of each known section 0 block, shared by the
+	# parsing and writing code in FmdlFile. Unknown fields are named after
+	# their position; padding is not represented in the unpacked entries.
+	#
+	SECTION0_BLOCK_SCHEMAS = {
+		0: BlockSchema('Bone', '< H h H H 8x 4f 4f', (
+			'nameStringID', 'parentBoneID', 'boundingBoxID', 'unknown',
+			'localX', 'localY', 'localZ', 'localW',
+			'worldX', 'worldY', 'worldZ', 'worldW',
+		)),
+		1: BlockSchema('MeshGroup', '< H H h h', (
+			'nameStringID', 'invisible', 'parentID', 'unknown',
+		)),
+		2: BlockSchema('MeshGroupAssignment', '< 4x HHHH 4x H 14x', (
+			'meshGroupID', 'meshCount', 'firstMeshIndex', 'boundingBoxID', 'unknown',
+		)),
+		3: BlockSchema('Mesh', '< BB 2x HHHH 4x IIQ 16x', (
+			'alphaFlags', 'shadowFlags', 'materialInstanceID', 'boneGroupID', 'meshFormatID',
+			'vertexCount', 'firstFaceVertexIndex', 'faceVertexCount', 'firstFaceIndexID',
+		)),
+		4: BlockSchema('MaterialInstance', '< H 2x H BB H H 4x', (
+			'nameStringID', 'materialID', 'textureCount', 'materialParameterCount',
+			'firstTextureID', 'firstMaterialParameterID',
+		)),
+		5: BlockSchema('BoneGroup', '< H H 32H', (
+			'unknown', 'entryCount',
+		) + tuple('boneID%d' % i for i in range(32))),
+		6: BlockSchema('Texture', '< H H', (
+			'filenameStringID', 'directoryStringID',
+		)),
+		7: BlockSchema('TextureMaterialParameterAssignment', '< H H', (
+			'parameterStringID', 'referenceID',
+		)),
+		8: BlockSchema('Material', '< H H', (
+			'shaderStringID', 'techniqueStringID',
+		)),
+		9: BlockSchema('MeshFormatAssignment', '< BB BB HH', (
+			'meshFormatEntryCount', 'vertexFormatEntryCount', 'firstUvIndex', 'uvIndexCount',
+			'firstMeshFormatID', 'firstVertexFormatID',
+		)),
+		10: BlockSchema('MeshFormat', '< BBBB I', (
+			'bufferID', 'vertexFormatEntryCount', 'bufferOffsetIncrement', 'meshFormatType', 'bufferOffset',
+		)),
+		11: BlockSchema('VertexFormat', '< B B H', (
+			'datumType', 'datumFormat', 'offset',
+		)),
+		12: BlockSchema('String', '< H H I', (
+			'blockID', 'length', 'offset',
+		)),
+		13: BlockSchema('BoundingBox', '< 8f', (
+			'maxX', 'maxY', 'maxZ', 'maxW',
+			'minX', 'minY', 'minZ', 'minW',
+		)),
+		14: BlockSchema('BufferOffset', '< I I I 4x', (
+			'eof', 'length', 'offset',
+		)),
+		16: BlockSchema('LevelsOfDetail', '< I 3f', (
+			'lodCount', 'unknown0', 'unknown1', 'unknown2',
+		)),
+		17: BlockSchema('FaceIndex', '< I I', (
+			'firstFaceVertexIndex', 'faceVertexCount',
+		)),
+		18: BlockSchema('Unknown18', '< 8x', ()),
+		20: BlockSchema('Unknown20', '< ffff IIIi 96x', (
+			'unknown0', 'unknown1', 'unknown2', 'unknown3',
+			'unknown4', 'unknown5', 'unknown6', 'unknown7',
+		)),
 	}
 	
+	SECTION0_BLOCK_ENTRY_SIZES = dict((blockID, schema.struct.size) for (blockID, schema) in SECTION0_BLOCK_SCHEMAS.items())
+	
 	def __init__(self):
 		self.version = self.VERSION_2_03
 		self.segment0Blocks = {}
 		self.segment1Blocks = {}
+		self.segment0BlockViews = {}
+		self.view = None
+		self.mapping = None
 	
-	def readStream(self, stream):
-		header = bytearray(56)
-		if stream.readinto(header) != len(header):
+	def readBuffer(self, buffer, section1BlockIDs = None):
+		#
+		# Parse an fmdl file from a bytes-like object. Section 0 entries and
+		# section 1 blocks are stored as memoryview slices into $buffer, so
+		# no file content is copied; the buffer must be kept alive, and
+		# unmodified, for as long as the blocks are in use.
+		#
+		# If $section1BlockIDs is given, only those section 1 blocks are
+		# made available; the others are never accessed.
+		#
+		view = memoryview(buffer).cast('B')
+		self.view = view
+		fileLength = len(view)
+		
+		if fileLength < 56:
 			raise InvalidFmdl("Incomplete header")
 		(
 			magic,
@@ -52,37 +150,33 @@ class FmdlContainer:
 			section0Length,
 			section1Offset,
 			section1Length,
-		) = unpack('< 4s I Q QQ II II II', header)
+		) = unpack_from('< 4s I Q QQ II II II', view, 0)
 		
 		if magic != self.MAGIC:
 			raise InvalidFmdl("Unexpected magic number")
 		
 		self.version = version
 		
-		stream.seek(descriptorsOffset)
+		if descriptorsOffset + section0BlockCount * 8 + section1BlockCount * 12 > fileLength:
+			raise InvalidFmdl("Incomplete block descriptor")
 		
 		section0Descriptors = []
 		for i in range(section0BlockCount):
-			descriptor = bytearray(8)
-			if stream.readinto(descriptor) != len(descriptor):
-				raise InvalidFmdl("Incomplete block descriptor")
 			(
 				blockID,
 				entryCount,
 				blockOffset,
-			) = unpack('< H H I', descriptor)
+			) = unpack_from('< H H I', view, descriptorsOffset + i * 8)
 			section0Descriptors.append((blockID, entryCount, blockOffset))
 		
+		section1DescriptorsOffset = descriptorsOffset + section0BlockCount * 8
 		section1Descriptors = []
 		for i in range(section1BlockCount):
-			descriptor = bytearray(12)
-			if stream.readinto(descriptor) != len(descriptor):
-				raise InvalidFmdl("Incomplete block descriptor")
 			(
 				blockID,
 				blockOffset,
 				length,
-			) = unpack('< I I I', descriptor)
+			) = unpack_from('< I I I', view, section1DescriptorsOffset + i * 12)
 			section1Descriptors.append((blockID, blockOffset, length))
 		
 		for (blockID, entryCount, sectionOffset) in section0Descriptors:
@@ -93,50 +187,138 @@ class FmdlContainer:
 			if blockID in self.segment0Blocks:
 				raise InvalidFmdl("Duplicate segment 0 block %d" % blockID)
 			
-			stream.seek(sectionOffset + section0Offset)
+			blockStart = sectionOffset + section0Offset
+			if blockStart + entryCount * entrySize > fileLength:
+				raise InvalidFmdl("Unexpected end of file reading section 0 block %d entry" % blockID)
 			
-			block = []
-			for i in range(entryCount):
-				entry = bytearray(entrySize)
-				if stream.readinto(entry) != len(entry):
-					raise InvalidFmdl("Unexpected end of file reading section 0 block %d entry" % blockID)
-				block.append(entry)
-			self.segment0Blocks[blockID] = block
-		
-		stream.seek(0, 2)
-		fileLength = stream.tell()
+			blockView = view[blockStart : blockStart + entryCount * entrySize]
+			self.segment0BlockViews[blockID] = blockView
+			self.segment0Blocks[blockID] = [
+				blockView[position : position + entrySize]
+				for position in range(0, len(blockView), entrySize)
+			]
 		
 		for (blockID, sectionOffset, length) in section1Descriptors:
+			if section1BlockIDs is not None and blockID not in section1BlockIDs:
+				continue
 			if blockID in self.segment1Blocks:
 				raise InvalidFmdl("Duplicate segment 1 block %d" % blockID)
 			
 			# These block lengths are occasionally set to slightly wrong values.
 			# Interpret them liberally.
 			remainingLength = fileLength - (sectionOffset + section1Offset)
+			if remainingLength < 0:
+				raise InvalidFmdl("Unexpected end of file reading section 1 block %d" % blockID)
 			if length > remainingLength or blockID == 3:
 				length = remainingLength
 			
-			stream.seek(sectionOffset + section1Offset)
-			
-			block = bytearray(length)
-			if stream.readinto(block) != len(block):
-				raise InvalidFmdl("Unexpected end of file reading section 1 block %d" % blockID)
-				pass
-			self.segment1Blocks[blockID] = block
+			blockStart = sectionOffset + section1Offset
+			self.segment1Blocks[blockID] = view[blockStart : blockStart + length]
+	
+	def readStream(self, stream, section1BlockIDs = None):
+		stream.seek(0)
+		self.readBuffer(stream.read(), section1BlockIDs)
 	
-	def readFile(self, filename):
+	def readFile(self, filename, section1BlockIDs = None):
+		#
+		# Map the file into memory rather than reading it, so that blocks can
+		# be parsed straight out of the page cache. close() unmaps the file.
+		#
 		with open(filename, 'rb') as stream:
-			self.readStream(stream)
+			try:
+				mapping = mmap.mmap(stream.fileno(), 0, access = mmap.ACCESS_READ)
+			except ValueError:
+				# Empty files cannot be mapped.
+				raise InvalidFmdl("Incomplete header")
+		self.mapping = mapping
+		try:
+			self.readBuffer(mapping, section1BlockIDs)
+		except:
+			self.close()
+			raise
+	
+	def close(self):
+		#
+		# Release all blocks referring to the underlying buffer, and unmap the
+		# file if it was mapped. The container cannot be used after this.
+		#
+		self.segment0Blocks = {}
+		self.segment1Blocks = {}
+		self.segment0BlockViews = {}
+		if self.view is not None:
+			self.view.release()
+			self.view = None
+		if self.mapping is not None:
+			try:
+				self.mapping.close()
+			except BufferError:
+				# Some block is still referenced by the caller; the mapping
+				# will be closed once that reference is gone.
+				pass
+			self.mapping = None
 	
-	def writeStream(self, stream):
+	def unpackBlock(self, blockID):
+		#
+		# Decode all entries of a section 0 block in one go, as a list of
+		# tuples with the fields from SECTION0_BLOCK_SCHEMAS.
+		#
+		if blockID not in self.segment0Blocks:
+			return []
+		schema = self.SECTION0_BLOCK_SCHEMAS[blockID]
+		entries = self.segment0Blocks[blockID]
+		if blockID in self.segment0BlockViews and len(self.segment0BlockViews[blockID]) == len(entries) * schema.struct.size:
+			block = self.segment0BlockViews[blockID]
+		else:
+			block = bytearray(0).join(entries)
+		return list(schema.struct.iter_unpack(block))
+	
+	def unpackBlockRecords(self, blockID):
+		#
+		# As unpackBlock(), but as named tuples.
+		#
+		recordType = self.SECTION0_BLOCK_SCHEMAS[blockID].recordType
+		return [recordType._make(entry) for entry in self.unpackBlock(blockID)]
+	
+	def __enter__(self):
+		return self
+	
+	def __exit__(self, excType, excValue, traceback):
+		self.close()
+	
+	#
+	# A section 1 block whose content is only produced when the file is
+	# written, so that large blocks can be written straight into the output
+	# rather than built up separately and copied. $write is called with a
+	# writable, zero-filled memoryview of exactly $length bytes.
+	#
+	class DeferredBlock:
+		def __init__(self, length, write):
+			self.length = length
+			self.write = write
+		
+		def __len__(self):
+			return self.length
+	
+	#
+	# Position of every piece of a file in the output, as computed by
+	# planLayout(). $chunks is a list of (offset, content) pairs, where
+	# content is a bytes-like object or a DeferredBlock; anything in between
+	# is zero padding.
+	#
+	class Layout:
+		def __init__(self):
+			self.size = 0
+			self.chunks = []
+	
+	def planLayout(self):
 		section0Bitmap = 0
 		section1Bitmap = 0
 		
 		section0Descriptors = []
 		section1Descriptors = []
 		
-		section0Blocks = []
-		section1Blocks = []
+		section0Chunks = []
+		section1Chunks = []
 		
 		offset = 0
 		for i in range(64):
@@ -144,22 +326,17 @@ class FmdlContainer:
 				continue
 			
 			entries = self.segment0Blocks[i]
-			block = bytearray(0).join(entries)
 			descriptor = pack('< H H I', i, len(entries), offset)
-			if len(block) % 16:
+			for entry in entries:
+				section0Chunks.append((offset, entry))
+				offset += len(entry)
+			if offset % 16:
 				# This is more padding than used by some PES fmdl files, but certainly safe.
-				padding = 16 - (len(block) % 16)
-				block += bytearray(padding)
+				offset += 16 - (offset % 16)
 			
 			section0Bitmap |= (1 << i)
 			section0Descriptors.append(descriptor)
-			section0Blocks.append(block)
-			offset += len(block)
 		section0Length = offset
-		if section0Length % 16:
-			padding = 16 - (section0Length % 16)
-			section0Blocks.append(bytearray(padding))
-			section0Length += padding
 		
 		offset = 0
 		for i in range(64):
@@ -171,7 +348,7 @@ class FmdlContainer:
 			
 			section1Bitmap |= (1 << i)
 			section1Descriptors.append(descriptor)
-			section1Blocks.append(block)
+			section1Chunks.append((offset, block))
 			offset += len(block)
 		section1Length = offset
 		
@@ -199,56 +376,103 @@ class FmdlContainer:
 			0,
 		)
 		
-		totalContent = [header] + [descriptors] + section0Blocks + section1Blocks
-		for chunk in totalContent:
-			stream.write(chunk)
+		layout = FmdlContainer.Layout()
+		layout.size = section1Offset + section1Length
+		layout.chunks.append((0, header))
+		layout.chunks.append((headerSize, descriptors))
+		for (offset, chunk) in section0Chunks:
+			layout.chunks.append((section0Offset + offset, chunk))
+		for (offset, chunk) in section1Chunks:
+			layout.chunks.append((section1Offset + offset, chunk))
+		return layout
+	
+	def writeLayout(self, layout, buffer):
+		#
+		# Write the file described by $layout into $buffer, a writable,
+		# zero-filled buffer of layout.size bytes.
+		#
+		with memoryview(buffer) as view:
+			for (offset, chunk) in layout.chunks:
+				length = len(chunk)
+				if length == 0:
+					continue
+				with view[offset : offset + length] as target:
+					if isinstance(chunk, FmdlContainer.DeferredBlock):
+						chunk.write(target)
+					else:
+						target[:] = chunk
+	
+	def writeBuffer(self):
+		layout = self.planLayout()
+		buffer = bytearray(layout.size)
+		self.writeLayout(layout, buffer)
+		return buffer
+	
+	def writeStream(self, stream):
+		stream.write(self.writeBuffer())
 	
 	def writeFile(self, filename):
-		with open(filename, 'wb') as stream:
-			self.writeStream(stream)
+		#
+		# Size the output file up front and write it through a memory
+		# mapping, so that every byte is written exactly once. The file is
+		# written under a temporary name in the same directory, and only
+		# replaces $filename once it is complete, so that a failure to
+		# encode the file leaves any existing file at $filename intact.
+		#
+		with Tracing.span('planLayout'):
+			layout = self.planLayout()
+		while True:
+			temporaryFilename = '%s.%s.tmp' % (filename, os.urandom(4).hex())
+			try:
+				stream = open(temporaryFilename, 'x+b')
+			except FileExistsError:
+				continue
+			break
+		try:
+			with stream:
+				stream.truncate(layout.size)
+				mapping = mmap.mmap(stream.fileno(), layout.size)
+			try:
+				with Tracing.stage('writeLayout', bytes = layout.size):
+					self.writeLayout(layout, mapping)
+			finally:
+				mapping.close()
+			os.replace(temporaryFilename, filename)
+		except:
+			if os.path.exists(temporaryFilename):
+				os.remove(temporaryFilename)
+			raise
 
 class FmdlFile:
-	class Vector2:
-		def __init__(self):
-			self.u = None
-			self.v = None
-		
-		def __init__(self, u, v):
-			self.u = u
-			self.v = v
+	#
+	# Geometry objects are created for every vertex of every mesh, so they
+	# are kept compact with __slots__.
+	#
+	# Vector2, Vector4 and BoundingBox are immutable values, compared and
+	# hashed by value.
+	#
+	# Vector3, Vertex, VertexEncoding and Face are compared and hashed by
+	# identity, and are used as dictionary keys that way. In particular,
+	# vertices that share a single Vector3 position object are loops of the
+	# same vertex (see FmdlSplitVertexEncoding and IO.importMesh), whereas
+	# vertices with equal but distinct position objects are distinct vertices.
+	#
+	class Vector2(collections.namedtuple('Vector2', ('u', 'v'))):
+		__slots__ = ()
 	
 	class Vector3:
-		def __init__(self):
-			self.x = None
-			self.y = None
-			self.z = None
+		__slots__ = ('x', 'y', 'z')
 		
 		def __init__(self, x, y, z):
 			self.x = x
 			self.y = y
 			self.z = z
 	
-	class Vector4:
-		def __init__(self):
-			self.x = None
-			self.y = None
-			self.z = None
-			self.w = None
-		
-		def __init__(self, x, y, z, w):
-			self.x = x
-			self.y = y
-			self.z = z
-			self.w = w
+	class Vector4(collections.namedtuple('Vector4', ('x', 'y', 'z', 'w'))):
+		__slots__ = ()
 	
-	class BoundingBox:
-		def __init__(self):
-			self.min = None
-			self.max = None
-		
-		def __init__(self, min, max):
-			self.min = min
-			self.max = max
+	class BoundingBox(collections.namedtuple('BoundingBox', ('min', 'max'))):
+		__slots__ = ()
 	
 	class Bone:
 		def __init__(self):
@@ -283,6 +507,8 @@ class FmdlFile:
 			self.parameters = []
 	
 	class Vertex:
+		__slots__ = ('position', 'normal', 'tangent', 'color', 'boneMapping', 'uv')
+		
 		def __init__(self):
 			self.position = None
 			self.normal = None
@@ -291,9 +517,33 @@ class FmdlFile:
 			self.boneMapping = None
 			self.uv = []
 	
+	#
+	# The bone mapping of a parsed vertex. Parsing gives all vertices of a mesh
+	# with the same bone weighting the same BoneMapping object, and the same
+	# tuple as VertexEncoding.boneMapping. Because it is shared, a BoneMapping
+	# cannot be modified; assign a new dict to Vertex.boneMapping instead.
+	#
+	class BoneMapping(dict):
+		def readOnly(self, *args, **kwargs):
+			raise TypeError("Shared bone mapping cannot be modified")
+		
+		__setitem__ = readOnly
+		__delitem__ = readOnly
+		clear = readOnly
+		pop = readOnly
+		popitem = readOnly
+		setdefault = readOnly
+		update = readOnly
+		__ior__ = readOnly
+		
+		def __reduce__(self):
+			return (FmdlFile.BoneMapping, (dict(self), ))
+	
 	class Face:
+		__slots__ = ('vertices', )
+		
 		def __init__(self, v1, v2, v3):
-			self.vertices = [v1, v2, v3]
+			self.vertices = (v1, v2, v3)
 	
 	class VertexFields:
 		def __init__(self):
@@ -306,6 +556,8 @@ class FmdlFile:
 			self.highPrecisionUv = False
 	
 	class VertexEncoding:
+		__slots__ = ('vertex', 'position', 'normal', 'tangent', 'color', 'boneMapping', 'uv')
+		
 		def __init__(self):
 			self.vertex = None
 			self.position = None
@@ -323,8 +575,11 @@ class FmdlFile:
 		}
 		
 		def __init__(self):
-			self.vertices = []
-			self.faces = []
+			self.vertexList = []
+			self.faceList = []
+			self.faceIndexList = None
+			self.vertexEncodingList = None
+			self.boneInfluenceArrays = None
 			self.boneGroup = None
 			self.materialInstance = None
 			self.alphaFlags = None
@@ -332,7 +587,146 @@ class FmdlFile:
 			self.vertexFields = None
 			# extension fields
 			self.extensionHeaders = set()
-			self.vertexEncoding = None
+			self.geometrySource = None
+		
+		#
+		# The geometry of a mesh consists of vertices, faces, and vertexEncoding.
+		#
+		# Faces of a parsed mesh are stored as faceIndices, an F x 3 array of
+		# indices into vertices. The Face objects are only built when faces is
+		# accessed.
+		#
+		# If NumPy is available, boneInfluences holds the encoded bone mappings
+		# of the vertices as arrays, see FmdlArrays.BoneInfluences, once they
+		# are known. Like vertexEncoding, it is derived from the vertices;
+		# assigning vertices clears it.
+		#
+		# Meshes read with FmdlFile.readFile(lazy = True) have a geometrySource
+		# instead, and decode their geometry from the file when it is first
+		# accessed. unloadGeometry() drops the decoded geometry again. Since the
+		# geometry can be edited in place once it has been handed out, accessing
+		# or assigning any part of it detaches the mesh from its source, after
+		# which unloadGeometry() leaves it alone; only vertexCount() and
+		# faceCount() do not.
+		#
+		def loadGeometry(self):
+			if self.geometrySource is not None and self.vertexList is None:
+				(self.vertexList, self.vertexEncodingList, self.faceIndexList, self.boneInfluenceArrays) = self.geometrySource.load()
+				self.faceList = None
+		
+		def unloadGeometry(self):
+			if self.geometrySource is not None:
+				self.vertexList = None
+				self.faceList = None
+				self.faceIndexList = None
+				self.vertexEncodingList = None
+				self.boneInfluenceArrays = None
+		
+		def detachGeometry(self):
+			self.loadGeometry()
+			self.geometrySource = None
+		
+		def vertexCount(self):
+			self.loadGeometry()
+			return len(self.vertexList)
+		
+		def faceCount(self):
+			self.loadGeometry()
+			if self.faceList is None:
+				return len(self.faceIndexList)
+			return len(self.faceList)
+		
+		@property
+		def vertices(self):
+			self.detachGeometry()
+			return self.vertexList
+		
+		@vertices.setter
+		def vertices(self, vertices):
+			self.detachGeometry()
+			self.vertexList = vertices
+			self.boneInfluenceArrays = None
+		
+		@property
+		def faces(self):
+			self.detachGeometry()
+			if self.faceList is None:
+				faceIndices = self.faceIndexList
+				if not isinstance(faceIndices, list):
+					faceIndices = faceIndices.tolist()
+				vertices = self.vertexList
+				self.faceList = [FmdlFile.Face(vertices[index1], vertices[index2], vertices[index3]) for (index1, index2, index3) in faceIndices]
+			return self.faceList
+		
+		@faces.setter
+		def faces(self, faces):
+			self.detachGeometry()
+			self.faceList = faces
+			self.faceIndexList = None
+		
+		@property
+		def faceIndices(self):
+			self.detachGeometry()
+			return self.faceIndexList
+		
+		@faceIndices.setter
+		def faceIndices(self, faceIndices):
+			self.detachGeometry()
+			self.faceIndexList = faceIndices
+			self.faceList = None
+		
+		@property
+		def vertexEncoding(self):
+			self.detachGeometry()
+			return self.vertexEncodingList
+		
+		@vertexEncoding.setter
+		def vertexEncoding(self, vertexEncoding):
+			self.detachGeometry()
+			self.vertexEncodingList = vertexEncoding
+		
+		@property
+		def boneInfluences(self):
+			self.detachGeometry()
+			return self.boneInfluenceArrays
+		
+		@boneInfluences.setter
+		def boneInfluences(self, boneInfluences):
+			self.detachGeometry()
+			self.boneInfluenceArrays = boneInfluences
+	
+	#
+	# Location of the geometry of a mesh in an open FmdlContainer, for meshes
+	# read with FmdlFile.readFile(lazy = True).
+	#
+	class MeshGeometrySource:
+		def __init__(self, fmdl, format, boneGroup, vertexCount, vertexBufferOffset, firstFaceVertexIndex, faceVertexCount):
+			self.fmdl = fmdl
+			self.format = format
+			self.boneGroup = boneGroup
+			self.vertexCount = vertexCount
+			self.vertexBufferOffset = vertexBufferOffset
+			self.firstFaceVertexIndex = firstFaceVertexIndex
+			self.faceVertexCount = faceVertexCount
+		
+		def load(self):
+			if self.fmdl.view is None:
+				raise ValueError("Cannot load mesh geometry from a closed fmdl file")
+			with Tracing.span('loadMeshGeometry', vertices = self.vertexCount, faces = self.faceVertexCount // 3):
+				(vertices, vertexEncodings, boneInfluences) = FmdlFile.parseVertices(self.fmdl, self.format, self.boneGroup, self.vertexCount)
+				faceIndices = FmdlFile.parseFaces(self.fmdl, self.vertexBufferOffset, self.firstFaceVertexIndex, self.faceVertexCount, self.vertexCount)
+			return (vertices, vertexEncodings, faceIndices, boneInfluences)
+		
+		#
+		# Decode the geometry into an FmdlArrays.MeshArrays, for
+		# FmdlFile.readFile(arrays = True).
+		#
+		def loadArrays(self):
+			if 2 not in self.fmdl.segment1Blocks:
+				raise InvalidFmdl("Vertex block not found")
+			with Tracing.span('loadMeshGeometry', vertices = self.vertexCount, faces = self.faceVertexCount // 3):
+				return arraysModule().MeshArrays.parse(self.fmdl.segment1Blocks[2], self.format, self.boneGroup, self.vertexCount,
+					self.vertexBufferOffset, self.firstFaceVertexIndex, self.faceVertexCount)
 	
 	class MeshGroup:
 		extensionHeaders = {
@@ -351,6 +745,115 @@ class FmdlFile:
 	
 	
 	
+	#
+	# Summary of an fmdl file, as returned by probe(). Contains everything
+	# except mesh geometry.
+	#
+	class Summary:
+		def __init__(self):
+			self.bones = []
+			self.materialInstances = []
+			self.meshes = []
+			self.meshGroups = []
+			self.extensionHeaders = {}
+	
+	class MeshSummary:
+		def __init__(self):
+			self.vertexCount = None
+			self.faceCount = None
+			self.boneGroup = None
+			self.materialInstance = None
+			self.alphaFlags = None
+			self.shadowFlags = None
+			self.extensionHeaders = set()
+	
+	#
+	# Layout of section 1 block 2, which holds the vertex position buffers,
+	# vertex data buffers and face buffers of all meshes. storeMeshes() plans
+	# where the data of each mesh goes; the data itself is only encoded when
+	# the file is written, straight into the output buffer.
+	#
+	class MeshBufferLayout:
+		def __init__(self):
+			self.positionBufferLength = 0
+			self.dataBufferLength = 0
+			self.faceBufferLength = 0
+			self.meshes = []
+		
+		#
+		# Reserve space for the vertices and faces of a mesh, and return the
+		# index of its first face vertex in the face buffer.
+		#
+		def addMesh(self, mesh, formatEntries, positionBufferEntrySize, dataBufferEntrySize, boneGroupIndices):
+			self.meshes.append((
+				mesh,
+				formatEntries,
+				positionBufferEntrySize,
+				dataBufferEntrySize,
+				boneGroupIndices,
+				self.positionBufferLength,
+				self.dataBufferLength,
+				self.faceBufferLength,
+			))
+			
+			firstFaceVertexID = self.faceBufferLength // 2
+			# Vertex buffers of each mesh are padded to 16 bytes.
+			self.positionBufferLength += (mesh.vertexCount() * positionBufferEntrySize + 15) & ~15
+			self.dataBufferLength += (mesh.vertexCount() * dataBufferEntrySize + 15) & ~15
+			self.faceBufferLength += mesh.faceCount() * 6
+			return firstFaceVertexID
+		
+		def length(self):
+			return self.positionBufferLength + self.dataBufferLength + self.faceBufferLength
+		
+		def write(self, buffer):
+			dataBufferStart = self.positionBufferLength
+			faceBufferStart = self.positionBufferLength + self.dataBufferLength
+			arrays = arraysModule()
+			for (
+				mesh,
+				formatEntries,
+				positionBufferEntrySize,
+				dataBufferEntrySize,
+				boneGroupIndices,
+				positionBufferOffset,
+				dataBufferOffset,
+				faceBufferOffset,
+			) in self.meshes:
+				with Tracing.span('writeMesh', vertices = mesh.vertexCount(), faces = mesh.faceCount()):
+					if arrays is not None:
+						arrays.addMesh(
+							mesh,
+							formatEntries,
+							positionBufferEntrySize,
+							dataBufferEntrySize,
+							boneGroupIndices,
+							buffer,
+							positionBufferOffset,
+							dataBufferStart + dataBufferOffset,
+							faceBufferStart + faceBufferOffset,
+						)
+						continue
+					
+					if mesh.vertexEncoding == None:
+						vertexEncoding = FmdlFile.encodeVertices(mesh.vertices, mesh.vertexFields)
+					else:
+						vertexEncoding = mesh.vertexEncoding
+					
+					vertexIndices = FmdlFile.addVertices(
+						vertexEncoding,
+						formatEntries,
+						positionBufferEntrySize,
+						dataBufferEntrySize,
+						boneGroupIndices,
+						buffer,
+						positionBufferOffset,
+						dataBufferStart + dataBufferOffset,
+					)
+					FmdlFile.addFaces(mesh.faces, buffer, faceBufferStart + faceBufferOffset, vertexIndices)
+	
+	
+	
 	class FmdlVertexDatumType:
 		position = 0
 		boneWeights = 1
@@ -374,6 +877,39 @@ class FmdlFile:
 		quadFloat8 = 8
 		quadInt8 = 9
 	
+	VERTEX_DATUM_NAMES = {
+		FmdlVertexDatumType.position: 'position',
+		FmdlVertexDatumType.boneWeights: 'bone weight',
+		FmdlVertexDatumType.normal: 'normal',
+		FmdlVertexDatumType.color: 'color',
+		FmdlVertexDatumType.boneIndices: 'bone index',
+		FmdlVertexDatumType.uv0: 'uv',
+		FmdlVertexDatumType.uv1: 'uv',
+		FmdlVertexDatumType.uv2: 'uv',
+		FmdlVertexDatumType.uv3: 'uv',
+		FmdlVertexDatumType.tangent: 'tangent',
+	}
+	
+	UV_DATUM_TYPES = [
+		FmdlVertexDatumType.uv0,
+		FmdlVertexDatumType.uv1,
+		FmdlVertexDatumType.uv2,
+		FmdlVertexDatumType.uv3,
+	]
+	
+	#
+	# Look up the entry for a vertex datum in $datumFormats, a map from datum
+	# type to a map from the allowed datum formats of that type to a
+	# codec-specific description of them.
+	#
+	@staticmethod
+	def vertexDatumFormat(datumFormats, datumType, datumFormat):
+		if datumType not in datumFormats:
+			raise InvalidFmdl("Unexpected vertex datum type %d" % datumType)
+		if datumFormat not in datumFormats[datumType]:
+			raise InvalidFmdl("Unexpected format %d for vertex %s data" % (datumFormat, FmdlFile.VERTEX_DATUM_NAMES[datumType]))
+		return datumFormats[datumType][datumFormat]
+	
 	
 	
 	def __init__(self):
@@ -382,11 +918,24 @@ class FmdlFile:
 		self.meshes = []
 		self.meshGroups = []
 		self.extensionHeaders = {}
+		self.container = None
+	
 	
 	
+	#
+	# parseFloat16() is a lookup in a table of all 65536 float16 values,
+	# computed on first use by computeFloat16().
+	#
+	float16Table = []
 	
 	@staticmethod
 	def parseFloat16(int16):
+		if len(FmdlFile.float16Table) == 0:
+			FmdlFile.float16Table.extend([FmdlFile.computeFloat16(i) for i in range(65536)])
+		return FmdlFile.float16Table[int16]
+	
+	@staticmethod
+	def computeFloat16(int16):
 		exponentBits = 5
 		exponentBias = 15
 		mantissaBits = 10
@@ -450,13 +999,12 @@ class FmdlFile:
 			return []
 		
 		bones = []
-		for definition in fmdl.segment0Blocks[0]:
+		for definition in fmdl.unpackBlock(0):
 			(
 				nameStringID,
 				parentBoneID,
 				boundingBoxID,
 				unknown,
-				padding,
 				localX,
 				localY,
 				localZ,
@@ -465,7 +1013,7 @@ class FmdlFile:
 				worldY,
 				worldZ,
 				worldW,
-			) = unpack('< H h H H Q 4f 4f', definition)
+			) = definition
 			
 			if not nameStringID < len(strings):
 				raise InvalidFmdl("Invalid string %d referenced by bone" % nameStringID)
@@ -509,19 +1057,14 @@ class FmdlFile:
 	
 	@staticmethod
 	def parseMeshGroups(fmdl, strings, boundingBoxes, meshes, extensionHeaders):
-		if 1 in fmdl.segment0Blocks:
-			block = fmdl.segment0Blocks[1]
-		else:
-			block = []
-		
 		meshGroups = []
-		for definition in block:
+		for definition in fmdl.unpackBlock(1):
 			(
 				nameStringID,
 				invisible,
 				parentID,
 				unknown,
-			) = unpack('< H H h h', definition)
+			) = definition
 			
 			if not nameStringID < len(strings):
 				raise InvalidFmdl("Invalid string %d referenced by mesh group" % (nameStringID))
@@ -585,20 +1128,20 @@ class FmdlFile:
 			return []
 		
 		assignments = []
-		for definition in fmdl.segment0Blocks[2]:
+		for definition in fmdl.unpackBlock(2):
 			(
 				meshGroupID,
 				meshCount,
 				firstMeshIndex,
 				boundingBoxID,
 				unknown,
-			) = unpack('< 4x HHHH 4x H 14x', definition)
+			) = definition
 			
 			assignments.append((meshGroupID, firstMeshIndex, meshCount, boundingBoxID))
 		return assignments
 	
 	@staticmethod
-	def parseMeshes(fmdl, bones, materialInstances, extensionHeaders):
+	def parseMeshes(fmdl, bones, materialInstances, extensionHeaders, lazy = False, arrays = False):
 		if 3 not in fmdl.segment0Blocks:
 			return []
 		
@@ -612,7 +1155,7 @@ class FmdlFile:
 			raise InvalidFmdl("Missing face buffer")
 		
 		meshes = []
-		for definition in fmdl.segment0Blocks[3]:
+		for definition in fmdl.unpackBlock(3):
 			(
 				alphaFlags,
 				shadowFlags,
@@ -623,7 +1166,7 @@ class FmdlFile:
 				firstFaceVertexIndex,
 				faceVertexCount,
 				firstFaceIndexID,
-			) = unpack('< BB 2x HHHH 4x IIQ 16x', definition)
+			) = definition
 			
 			if not meshFormatID < len(meshFormats):
 				raise InvalidFmdl("Invalid mesh format ID %d referenced by mesh" % meshFormatID)
@@ -708,18 +1251,23 @@ class FmdlFile:
 				raise InvalidFmdl("Invalid face index ID %d referenced by mesh" % firstFaceIndexID)
 			(lodFirstFaceVertexIndex, lodFaceVertexCount) = faceIndices[firstFaceIndexID]
 			
-			(vertices, vertexEncodings) = FmdlFile.parseVertices(fmdl, meshFormats[meshFormatID], boneGroup, vertexCount)
-			faces = FmdlFile.parseFaces(fmdl, bufferOffsets[2], firstFaceVertexIndex + lodFirstFaceVertexIndex, lodFaceVertexCount, vertices)
+			geometrySource = FmdlFile.MeshGeometrySource(fmdl, meshFormats[meshFormatID], boneGroup, vertexCount,
+				bufferOffsets[2], firstFaceVertexIndex + lodFirstFaceVertexIndex, lodFaceVertexCount)
 			
-			mesh = FmdlFile.Mesh()
-			mesh.vertices = vertices
-			mesh.faces = faces
+			if arrays:
+				mesh = geometrySource.loadArrays()
+			else:
+				mesh = FmdlFile.Mesh()
+				if lazy:
+					mesh.geometrySource = geometrySource
+					mesh.unloadGeometry()
+				else:
+					(mesh.vertices, mesh.vertexEncoding, mesh.faceIndices, mesh.boneInfluences) = geometrySource.load()
 			mesh.boneGroup = boneGroup
 			mesh.materialInstance = materialInstance
 			mesh.alphaFlags = alphaFlags
 			mesh.shadowFlags = shadowFlags
 			mesh.vertexFields = vertexFields
-			mesh.vertexEncoding = vertexEncodings
 			mesh.extensionHeaders = FmdlFile.parseObjectExtensionHeaders(extensionHeaders, FmdlFile.Mesh.extensionHeaders, len(meshes))
 			meshes.append(mesh)
 		return meshes
@@ -735,17 +1283,15 @@ class FmdlFile:
 		assignments = FmdlFile.parseTextureMaterialParameterAssignments(fmdl, strings)
 		
 		materialInstances = []
-		for definition in fmdl.segment0Blocks[4]:
+		for definition in fmdl.unpackBlock(4):
 			(
 				nameStringID,
-				padding0,
 				materialID,
 				textureCount,
 				materialParameterCount,
 				firstTextureID,
 				firstMaterialParameterID,
-				padding1
-			) = unpack('< H H H BB H H I', definition)
+			) = definition
 			
 			if not nameStringID < len(strings):
 				raise InvalidFmdl("Invalid string ID %d referenced by material instance" % nameStringID)
@@ -800,16 +1346,15 @@ class FmdlFile:
 			return []
 		
 		boneGroups = []
-		for definition in fmdl.segment0Blocks[5]:
+		for definition in fmdl.unpackBlock(5):
 			(
 				unknown,
 				entryCount,
-			) = unpack_from('< H H', definition, 0)
+			) = definition[0:2]
 			if entryCount > 32:
 				entryCount = 32
 			boneGroup = FmdlFile.BoneGroup()
-			for i in range(entryCount):
-				(boneID, ) = unpack_from('< H', definition, i * 2 + 4)
+			for boneID in definition[2 : 2 + entryCount]:
 				if not boneID < len(bones):
 					raise InvalidFmdl("Invalid bone ID %d referenced by bone group" % boneID)
 				boneGroup.bones.append(bones[boneID])
@@ -822,11 +1367,11 @@ class FmdlFile:
 			return []
 		
 		textures = []
-		for definition in fmdl.segment0Blocks[6]:
+		for definition in fmdl.unpackBlock(6):
 			(
 				filenameStringID,
 				directoryStringID,
-			) = unpack('< H H', definition)
+			) = definition
 			if not filenameStringID < len(strings):
 				raise InvalidFdml("Invalid string ID %d referenced by texture" % filenameStringID)
 			if not directoryStringID < len(strings):
@@ -844,11 +1389,11 @@ class FmdlFile:
 			return []
 		
 		assignments = []
-		for definition in fmdl.segment0Blocks[7]:
+		for definition in fmdl.unpackBlock(7):
 			(
 				parameterStringID,
 				referenceID,
-			) = unpack('< H H', definition)
+			) = definition
 			if not parameterStringID < len(strings):
 				raise InvalidFmdl("Invalid string ID %d referenced by texture / material parameter assignment" % parameterStringID)
 			assignments.append((strings[parameterStringID], referenceID))
@@ -860,11 +1405,11 @@ class FmdlFile:
 			return []
 		
 		materials = []
-		for definition in fmdl.segment0Blocks[8]:
+		for definition in fmdl.unpackBlock(8):
 			(
 				shaderStringID,
 				techniqueStringID,
-			) = unpack('< H H', definition)
+			) = definition
 			if not shaderStringID < len(strings):
 				raise InvalidFmdl("Invalid string ID %d referenced by material" % shaderStringID)
 			if not techniqueStringID < len(strings):
@@ -881,7 +1426,7 @@ class FmdlFile:
 		vertexFormatDefinitions = FmdlFile.parseVertexFormats(fmdl)
 		
 		meshFormatAssignments = []
-		for definition in fmdl.segment0Blocks[9]:
+		for definition in fmdl.unpackBlock(9):
 			(
 				meshFormatEntryCount,
 				vertexFormatEntryCount,
@@ -889,7 +1434,7 @@ class FmdlFile:
 				uvIndexCount,
 				firstMeshFormatID,
 				firstVertexFormatID,
-			) = unpack('< BB BB HH', definition)
+			) = definition
 			
 			if not firstMeshFormatID + meshFormatEntryCount <= len(meshFormatDefinitions):
 				raise InvalidFmdl("Invalid mesh format entry %d referenced by mesh format assignment" % (firstMeshFormatID + meshFormatEntryCount))
@@ -926,14 +1471,14 @@ class FmdlFile:
 			return []
 		
 		formatEntries = []
-		for definition in fmdl.segment0Blocks[10]:
+		for definition in fmdl.unpackBlock(10):
 			(
 				bufferID,
 				vertexFormatEntryCount,
 				bufferOffsetIncrement,
 				meshFormatType,
 				bufferOffset,
-			) = unpack('< BBBB I', definition)
+			) = definition
 			
 			formatEntries.append((bufferID, bufferOffset, bufferOffsetIncrement, vertexFormatEntryCount))
 		return formatEntries
@@ -944,12 +1489,12 @@ class FmdlFile:
 			return []
 		
 		formatEntries = []
-		for definition in fmdl.segment0Blocks[11]:
+		for definition in fmdl.unpackBlock(11):
 			(
 				datumType,
 				datumFormat,
 				offset,
-			) = unpack('< B B H', definition)
+			) = definition
 			
 			if datumType not in [
 				FmdlFile.FmdlVertexDatumType.position,
@@ -985,12 +1530,12 @@ class FmdlFile:
 		
 		lastStringPosition = 0
 		strings = []
-		for definition in fmdl.segment0Blocks[12]:
+		for definition in fmdl.unpackBlock(12):
 			(
 				blockID,
 				length,
 				offset,
-			) = unpack('< H H I', definition)
+			) = definition
 			
 			if blockID not in fmdl.segment1Blocks:
 				raise InvalidFmdl("Invalid block %d referenced by string" % blockID)
@@ -1052,11 +1597,11 @@ class FmdlFile:
 			return []
 		
 		boundingBoxes = []
-		for definition in fmdl.segment0Blocks[13]:
+		for definition in fmdl.unpackBlock(13):
 			(
 				maxX, maxY, maxZ, maxW,
 				minX, minY, minZ, minW,
-			) = unpack('< 8f', definition)
+			) = definition
 			boundingBoxes.append(
 				FmdlFile.BoundingBox(
 					FmdlFile.Vector4(minX, minY, minZ, minW),
@@ -1071,13 +1616,12 @@ class FmdlFile:
 			return []
 		
 		bufferOffsets = []
-		for definition in fmdl.segment0Blocks[14]:
+		for definition in fmdl.unpackBlock(14):
 			(
 				eof,
 				length,
 				offset,
-				padding,
-			) = unpack('< I I I I', definition)
+			) = definition
 			
 			bufferOffsets.append(offset)
 		return bufferOffsets
@@ -1087,16 +1631,17 @@ class FmdlFile:
 		if 16 not in fmdl.segment0Blocks:
 			raise InvalidFmdl("Level Of Detail specification missing")
 		
-		if len(fmdl.segment0Blocks[16]) != 1:
-			raise InvalidFmdl("Unexpected Level Of Detail specification, expected 1 record, found %s" % len(fmdl.segment0Blocks[16]))
+		block = fmdl.unpackBlock(16)
+		if len(block) != 1:
+			raise InvalidFmdl("Unexpected Level Of Detail specification, expected 1 record, found %s" % len(block))
 		
-		definition = fmdl.segment0Blocks[16][0]
+		definition = block[0]
 		(
 			lodCount,
 			unknown0,
 			unknown1,
 			unknown2,
-		) = unpack('< I 3f', definition)
+		) = definition
 		
 		return lodCount
 	
@@ -1106,11 +1651,11 @@ class FmdlFile:
 			return []
 		
 		faceIndices = []
-		for definition in fmdl.segment0Blocks[17]:
+		for definition in fmdl.unpackBlock(17):
 			(
 				firstFaceVertexIndex,
 				faceVertexCount,
-			) = unpack('< I I', definition)
+			) = definition
 			faceIndices.append((firstFaceVertexIndex, faceVertexCount))
 		return faceIndices
 	
@@ -1120,13 +1665,14 @@ class FmdlFile:
 			return []
 		
 		materialParametersBlock = fmdl.segment1Blocks[0]
-		materialParameters = []
-		for index in range(len(materialParametersBlock) // 16):
-			offset = index * 16
-			parameters = unpack_from('< 4f', materialParametersBlock, offset)
-			materialParameters.append(parameters)
-		return materialParameters
-	
+		length = len(materialParametersBlock) - (len(materialParametersBlock) % 16)
+		return list(struct.iter_unpack('< 4f', materialParametersBlock[0 : length]))
+	
+	#
+	# Returns (vertices, vertex encodings, bone influences), where the bone
+	# influences are the FmdlArrays.BoneInfluences of the mesh if NumPy is
+	# available and the mesh has bone mappings, and None otherwise.
+	#
 	@staticmethod
 	def parseVertices(fmdl, format, boneGroup, vertexCount):
 		#
@@ -1141,129 +1687,36 @@ class FmdlFile:
 		
 		vertexBuffer = fmdl.segment1Blocks[2]
 		
-		vertices = []
-		vertexEncodings = []
-		for vertexIndex in range(vertexCount):
-			vertex = FmdlFile.Vertex()
-			vertexEncoding = FmdlFile.VertexEncoding()
-			vertexEncoding.vertex = vertex
-			
-			uvEncoding = [None for i in range(4)]
-			uv = [None for i in range(4)]
-			boneWeights = None
-			boneIndices = None
-			
-			for (datumType, datumFormat, offset, increment) in format:
-				position = offset + vertexIndex * increment
-				
-				if datumType == FmdlFile.FmdlVertexDatumType.position:
-					if datumFormat != FmdlFile.FmdlVertexDatumFormat.tripleFloat32:
-						raise InvalidFmdl("Unexpected format %d for vertex position data" % datumFormat)
-					vertexEncoding.position = vertexBuffer[position : position + 12]
-					value = unpack('< 3f', vertexEncoding.position)
-					vertex.position = FmdlFile.Vector3(value[0], value[1], value[2])
-				elif datumType == FmdlFile.FmdlVertexDatumType.boneWeights:
-					if datumFormat != FmdlFile.FmdlVertexDatumFormat.quadFloat8:
-						raise InvalidFmdl("Unexpected format %d for vertex bone weight data" % datumFormat)
-					boneWeights = unpack('< 4B', vertexBuffer[position : position + 4])
-				elif datumType == FmdlFile.FmdlVertexDatumType.normal:
-					if datumFormat != FmdlFile.FmdlVertexDatumFormat.quadFloat16:
-						raise InvalidFmdl("Unexpected format %d for vertex normal data" % datumFormat)
-					vertexEncoding.normal = vertexBuffer[position : position + 8]
-					value = [FmdlFile.parseFloat16(x) for x in unpack('< 4H', vertexEncoding.normal)]
-					vertex.normal = FmdlFile.Vector4(value[0], value[1], value[2], value[3])
-				elif datumType == FmdlFile.FmdlVertexDatumType.color:
-					if datumFormat != FmdlFile.FmdlVertexDatumFormat.quadFloat8:
-						raise InvalidFmdl("Unexpected format %d for vertex color data" % datumFormat)
-					vertexEncoding.color = vertexBuffer[position : position + 4]
-					vertex.color = [x / 255.0 for x in unpack('< 4B', vertexEncoding.color)]
-				elif datumType == FmdlFile.FmdlVertexDatumType.boneIndices:
-					if datumFormat != FmdlFile.FmdlVertexDatumFormat.quadInt8:
-						raise InvalidFmdl("Unexpected format %d for vertex bone index data" % datumFormat)
-					boneIndices = unpack('< 4B', vertexBuffer[position : position + 4])
-				elif datumType == FmdlFile.FmdlVertexDatumType.uv0:
-					if datumFormat == FmdlFile.FmdlVertexDatumFormat.doubleFloat16:
-						uvEncoding[0] = vertexBuffer[position : position + 4]
-						value = [FmdlFile.parseFloat16(x) for x in unpack('< 2H', uvEncoding[0])]
-					elif datumFormat == FmdlFile.FmdlVertexDatumFormat.doubleFloat32:
-						uvEncoding[0] = vertexBuffer[position : position + 8]
-						value = unpack('< 2f', uvEncoding[0])
-					else:
-						raise InvalidFmdl("Unexpected format %d for vertex uv data" % datumFormat)
-					uv[0] = FmdlFile.Vector2(value[0], value[1])
-				elif datumType == FmdlFile.FmdlVertexDatumType.uv1:
-					if datumFormat == FmdlFile.FmdlVertexDatumFormat.doubleFloat16:
-						uvEncoding[1] = vertexBuffer[position : position + 4]
-						value = [FmdlFile.parseFloat16(x) for x in unpack('< 2H', uvEncoding[1])]
-					elif datumFormat == FmdlFile.FmdlVertexDatumFormat.doubleFloat32:
-						uvEncoding[1] = vertexBuffer[position : position + 8]
-						value = unpack('< 2f', uvEncoding[1])
-					uv[1] = FmdlFile.Vector2(value[0], value[1])
-				elif datumType == FmdlFile.FmdlVertexDatumType.uv2:
-					if datumFormat == FmdlFile.FmdlVertexDatumFormat.doubleFloat16:
-						uvEncoding[2] = vertexBuffer[position : position + 4]
-						value = [FmdlFile.parseFloat16(x) for x in unpack('< 2H', uvEncoding[2])]
-					elif datumFormat == FmdlFile.FmdlVertexDatumFormat.doubleFloat32:
-						uvEncoding[2] = vertexBuffer[position : position + 8]
-						value = unpack('< 2f', uvEncoding[2])
-					uv[2] = FmdlFile.Vector2(value[0], value[1])
-				elif datumType == FmdlFile.FmdlVertexDatumType.uv3:
-					if datumFormat == FmdlFile.FmdlVertexDatumFormat.doubleFloat16:
-						uvEncoding[3] = vertexBuffer[position : position + 4]
-						value = [FmdlFile.parseFloat16(x) for x in unpack('< 2H', uvEncoding[3])]
-					elif datumFormat == FmdlFile.FmdlVertexDatumFormat.doubleFloat32:
-						uvEncoding[3] = vertexBuffer[position : position + 8]
-						value = unpack('< 2f', uvEncoding[3])
-					uv[3] = FmdlFile.Vector2(value[0], value[1])
-				elif datumType == FmdlFile.FmdlVertexDatumType.tangent:
-					if datumFormat != FmdlFile.FmdlVertexDatumFormat.quadFloat16:
-						raise InvalidFmdl("Unexpected format %d for vertex tangent data" % datumFormat)
-					vertexEncoding.tangent = vertexBuffer[position : position + 8]
-					value = [FmdlFile.parseFloat16(x) for x in unpack('< 4H', vertexEncoding.tangent)]
-					vertex.tangent = FmdlFile.Vector4(value[0], value[1], value[2], value[3])
-				else:
-					raise InvalidFmdl("Unexpected vertex datum type %d" % datumType)
-			
-			for i in range(4):
-				if uv[i] != None:
-					vertex.uv.append(uv[i])
-					vertexEncoding.uv.append(uvEncoding[i])
-			
-			if boneWeights != None:
-				vertex.boneMapping = {}
-				vertexEncoding.boneMapping = []
-				for i in range(4):
-					if boneWeights[i] > 0:
-						if not boneIndices[i] < len(boneGroup.bones):
-							#
-							# This happens a fair few times in real models.
-							# Let's just ignore the bone weighting instead.
-							#
-							# WARNING
-							#raise InvalidFmdl("Invalid bone ID %d referenced by vertex" % boneIndices[i])
-							continue
-						
-						vertex.boneMapping[boneGroup.bones[boneIndices[i]]] = boneWeights[i] / 255.0
-						vertexEncoding.boneMapping.append((boneGroup.bones[boneIndices[i]], boneWeights[i]))
-			
-			vertices.append(vertex)
-			vertexEncodings.append(vertexEncoding)
-		return (vertices, vertexEncodings)
+		arrays = arraysModule()
+		if arrays is not None:
+			return arrays.parseVertices(vertexBuffer, format, boneGroup, vertexCount)
+		
+		from . import FmdlVertexCodecs
+		(vertices, vertexEncodings) = FmdlVertexCodecs.decodeVertices(vertexBuffer, format, boneGroup, vertexCount)
+		return (vertices, vertexEncodings, None)
 	
+	#
+	# Returns the faces of a mesh as vertex indices: an F x 3 uint16 array if
+	# NumPy is available, a list of index triples otherwise.
+	#
 	@staticmethod
-	def parseFaces(fmdl, vertexBufferOffset, firstFaceVertexIndex, faceVertexCount, vertices):
+	def parseFaces(fmdl, vertexBufferOffset, firstFaceVertexIndex, faceVertexCount, vertexCount):
 		if 2 not in fmdl.segment1Blocks:
 			raise InvalidFmdl("Vertex block not found")
 		
 		vertexBuffer = fmdl.segment1Blocks[2]
 		
+		arrays = arraysModule()
+		if arrays is not None:
+			return arrays.parseFaces(vertexBuffer, vertexBufferOffset, firstFaceVertexIndex, faceVertexCount, vertexCount)
+		
 		faces = []
 		for faceVertexIndex in range(firstFaceVertexIndex, firstFaceVertexIndex + faceVertexCount, 3):
 			position = faceVertexIndex * 2 + vertexBufferOffset
 			(index1, index2, index3) = unpack_from('< HHH', vertexBuffer, position)
-			if not index1 < len(vertices) and index2 < len(vertices) and index3 < len(vertices):
+			if not (index1 < vertexCount and index2 < vertexCount and index3 < vertexCount):
 				raise InvalidFmdl("Invalid vertex referenced by face")
-			faces.append(FmdlFile.Face(vertices[index1], vertices[index2], vertices[index3]))
+			faces.append((index1, index2, index3))
 		return faces
 	
 	@staticmethod
@@ -1275,16 +1728,52 @@ class FmdlFile:
 				output.add(key)
 		return output
 	
-	def readFile(self, filename):
+	#
+	# If $lazy is set, mesh geometry is not decoded until it is first accessed,
+	# and the file stays mapped until close() is called; see Mesh.
+	#
+	# If $arrays is set, meshes are read as FmdlArrays.MeshArrays instead of
+	# Mesh objects. This needs NumPy.
+	#
+	@Tracing.traced('FmdlFile.readFile')
+	def readFile(self, filename, lazy = False, arrays = False):
+		if arrays and lazy:
+			raise ValueError("Meshes read as arrays cannot be loaded lazily")
+		if arrays and arraysModule() is None:
+			raise ValueError("Reading meshes as arrays needs NumPy")
+		
+		self.close()
+		
 		fmdl = FmdlContainer()
-		fmdl.readFile(filename)
+		with Tracing.stage('FmdlContainer.readFile'):
+			fmdl.readFile(filename)
+		
+		try:
+			with Tracing.span('parseStrings'):
+				(strings, extensionHeaders) = self.parseStrings(fmdl)
+			with Tracing.span('parseBones'):
+				boundingBoxes = self.parseBoundingBoxes(fmdl)
+				bones = self.parseBones(fmdl, strings, boundingBoxes)
+			with Tracing.span('parseMaterialInstances'):
+				materialInstances = self.parseMaterialInstances(fmdl, strings)
+			with Tracing.stage('parseMeshes') as span:
+				meshes = self.parseMeshes(fmdl, bones, materialInstances, extensionHeaders, lazy, arrays)
+				span.set(meshes = len(meshes))
+			with Tracing.span('parseMeshGroups'):
+				meshGroups = self.parseMeshGroups(fmdl, strings, boundingBoxes, meshes, extensionHeaders)
+		except:
+			fmdl.close()
+			raise
 		
-		(strings, extensionHeaders) = self.parseStrings(fmdl)
-		boundingBoxes = self.parseBoundingBoxes(fmdl)
-		bones = self.parseBones(fmdl, strings, boundingBoxes)
-		materialInstances = self.parseMaterialInstances(fmdl, strings)
-		meshes = self.parseMeshes(fmdl, bones, materialInstances, extensionHeaders)
-		meshGroups = self.parseMeshGroups(fmdl, strings, boundingBoxes, meshes, extensionHeaders)
+		#
+		# All parse functions copy what they need out of the container, so
+		# that unless geometry is loaded lazily, the file can be unmapped as
+		# soon as parsing is done.
+		#
+		if lazy:
+			self.container = fmdl
+		else:
+			fmdl.close()
 		
 		self.bones = bones
 		self.materialInstances = materialInstances
@@ -1292,6 +1781,149 @@ class FmdlFile:
 		self.meshGroups = meshGroups
 		self.extensionHeaders = extensionHeaders
 	
+	#
+	# Drop the decoded geometry of all lazily loaded meshes.
+	#
+	def unloadGeometry(self):
+		for mesh in self.meshes:
+			mesh.unloadGeometry()
+	
+	#
+	# Close the file backing lazily loaded meshes. Geometry that has not been
+	# loaded by then can no longer be accessed.
+	#
+	def close(self):
+		if self.container is not None:
+			self.container.close()
+			self.container = None
+	
+	def __enter__(self):
+		return self
+	
+	def __exit__(self, excType, excValue, traceback):
+		self.close()
+	
+	#
+	# Read a single mesh from an fmdl file, decoding the geometry of only that
+	# mesh. $meshID is either the index of a mesh in the file, in which case
+	# that mesh is returned, or the name of a mesh group, in which case a list
+	# of the meshes in that mesh group is returned. Meshes split by the
+	# mesh-splitting extension are combined back into a single mesh.
+	#
+	@staticmethod
+	def readMesh(filename, meshID):
+		# FmdlMeshSplitting depends on this module.
+		from . import FmdlMeshSplitting
+		
+		with FmdlFile() as fmdlFile:
+			fmdlFile.readFile(filename, lazy = True)
+			
+			splitMeshGroups = {}
+			extensionHeaders = fmdlFile.extensionHeaders
+			if extensionHeaders is not None and 'x-fmdl-extensions' in extensionHeaders and 'mesh-splitting' in extensionHeaders['x-fmdl-extensions']:
+				for meshGroup in fmdlFile.meshGroups:
+					if 'split-mesh-groups' in meshGroup.extensionHeaders:
+						for mesh in meshGroup.meshes:
+							splitMeshGroups[mesh] = meshGroup
+			
+			def resolveMeshes(meshes):
+				output = []
+				combinedMeshGroups = set()
+				for mesh in meshes:
+					if mesh not in splitMeshGroups:
+						mesh.detachGeometry()
+						output.append(mesh)
+					elif splitMeshGroups[mesh] not in combinedMeshGroups:
+						splitMeshGroup = splitMeshGroups[mesh]
+						combinedMeshGroups.add(splitMeshGroup)
+						output.append(FmdlMeshSplitting.combineMeshes(splitMeshGroup.meshes, fmdlFile.bones))
+				return output
+			
+			if isinstance(meshID, str):
+				for meshGroup in fmdlFile.meshGroups:
+					if meshGroup.name == meshID:
+						break
+				else:
+					raise ValueError("No mesh group named '%s' in fmdl file" % meshID)
+				
+				meshes = meshGroup.meshes.copy()
+				for child in meshGroup.children:
+					if 'split-mesh-groups' in child.extensionHeaders:
+						meshes += child.meshes
+				return resolveMeshes(meshes)
+			
+			if not 0 <= meshID < len(fmdlFile.meshes):
+				raise ValueError("No mesh %d in fmdl file" % meshID)
+			return resolveMeshes([fmdlFile.meshes[meshID]])[0]
+	
+	#
+	# Read everything but the mesh geometry of an fmdl file: bones, material
+	# instances and their textures, mesh groups, extension headers, and per
+	# mesh its vertex and face counts. This reads only the section 0 blocks,
+	# the string block and the material parameter block, and never touches
+	# the vertex buffer, making it suitable for scanning large libraries.
+	#
+	@staticmethod
+	def probe(filename):
+		fmdl = FmdlContainer()
+		fmdl.readFile(filename, section1BlockIDs = {0, 3})
+		
+		with fmdl:
+			(strings, extensionHeaders) = FmdlFile.parseStrings(fmdl)
+			boundingBoxes = FmdlFile.parseBoundingBoxes(fmdl)
+			bones = FmdlFile.parseBones(fmdl, strings, boundingBoxes)
+			materialInstances = FmdlFile.parseMaterialInstances(fmdl, strings)
+			meshes = FmdlFile.probeMeshes(fmdl, bones, materialInstances, extensionHeaders)
+			meshGroups = FmdlFile.parseMeshGroups(fmdl, strings, boundingBoxes, meshes, extensionHeaders)
+		
+		summary = FmdlFile.Summary()
+		summary.bones = bones
+		summary.materialInstances = materialInstances
+		summary.meshes = meshes
+		summary.meshGroups = meshGroups
+		summary.extensionHeaders = extensionHeaders
+		return summary
+	
+	@staticmethod
+	def probeMeshes(fmdl, bones, materialInstances, extensionHeaders):
+		if 3 not in fmdl.segment0Blocks:
+			return []
+		
+		boneGroups = FmdlFile.parseBoneGroups(fmdl, bones)
+		faceIndices = FmdlFile.parseFaceIndices(fmdl)
+		
+		meshes = []
+		for definition in fmdl.unpackBlock(3):
+			(
+				alphaFlags,
+				shadowFlags,
+				materialInstanceID,
+				boneGroupID,
+				meshFormatID,
+				vertexCount,
+				firstFaceVertexIndex,
+				faceVertexCount,
+				firstFaceIndexID,
+			) = definition
+			
+			if not materialInstanceID < len(materialInstances):
+				raise InvalidFmdl("Invalid material instance ID %d referenced by mesh" % materialInstanceID)
+			if not firstFaceIndexID < len(faceIndices):
+				raise InvalidFmdl("Invalid face index ID %d referenced by mesh" % firstFaceIndexID)
+			(lodFirstFaceVertexIndex, lodFaceVertexCount) = faceIndices[firstFaceIndexID]
+			
+			mesh = FmdlFile.MeshSummary()
+			mesh.vertexCount = vertexCount
+			mesh.faceCount = (lodFaceVertexCount + 2) // 3
+			if boneGroupID < len(boneGroups):
+				mesh.boneGroup = boneGroups[boneGroupID]
+			mesh.materialInstance = materialInstances[materialInstanceID]
+			mesh.alphaFlags = alphaFlags
+			mesh.shadowFlags = shadowFlags
+			mesh.extensionHeaders = FmdlFile.parseObjectExtensionHeaders(extensionHeaders, FmdlFile.Mesh.extensionHeaders, len(meshes))
+			meshes.append(mesh)
+		return meshes
+	
 	
 	
 	@staticmethod
@@ -1306,6 +1938,10 @@ class FmdlFile:
 		fmdl.segment0Blocks[blockID].append(block)
 		return ID
 	
+	@staticmethod
+	def addSegment0Entry(fmdl, blockID, *fields):
+		return FmdlFile.addSegment0Block(fmdl, blockID, FmdlContainer.SECTION0_BLOCK_SCHEMAS[blockID].struct.pack(*fields))
+	
 	@staticmethod
 	def addBone(fmdl, stringIndices, bone, boneIndices):
 		if bone.parent != None and bone.parent in boneIndices:
@@ -1313,15 +1949,14 @@ class FmdlFile:
 		else:
 			parentBoneID = -1
 		
-		return FmdlFile.addSegment0Block(fmdl, 0, pack('< H h H H Q 4f 4f',
+		return FmdlFile.addSegment0Entry(fmdl, 0,
 			FmdlFile.addString(fmdl, stringIndices, bone.name),
 			parentBoneID,
 			FmdlFile.addBoundingBox(fmdl, bone.boundingBox),
 			1, #unknown
-			0, #padding
 			bone.localPosition.x, bone.localPosition.y, bone.localPosition.z, bone.localPosition.w,
 			bone.globalPosition.x, bone.globalPosition.y, bone.globalPosition.z, bone.globalPosition.w,
-		))
+		)
 	
 	@staticmethod
 	def addMeshGroup(fmdl, stringIndices, meshGroup, meshGroupIndices, meshIndices):
@@ -1330,12 +1965,12 @@ class FmdlFile:
 		else:
 			parentMeshGroupID = meshGroupIndices[meshGroup.parent]
 		
-		meshGroupID = FmdlFile.addSegment0Block(fmdl, 1, pack('< H H h h',
+		meshGroupID = FmdlFile.addSegment0Entry(fmdl, 1,
 			FmdlFile.addString(fmdl, stringIndices, meshGroup.name),
 			1 if meshGroup.visible is False else 0,
 			parentMeshGroupID,
 			-1,
-		))
+		)
 		
 		boundingBoxID = FmdlFile.addBoundingBox(fmdl, meshGroup.boundingBox)
 		
@@ -1361,21 +1996,16 @@ class FmdlFile:
 	
 	@staticmethod
 	def addMeshGroupAssignment(fmdl, meshGroupID, firstMeshID, meshCount, boundingBoxID):
-		return FmdlFile.addSegment0Block(fmdl, 2, pack('< 4x HHHH 4x H 14x',
+		return FmdlFile.addSegment0Entry(fmdl, 2,
 			meshGroupID,
 			meshCount,
 			firstMeshID,
 			boundingBoxID,
 			0,
-		))
+		)
 	
 	@staticmethod
-	def addMesh(fmdl, mesh, boneIndices, materialInstanceID, levelsOfDetail, vertexPositionBuffer, vertexDataBuffer, faceBuffer):
-		if mesh.vertexEncoding == None:
-			vertexEncoding = FmdlFile.encodeVertices(mesh.vertices, mesh.vertexFields)
-		else:
-			vertexEncoding = mesh.vertexEncoding
-		
+	def addMesh(fmdl, mesh, boneIndices, materialInstanceID, levelsOfDetail, meshBufferLayout):
 		if mesh.vertexFields.hasBoneMapping:
 			(boneGroupID, boneGroupIndices) = FmdlFile.addBoneGroup(fmdl, mesh.boneGroup, boneIndices)
 		else:
@@ -1387,35 +2017,31 @@ class FmdlFile:
 			vertexFormatEntries,
 			positionBufferEntrySize,
 			dataBufferEntrySize,
-		) = FmdlFile.addMeshFormatAssignment(fmdl, mesh.vertexFields, len(vertexPositionBuffer), len(vertexDataBuffer))
+		) = FmdlFile.addMeshFormatAssignment(fmdl, mesh.vertexFields, meshBufferLayout.positionBufferLength, meshBufferLayout.dataBufferLength)
+		
+		firstFaceIndexID = FmdlFile.newSegment0BlockDescriptorID(fmdl, 17)
+		for i in range(levelsOfDetail):
+			FmdlFile.addFaceIndex(fmdl, mesh.faceCount())
 		
-		vertexIndices = FmdlFile.addVertices(
-			vertexEncoding,
+		firstFaceVertexID = meshBufferLayout.addMesh(
+			mesh,
 			vertexFormatEntries,
 			positionBufferEntrySize,
 			dataBufferEntrySize,
 			boneGroupIndices,
-			vertexPositionBuffer,
-			vertexDataBuffer,
 		)
 		
-		firstFaceIndexID = FmdlFile.newSegment0BlockDescriptorID(fmdl, 17)
-		for i in range(levelsOfDetail):
-			FmdlFile.addFaceIndex(fmdl, mesh.faces)
-		
-		firstFaceVertexID = FmdlFile.addFaces(fmdl, mesh.faces, faceBuffer, vertexIndices)
-		
-		return FmdlFile.addSegment0Block(fmdl, 3, pack('< BB 2x HHHH 4x IIQ 16x',
+		return FmdlFile.addSegment0Entry(fmdl, 3,
 			mesh.alphaFlags,
 			mesh.shadowFlags,
 			materialInstanceID,
 			boneGroupID,
 			meshFormatAssignmentID,
-			len(mesh.vertices),
+			mesh.vertexCount(),
 			firstFaceVertexID,
-			len(mesh.faces) * 3,
+			mesh.faceCount() * 3,
 			firstFaceIndexID,
-		))
+		)
 	
 	@staticmethod
 	def addMaterialInstance(fmdl, stringIndices, materialInstance):
@@ -1434,56 +2060,53 @@ class FmdlFile:
 			materialParameterValuesID = FmdlFile.addMaterialParameterValues(fmdl, values)
 			FmdlFile.addTextureMaterialParameterAssignment(fmdl, stringIndices, parameter, materialParameterValuesID)
 		
-		return FmdlFile.addSegment0Block(fmdl, 4, pack('< H H H BB H H I',
+		return FmdlFile.addSegment0Entry(fmdl, 4,
 			nameStringID,
-			0, #padding
 			materialID,
 			textureCount,
 			materialParameterCount,
 			firstTextureAssignmentID,
 			firstMaterialParameterAssignmentID,
-			0, #padding
-		))
+		)
 	
 	@staticmethod
 	def addBoneGroup(fmdl, boneGroup, boneIndices):
 		if len(boneGroup.bones) > 32:
 			raise InvalidFmdl("Too many bones in bone group")
-		descriptor = bytearray(68)
-		pack_into('< HH', descriptor, 0,
-			4, #unknown
-			len(boneGroup.bones),
-		)
 		
 		boneGroupIndices = {}
+		boneIDs = [0 for i in range(32)]
 		for i in range(len(boneGroup.bones)):
-			boneIndex = boneIndices[boneGroup.bones[i]]
-			pack_into('< H', descriptor, i * 2 + 4, boneIndex)
+			boneIDs[i] = boneIndices[boneGroup.bones[i]]
 			boneGroupIndices[boneGroup.bones[i]] = i
 		
-		boneGroupID = FmdlFile.addSegment0Block(fmdl, 5, descriptor)
+		boneGroupID = FmdlFile.addSegment0Entry(fmdl, 5,
+			4, #unknown
+			len(boneGroup.bones),
+			*boneIDs
+		)
 		return (boneGroupID, boneGroupIndices)
 	
 	@staticmethod
 	def addTexture(fmdl, stringIndices, filename, directory):
-		return FmdlFile.addSegment0Block(fmdl, 6, pack('< H H',
+		return FmdlFile.addSegment0Entry(fmdl, 6,
 			FmdlFile.addString(fmdl, stringIndices, filename),
 			FmdlFile.addString(fmdl, stringIndices, directory),
-		))
+		)
 	
 	@staticmethod
 	def addTextureMaterialParameterAssignment(fmdl, stringIndices, parameterName, valueID):
-		return FmdlFile.addSegment0Block(fmdl, 7, pack('< H H',
+		return FmdlFile.addSegment0Entry(fmdl, 7,
 			FmdlFile.addString(fmdl, stringIndices, parameterName),
 			valueID,
-		))
+		)
 	
 	@staticmethod
 	def addMaterial(fmdl, stringIndices, shader, technique):
-		return FmdlFile.addSegment0Block(fmdl, 8, pack('< H H',
+		return FmdlFile.addSegment0Entry(fmdl, 8,
 			FmdlFile.addString(fmdl, stringIndices, shader),
 			FmdlFile.addString(fmdl, stringIndices, technique),
-		))
+		)
 	
 	@staticmethod
 	def addMeshFormatAssignment(fmdl, vertexFields, vertexPositionBufferOffset, vertexDataBufferOffset):
@@ -1568,28 +2191,28 @@ class FmdlFile:
 		meshFormatCount = FmdlFile.newSegment0BlockDescriptorID(fmdl, 10) - firstMeshFormatID
 		vertexFormatCount = FmdlFile.newSegment0BlockDescriptorID(fmdl, 11) - firstVertexFormatID
 		
-		meshFormatAssignmentID = FmdlFile.addSegment0Block(fmdl, 9, pack('< BBBB HH',
+		meshFormatAssignmentID = FmdlFile.addSegment0Entry(fmdl, 9,
 			meshFormatCount,
 			vertexFormatCount,
 			0,
 			vertexFields.uvCount,
 			firstMeshFormatID,
 			firstVertexFormatID,
-		))
+		)
 		
 		return (meshFormatAssignmentID, formatEntries, bufferOffsets[0], bufferOffsets[1])
 	
 	@staticmethod
 	def addMeshFormat(fmdl, bufferID, vertexFormatEntryCount, bufferOffsetIncrement, meshFormatType, bufferOffset):
-		return FmdlFile.addSegment0Block(fmdl, 10, pack('< BBBB I',
+		return FmdlFile.addSegment0Entry(fmdl, 10,
 			bufferID, vertexFormatEntryCount, bufferOffsetIncrement, meshFormatType, bufferOffset,
-		))
+		)
 	
 	@staticmethod
 	def addVertexFormat(fmdl, datumType, datumFormat, offset):
-		return FmdlFile.addSegment0Block(fmdl, 11, pack('< BB H',
+		return FmdlFile.addSegment0Entry(fmdl, 11,
 			datumType, datumFormat, offset,
-		))
+		)
 	
 	@staticmethod
 	def addString(fmdl, stringIndices, string):
@@ -1605,42 +2228,42 @@ class FmdlFile:
 		fmdl.segment1Blocks[3] += encoded
 		fmdl.segment1Blocks[3] += b'\0'
 		
-		index = FmdlFile.addSegment0Block(fmdl, 12, pack('< H H I',
+		index = FmdlFile.addSegment0Entry(fmdl, 12,
 			3,
 			len(encoded),
 			offset,
-		))
+		)
 		stringIndices[string] = index
 		return index
 	
 	@staticmethod
 	def addBoundingBox(fmdl, boundingBox):
-		return FmdlFile.addSegment0Block(fmdl, 13, pack('< 8f',
+		return FmdlFile.addSegment0Entry(fmdl, 13,
 			boundingBox.max.x, boundingBox.max.y, boundingBox.max.z, boundingBox.max.w,
 			boundingBox.min.x, boundingBox.min.y, boundingBox.min.z, boundingBox.min.w,
-		))
+		)
 	
 	@staticmethod
 	def addBufferOffset(fmdl, last, length, offset):
-		return FmdlFile.addSegment0Block(fmdl, 14, pack('< III 4x',
+		return FmdlFile.addSegment0Entry(fmdl, 14,
 			1 if last else 0,
 			length,
 			offset,
-		))
+		)
 	
 	@staticmethod
 	def addLevelsOfDetail(fmdl, levels):
-		FmdlFile.addSegment0Block(fmdl, 16, pack('< I fff',
+		FmdlFile.addSegment0Entry(fmdl, 16,
 			levels,
 			1.0, 1.0, 1.0,
-		))
+		)
 	
 	@staticmethod
-	def addFaceIndex(fmdl, faces):
-		return FmdlFile.addSegment0Block(fmdl, 17, pack('< II',
+	def addFaceIndex(fmdl, faceCount):
+		return FmdlFile.addSegment0Entry(fmdl, 17,
 			0,
-			len(faces) * 3,
-		))
+			faceCount * 3,
+		)
 	
 	@staticmethod
 	def addMaterialParameterValues(fmdl, parameterValues):
@@ -1651,8 +2274,23 @@ class FmdlFile:
 		fmdl.segment1Blocks[0] += pack('< 4f', *parameterValues)
 		return index
 	
+	#
+	# $boneInfluences, if given, are the FmdlArrays.BoneInfluences of
+	# $vertices, which the array encoder uses instead of encoding the bone
+	# mappings again.
+	#
 	@staticmethod
-	def encodeVertices(vertices, vertexFields):
+	def encodeVertices(vertices, vertexFields, boneInfluences = None):
+		arrays = arraysModule()
+		if arrays is not None:
+			return arrays.encodeVertices(vertices, vertexFields, boneInfluences)
+		
+		#
+		# Vertices often share their bone mapping object, so each distinct
+		# object is only encoded once.
+		#
+		encodedBoneMappings = {}
+		
 		vertexEncodings = []
 		for vertexIndex in range(len(vertices)):
 			vertexEncoding = FmdlFile.VertexEncoding()
@@ -1680,132 +2318,62 @@ class FmdlFile:
 								(vertex.uv[i].u, vertex.uv[i].v)
 						)))
 			if vertexFields.hasBoneMapping:
-				#
-				# fmdl bone mappings support at most 4 bones, and store weights as 8-bit integers.
-				# Pack the desired bone mapping into this constraint as accurately as possible:
-				# - If the desired bone mapping contains more than 4 bones, simplify it
-				#   down to 4 bones, keeping the total weight identical
-				# - Round bone weights to units of N/255, in such a way that the total bone weight
-				#   does not change more than one rounding error. In particular, a rounded total weight
-				#   of 1 must remain a total weight of 1 after elementwise rounding.
-				#
-				orderedBones = sorted(vertex.boneMapping.items(), key = (lambda pair: (pair[1], pair[0].name)), reverse = True)
-				totalWeight = sum([weight for (boneIndex, weight) in orderedBones])
-				integralTotalWeight = int((totalWeight * 255) + 0.5)
-				selectedBones = orderedBones[0:4]
-				selectedWeight = sum([weight for (boneIndex, weight) in selectedBones])
-				
-				remainingIntegralWeight = integralTotalWeight
-				remainingSelectedWeight = selectedWeight
-				vertexEncoding.boneMapping = []
-				for i in range(len(selectedBones)):
-					(bone, weight) = selectedBones[i]
-					if i == len(selectedBones) - 1:
-						boneWeight = max(0, min(255, remainingIntegralWeight))
-					elif remainingSelectedWeight <= 0:
-						boneWeight = 0
-					else:
-						boneWeight = int((weight / remainingSelectedWeight) * remainingIntegralWeight + 0.5)
-						boneWeight = max(0, min(255, boneWeight))
-						remainingIntegralWeight -= boneWeight
-						remainingSelectedWeight -= weight
-					
-					if boneWeight > 0:
-						vertexEncoding.boneMapping.append((bone, boneWeight))
+				key = id(vertex.boneMapping)
+				if key not in encodedBoneMappings:
+					encodedBoneMappings[key] = FmdlFile.encodeBoneMapping(vertex.boneMapping)
+				vertexEncoding.boneMapping = list(encodedBoneMappings[key])
 			vertexEncodings.append(vertexEncoding)
 		return vertexEncodings
 	
 	@staticmethod
-	def addVertices(encodedVertices, formatEntries, positionBufferEntrySize, dataBufferEntrySize, boneGroupIndices, vertexPositionBuffer, vertexDataBuffer):
-		positionBuffer = bytearray(len(encodedVertices) * positionBufferEntrySize)
-		dataBuffer = bytearray(len(encodedVertices) * dataBufferEntrySize)
-		buffers = [positionBuffer, dataBuffer]
-		entrySizes = [positionBufferEntrySize, dataBufferEntrySize]
-		
-		vertexIndices = {}
-		
-		for vertexIndex in range(len(encodedVertices)):
-			vertexEncoding = encodedVertices[vertexIndex]
-			vertexIndices[vertexEncoding.vertex] = vertexIndex
+	def encodeBoneMapping(boneMapping):
+		#
+		# fmdl bone mappings support at most 4 bones, and store weights as 8-bit integers.
+		# Pack the desired bone mapping into this constraint as accurately as possible:
+		# - If the desired bone mapping contains more than 4 bones, simplify it
+		#   down to 4 bones, keeping the total weight identical
+		# - Round bone weights to units of N/255, in such a way that the total bone weight
+		#   does not change more than one rounding error. In particular, a rounded total weight
+		#   of 1 must remain a total weight of 1 after elementwise rounding.
+		#
+		orderedBones = sorted(boneMapping.items(), key = (lambda pair: (pair[1], pair[0].name)), reverse = True)
+		totalWeight = sum([weight for (boneIndex, weight) in orderedBones])
+		integralTotalWeight = int((totalWeight * 255) + 0.5)
+		selectedBones = orderedBones[0:4]
+		selectedWeight = sum([weight for (boneIndex, weight) in selectedBones])
+		
+		remainingIntegralWeight = integralTotalWeight
+		remainingSelectedWeight = selectedWeight
+		encodedBoneMapping = []
+		for i in range(len(selectedBones)):
+			(bone, weight) = selectedBones[i]
+			if i == len(selectedBones) - 1:
+				boneWeight = max(0, min(255, remainingIntegralWeight))
+			elif remainingSelectedWeight <= 0:
+				boneWeight = 0
+			else:
+				boneWeight = int((weight / remainingSelectedWeight) * remainingIntegralWeight + 0.5)
+				boneWeight = max(0, min(255, boneWeight))
+				remainingIntegralWeight -= boneWeight
+				remainingSelectedWeight -= weight
 			
-			for (bufferID, datumType, datumFormat, offset) in formatEntries:
-				if datumType == FmdlFile.FmdlVertexDatumType.position:
-					if datumFormat != FmdlFile.FmdlVertexDatumFormat.tripleFloat32:
-						raise InvalidFmdl("Unexpected format %d for vertex position data" % datumFormat)
-					value = vertexEncoding.position
-				elif datumType == FmdlFile.FmdlVertexDatumType.boneWeights:
-					if datumFormat != FmdlFile.FmdlVertexDatumFormat.quadFloat8:
-						raise InvalidFmdl("Unexpected format %d for vertex bone weight data" % datumFormat)
-					boneWeights = [weight for (bone, weight) in vertexEncoding.boneMapping]
-					if len(boneWeights) < 4:
-						boneWeights += ((0,) * (4 - len(boneWeights)))
-					value = pack('< 4B', *boneWeights)
-				elif datumType == FmdlFile.FmdlVertexDatumType.normal:
-					if datumFormat != FmdlFile.FmdlVertexDatumFormat.quadFloat16:
-						raise InvalidFmdl("Unexpected format %d for vertex normal data" % datumFormat)
-					value = vertexEncoding.normal
-				elif datumType == FmdlFile.FmdlVertexDatumType.color:
-					if datumFormat != FmdlFile.FmdlVertexDatumFormat.quadFloat8:
-						raise InvalidFmdl("Unexpected format %d for vertex color data" % datumFormat)
-					value = vertexEncoding.color
-				elif datumType == FmdlFile.FmdlVertexDatumType.boneIndices:
-					if datumFormat != FmdlFile.FmdlVertexDatumFormat.quadInt8:
-						raise InvalidFmdl("Unexpected format %d for vertex bone index data" % datumFormat)
-					boneIndices = [boneGroupIndices[bone] for (bone, weight) in vertexEncoding.boneMapping]
-					if len(boneIndices) < 4:
-						boneIndices += ((0,) * (4 - len(boneIndices)))
-					value = pack('< 4B', *boneIndices)
-				elif datumType == FmdlFile.FmdlVertexDatumType.uv0:
-					if datumFormat not in [FmdlFile.FmdlVertexDatumFormat.doubleFloat16, FmdlFile.FmdlVertexDatumFormat.doubleFloat32]:
-						raise InvalidFmdl("Unexpected format %d for vertex uv data" % datumFormat)
-					value = vertexEncoding.uv[0]
-				elif datumType == FmdlFile.FmdlVertexDatumType.uv1:
-					if datumFormat not in [FmdlFile.FmdlVertexDatumFormat.doubleFloat16, FmdlFile.FmdlVertexDatumFormat.doubleFloat32]:
-						raise InvalidFmdl("Unexpected format %d for vertex uv data" % datumFormat)
-					value = vertexEncoding.uv[1]
-				elif datumType == FmdlFile.FmdlVertexDatumType.uv2:
-					if datumFormat not in [FmdlFile.FmdlVertexDatumFormat.doubleFloat16, FmdlFile.FmdlVertexDatumFormat.doubleFloat32]:
-						raise InvalidFmdl("Unexpected format %d for vertex uv data" % datumFormat)
-					value = vertexEncoding.uv[2]
-				elif datumType == FmdlFile.FmdlVertexDatumType.uv3:
-					if datumFormat not in [FmdlFile.FmdlVertexDatumFormat.doubleFloat16, FmdlFile.FmdlVertexDatumFormat.doubleFloat32]:
-						raise InvalidFmdl("Unexpected format %d for vertex uv data" % datumFormat)
-					value = vertexEncoding.uv[3]
-				elif datumType == FmdlFile.FmdlVertexDatumType.tangent:
-					if datumFormat != FmdlFile.FmdlVertexDatumFormat.quadFloat16:
-						raise InvalidFmdl("Unexpected format %d for vertex tangent data" % datumFormat)
-					value = vertexEncoding.tangent
-				else:
-					raise InvalidFmdl("Unexpected vertex datum type %d" % datumType)
-				
-				position = entrySizes[bufferID] * vertexIndex + offset
-				buffer = buffers[bufferID]
-				buffer[position : position + len(value)] = value
-		
-		if len(positionBuffer) % 16:
-			positionBuffer += bytearray(16 - (len(positionBuffer) % 16))
-		if len(dataBuffer) % 16:
-			dataBuffer += bytearray(16 - (len(dataBuffer) % 16))
-		
-		vertexPositionBuffer += positionBuffer
-		vertexDataBuffer += dataBuffer
-		
-		return vertexIndices
+			if boneWeight > 0:
+				encodedBoneMapping.append((bone, boneWeight))
+		return encodedBoneMapping
 	
 	@staticmethod
-	def addFaces(fmdl, faces, faceBuffer, vertexIndices):
-		meshFaceBuffer = bytearray(len(faces) * 6)
-		
+	def addVertices(encodedVertices, formatEntries, positionBufferEntrySize, dataBufferEntrySize, boneGroupIndices, buffer, positionBufferOffset, dataBufferOffset):
+		from . import FmdlVertexCodecs
+		return FmdlVertexCodecs.encodeVertices(encodedVertices, formatEntries, positionBufferEntrySize, dataBufferEntrySize, boneGroupIndices, buffer, positionBufferOffset, dataBufferOffset)
+	
+	@staticmethod
+	def addFaces(faces, buffer, faceBufferOffset, vertexIndices):
 		for i in range(len(faces)):
-			pack_into('< 3H', meshFaceBuffer, 6 * i,
+			pack_into('< 3H', buffer, faceBufferOffset + 6 * i,
 				vertexIndices[faces[i].vertices[0]],
 				vertexIndices[faces[i].vertices[1]],
 				vertexIndices[faces[i].vertices[2]],
 			)
-		
-		firstFaceVertexID = len(faceBuffer) // 2
-		faceBuffer += meshFaceBuffer
-		return firstFaceVertexID
 	
 	@staticmethod
 	def addExtensionHeaders(fmdl, fmdlFile, extensionHeaders, meshIndices, meshGroupIndices):
@@ -1813,22 +2381,30 @@ class FmdlFile:
 		flattenedExtensions = []
 		otherHeaders = {}
 		headerNames = {}
+		#
+		# Headers are written in the order they are first added. The headers
+		# of meshes and mesh groups are sets, and the file headers a dict that
+		# need not keep its order on older pythons, so they are visited in
+		# sorted order to make the output independent of hash randomization.
+		#
+		headerOrder = []
 		def addHeader(key, values):
 			if key.lower() in otherHeaders:
 				otherHeaders[key.lower()] += values
 			else:
 				otherHeaders[key.lower()] = values
 				headerNames[key.lower()] = key
-		for key in extensionHeaders:
+				headerOrder.append(key.lower())
+		for key in sorted(extensionHeaders):
 			if key.lower() == extensionsHeader.lower():
 				flattenedExtensions += extensionHeaders[key]
 			else:
-				addHeader(key, extensionHeaders[key])
+				addHeader(key, list(extensionHeaders[key]))
 		for i in range(len(fmdlFile.meshes)):
-			for key in fmdlFile.meshes[i].extensionHeaders:
+			for key in sorted(fmdlFile.meshes[i].extensionHeaders):
 				addHeader(key, [str(i)])
 		for i in range(len(fmdlFile.meshGroups)):
-			for key in fmdlFile.meshGroups[i].extensionHeaders:
+			for key in sorted(fmdlFile.meshGroups[i].extensionHeaders):
 				addHeader(key, [str(i)])
 		
 		if len(otherHeaders) == 0 and len(flattenedExtensions) == 0:
@@ -1836,7 +2412,7 @@ class FmdlFile:
 		
 		extensionString = ''
 		extensionString += extensionsHeader + ": " + ', '.join(flattenedExtensions) + "\n"
-		for key in otherHeaders:
+		for key in headerOrder:
 			extensionString += headerNames[key] + ": " + ', '.join(otherHeaders[key]) + "\n"
 		
 		encoded = bytes(extensionString, 'utf-8')
@@ -1874,10 +2450,7 @@ class FmdlFile:
 		levelsOfDetail = 1
 		FmdlFile.addLevelsOfDetail(fmdl, levelsOfDetail)
 		
-		vertexPositionBuffer = bytearray()
-		vertexDataBuffer = bytearray()
-		faceBuffer = bytearray()
-		
+		meshBufferLayout = FmdlFile.MeshBufferLayout()
 		meshIndices = {}
 		
 		for mesh in meshes:
@@ -1887,16 +2460,17 @@ class FmdlFile:
 				boneIndices,
 				materialInstanceIndices[mesh.materialInstance],
 				levelsOfDetail,
-				vertexPositionBuffer,
-				vertexDataBuffer,
-				faceBuffer,
+				meshBufferLayout,
 			)
 			meshIndices[mesh] = meshID
 		
-		FmdlFile.addBufferOffset(fmdl, False, len(vertexPositionBuffer), 0)
-		FmdlFile.addBufferOffset(fmdl, False, len(vertexDataBuffer), len(vertexPositionBuffer))
-		FmdlFile.addBufferOffset(fmdl, True, len(faceBuffer), len(vertexPositionBuffer) + len(vertexDataBuffer))
-		fmdl.segment1Blocks[2] = vertexPositionBuffer + vertexDataBuffer + faceBuffer
+		positionBufferLength = meshBufferLayout.positionBufferLength
+		dataBufferLength = meshBufferLayout.dataBufferLength
+		faceBufferLength = meshBufferLayout.faceBufferLength
+		FmdlFile.addBufferOffset(fmdl, False, positionBufferLength, 0)
+		FmdlFile.addBufferOffset(fmdl, False, dataBufferLength, positionBufferLength)
+		FmdlFile.addBufferOffset(fmdl, True, faceBufferLength, positionBufferLength + dataBufferLength)
+		fmdl.segment1Blocks[2] = FmdlContainer.DeferredBlock(meshBufferLayout.length(), meshBufferLayout.write)
 		
 		return meshIndices
 	
@@ -1913,32 +2487,51 @@ class FmdlFile:
 		
 		return meshGroupIndices
 	
+	#
+	# FmdlArrays.MeshArrays meshes are encoded from their arrays, and are
+	# left alone by these.
+	#
 	def precomputeVertexEncoding(self):
+		arrays = arraysModule()
 		for mesh in self.meshes:
+			if not isinstance(mesh, FmdlFile.Mesh):
+				continue
 			if mesh.vertexEncoding == None:
-				mesh.vertexEncoding = self.encodeVertices(mesh.vertices, mesh.vertexFields)
+				if arrays is not None and mesh.vertexFields.hasBoneMapping:
+					boneInfluences = arrays.meshBoneArrays(mesh)
+				else:
+					boneInfluences = None
+				mesh.vertexEncoding = self.encodeVertices(mesh.vertices, mesh.vertexFields, boneInfluences)
 	
 	def freeVertexEncoding(self):
 		for mesh in self.meshes:
+			if not isinstance(mesh, FmdlFile.Mesh):
+				continue
 			mesh.vertexEncoding = None
+			mesh.boneInfluences = None
 	
+	@Tracing.traced('FmdlFile.writeFile')
 	def writeFile(self, filename):
 		fmdl = FmdlContainer()
 		
 		stringIndices = {}
 		self.addString(fmdl, stringIndices, '')
-		boneIndices = self.storeBones(fmdl, stringIndices, self.bones)
-		materialInstanceIndices = self.storeMaterialInstances(fmdl, stringIndices, self.materialInstances)
-		meshIndices = self.storeMeshes(fmdl, self.meshes, boneIndices, materialInstanceIndices)
-		meshGroupIndices = self.storeMeshGroups(fmdl, stringIndices, self.meshGroups, meshIndices)
+		with Tracing.span('storeBones'):
+			boneIndices = self.storeBones(fmdl, stringIndices, self.bones)
+		with Tracing.span('storeMaterialInstances'):
+			materialInstanceIndices = self.storeMaterialInstances(fmdl, stringIndices, self.materialInstances)
+		with Tracing.stage('storeMeshes', meshes = len(self.meshes)):
+			meshIndices = self.storeMeshes(fmdl, self.meshes, boneIndices, materialInstanceIndices)
+		with Tracing.span('storeMeshGroups'):
+			meshGroupIndices = self.storeMeshGroups(fmdl, stringIndices, self.meshGroups, meshIndices)
 		self.addExtensionHeaders(fmdl, self, self.extensionHeaders, meshIndices, meshGroupIndices)
 		
 		# Unknown purpose
-		self.addSegment0Block(fmdl, 18, pack('< 8x'))
-		self.addSegment0Block(fmdl, 20, pack('< ffff IIIi 96x',
+		self.addSegment0Entry(fmdl, 18)
+		self.addSegment0Entry(fmdl, 20,
 			0.0, 1.0, 1.0, 1.0,
 			0, 0, 0, -1,
-		))
+		)
 		
 		# The old plugin needs all segment 1 blocks to be there, even if empty.
 		# Except for segment 1 block 1, which must be there if and only if there is a bone table.
@@ -0,0 +1,80 @@
+import numpy
+
+#
+# Array versions of FmdlFile.parseFloat16() and FmdlFile.encodeFloat16().
+#
+# Decoding is a lookup in a table of all 65536 float16 values. Encoding comes
+# in two modes:
+# - 'compatible' reproduces the exact output of FmdlFile.encodeFloat16(). It
+#   truncates the mantissa rather than rounding it, so that values too small
+#   for a float16 subnormal flush to zero, and values just below 2**16 encode
+#   as a finite 65504 rather than infinity. It encodes NaN as 0x7fff, and zero
+#   always without a sign bit. Files exported in this mode are byte-identical
+#   to what the pure-Python encoder produces.
+# - 'ieee' rounds to the nearest float16, as numpy.float16 does.
+#
+
+
+
+exponentBits = 5
+exponentBias = 15
+mantissaBits = 10
+
+DECODE_TABLE = numpy.arange(65536, dtype = numpy.uint32).astype('<u2').view('<f2').astype(numpy.float64)
+DECODE_TABLE.flags.writeable = False
+
+#
+# Decode an array of float16 bit patterns into a float64 array of the same shape.
+#
+def decode(halfs):
+	return DECODE_TABLE[numpy.asarray(halfs, dtype = numpy.uint16)]
+
+def encodeCompatible(values):
+	values = numpy.asarray(values, dtype = numpy.float64)
+	
+	with numpy.errstate(invalid = 'ignore'):
+		sign = (values < 0.0).astype(numpy.uint16)
+	absValues = numpy.abs(values)
+	(candidateMantissa, exponent) = numpy.frexp(absValues)
+	
+	isNan = numpy.isnan(values)
+	isInf = numpy.isinf(values)
+	isFinite = ~(isNan | isInf)
+	with numpy.errstate(invalid = 'ignore'):
+		isZero = isFinite & (candidateMantissa < 0.1)
+	isSubnormal = isFinite & ~isZero & (exponent < -exponentBias + 2)
+	isOverflow = isFinite & ~isZero & (exponent > exponentBias + 1)
+	isNormal = isFinite & ~isZero & ~isSubnormal & ~isOverflow
+	
+	biasedExponent = numpy.zeros(values.shape, dtype = numpy.uint16)
+	mantissa = numpy.zeros(values.shape, dtype = numpy.uint16)
+	
+	biasedExponent[isNan | isInf | isOverflow] = 31
+	mantissa[isNan] = ~(~0 << mantissaBits)
+	
+	subnormalMantissa = numpy.ldexp(candidateMantissa[isSubnormal], exponentBias + mantissaBits - 1 + exponent[isSubnormal])
+	mantissa[isSubnormal] = subnormalMantissa.astype(numpy.uint16)
+	
+	biasedExponent[isNormal] = exponent[isNormal] - 1 + exponentBias
+	normalizedMantissa = (candidateMantissa[isNormal] * 2.0) - 1.0
+	mantissa[isNormal] = numpy.ldexp(normalizedMantissa, mantissaBits).astype(numpy.uint16)
+	
+	return (sign << (exponentBits + mantissaBits)) | (biasedExponent << mantissaBits) | mantissa
+
+def encodeIeee(values):
+	with numpy.errstate(over = 'ignore'):
+		return numpy.asarray(values, dtype = numpy.float64).astype('<f2').view('<u2').astype(numpy.uint16)
+
+ENCODERS = {
+	'compatible': encodeCompatible,
+	'ieee': encodeIeee,
+}
+
+#
+# Encode an array of floats into a uint16 array of float16 bit patterns of the
+# same shape.
+#
+def encode(values, mode = 'compatible'):
+	if mode not in ENCODERS:
+		raise ValueError("Unknown float16 encoding mode '%s'" % mode)
+	return ENCODERS[mode](values)
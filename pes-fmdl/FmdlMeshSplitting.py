@@ -1,5 +1,12 @@
-from . import FmdlFile, PesSkeletonData
+from . import FmdlArrays, FmdlFile, PesSkeletonData
+import collections
+import collections.abc
+import concurrent.futures
+import heapq
+import itertools
 import numpy
+import operator
+import os
 
 #
 # FMDL meshes have a maximum number of vertices and faces in them, and the
@@ -104,72 +111,278 @@ def indistinguishableEncoding(encodedVertex, vertexFields):
 # Sets of equipresent vertices are lists, which cannot be hashed.
 # A container object for it CAN be hashed, and therefore stored in sets.
 #
+# VertexSets and EncodedFaces hash by identity, so iterating over sets of them
+# gives a different order in every run. Where order matters, they are sorted
+# by their index, which is their position in the mesh. The row of a VertexSet
+# is the vertex index of its first vertex.
+#
 class VertexSet:
-	def __init__(self, vertices):
+	def __init__(self, vertices, index, row):
 		self.vertices = vertices
+		self.index = index
+		self.row = row
 
 #
 # Stores a face as a sequence of *encoded* vertices
 #
 class EncodedFace:
-	def __init__(self, vertices):
+	def __init__(self, vertices, index):
 		self.vertices = vertices
+		self.index = index
+
+indexKey = operator.attrgetter('index')
+
+#
+# The bone group of a mesh, for computing the bones used by a VertexSet, as
+# indices into the bone group. All vertices in a VertexSet have the same bone
+# mapping, so these are the bones of its first vertex in the BoneInfluences of
+# the mesh. Vertices with the same bone influences share a list of them.
+#
+class MeshBones:
+	def __init__(self, mesh):
+		self.bones = mesh.boneGroup.bones
+		boneInfluences = FmdlArrays.meshBoneArrays(mesh)
+		(mappingIDs, mappingCount) = FmdlArrays.groupRows(numpy.concatenate((
+			boneInfluences.boneIndices,
+			boneInfluences.boneWeights.astype(boneInfluences.boneIndices.dtype),
+		), axis = 1))
+		self.vertexMappingIDs = mappingIDs.tolist()
+		self.mappingBoneIndices = [None] * mappingCount
+		for (mappingID, boneIndices, boneWeights) in zip(self.vertexMappingIDs, boneInfluences.boneIndices.tolist(), boneInfluences.boneWeights.tolist()):
+			if self.mappingBoneIndices[mappingID] is None:
+				self.mappingBoneIndices[mappingID] = [boneIndex for (boneIndex, weight) in zip(boneIndices, boneWeights) if weight > 0]
+	
+	def usedBoneIndices(self, vertexSet):
+		return self.mappingBoneIndices[self.vertexMappingIDs[vertexSet.row]]
+	
+	#
+	# The bones in a bitmask over bone group indices.
+	#
+	def maskBones(self, boneMask):
+		return set(self.bones[i] for i in range(len(self.bones)) if boneMask & (1 << i))
+
+#
+# Aggregate statistics of a collection of storable items, for checking
+# whether they fit in a single submesh: the number of distinct VertexSets
+# used by the items, the total number of vertices in those, and the bones
+# used by those, as a bitmask over bone group indices.
+#
+# VertexSets and bones are reference counted, so that the statistics can be
+# updated as items are removed. $vertexSetCounts is a Counter of the
+# VertexSets used by the items, counting each use by each item;
+# $boneIndices(vertexSet) returns the bone group indices used by a VertexSet.
+#
+class StorableItemStatistics:
+	def __init__(self, vertexSetCounts, boneIndices):
+		self.boneIndices = boneIndices
+		self.vertexSetReferences = vertexSetCounts
+		self.vertexCount = sum(len(vertexSet.vertices) for vertexSet in vertexSetCounts)
+		self.boneReferences = collections.Counter(itertools.chain.from_iterable(
+			boneIndices(vertexSet) for vertexSet in vertexSetCounts
+		))
+		self.boneMask = 0
+		for boneIndex in self.boneReferences:
+			self.boneMask |= 1 << boneIndex
+	
+	def vertexSetCount(self):
+		return len(self.vertexSetReferences)
+	
+	def boneCount(self):
+		return bin(self.boneMask).count('1')
+	
+	def remove(self, vertexSetCounts):
+		for (vertexSet, count) in vertexSetCounts.items():
+			references = self.vertexSetReferences[vertexSet] - count
+			if references > 0:
+				self.vertexSetReferences[vertexSet] = references
+				continue
+			del self.vertexSetReferences[vertexSet]
+			self.vertexCount -= len(vertexSet.vertices)
+			for boneIndex in self.boneIndices(vertexSet):
+				boneReferences = self.boneReferences[boneIndex] - 1
+				if boneReferences > 0:
+					self.boneReferences[boneIndex] = boneReferences
+				else:
+					del self.boneReferences[boneIndex]
+					self.boneMask &= ~(1 << boneIndex)
 
 class StorableItems:
 	def __init__(self):
 		self.faces = set()
 		self.looseVertices = set()
+	
+	def copy(self):
+		items = StorableItems()
+		items.faces = set(self.faces)
+		items.looseVertices = set(self.looseVertices)
+		return items
+
+#
+# A read-only view of a set, that follows changes to the set.
+#
+class SetView(collections.abc.Set):
+	__slots__ = ('items',)
+	
+	def __init__(self, items):
+		self.items = items
+	
+	def __contains__(self, item):
+		return item in self.items
+	
+	def __iter__(self):
+		return iter(self.items)
+	
+	def __len__(self):
+		return len(self.items)
+	
+	@classmethod
+	def _from_iterable(cls, iterable):
+		return set(iterable)
 
 #
 # Maintains, for each bone, the set of faces and the set of looseVertexSets
 # that contain a bone that is a descendent of $bone.
 #
+# Each item is attributed to the bones it is stored under, so that removing
+# an item only touches the sets of those bones. get() returns read-only views
+# of the sets of a bone, which stay up to date as items are removed; callers
+# that need to hold on to the items of a bone over a removal should copy()
+# them first.
+#
+# statistics() returns the StorableItemStatistics of the items of a bone.
+# These are computed when first requested for a bone, and from then on
+# updated as items are removed, so that repeatedly checking whether the items
+# of a bone fit in a submesh does not need to visit the items.
+#
 class BoneDescendentStorableItems:
-	def __init__(self, parentBones, encodedFaceIndices, looseVertexSets):
+	def __init__(self, parentBones, encodedFaceIndices, looseVertexSets, equipresentVertices, meshBones):
 		self.itemsPerBone = {}
+		self.statisticsPerBone = {}
+		self.views = {}
+		self.faceBones = {}
+		self.looseVertexBones = {}
+		self.equipresentVertices = equipresentVertices
+		self.meshBones = meshBones
+		self.vertexSetBoneIndices = {}
 		
 		# None functions as the root bone.
 		self.itemsPerBone[None] = StorableItems()
-		self.itemsPerBone[None].faces = set(encodedFaceIndices.keys())
-		self.itemsPerBone[None].looseVertices = looseVertexSets.copy()
 		if parentBones is not None:
 			for bone in parentBones.keys():
 				self.itemsPerBone[bone] = StorableItems()
-			
-			for face in encodedFaceIndices.keys():
-				for vertex in face.vertices:
-					for (bone, weight) in vertex.boneMapping:
-						currentBone = bone
-						while currentBone is not None:
-							if face in self.itemsPerBone[currentBone].faces:
-								break
-							self.itemsPerBone[currentBone].faces.add(face)
-							currentBone = parentBones[currentBone]
-			
-			for vertexSet in looseVertexSets:
-				#
-				# All vertices in a vertexSet have the same bone
-				# mapping, so we can just take one at random.
-				#
-				vertex = vertexSet.vertices[0]
-				for (bone, weight) in vertex.boneMapping:
-					currentBone = bone
-					while currentBone is not None:
-						if vertexSet in self.itemsPerBone[currentBone].looseVertices:
-							break
-						self.itemsPerBone[currentBone].looseVertices.add(vertexSet)
-						currentBone = parentBones[currentBone]
+		
+		#
+		# The bones of a VertexSet depend only on the bones in its bone
+		# mapping. VertexSets with the same bones share a single list of
+		# bones, and so do faces all of whose VertexSets share a list.
+		#
+		mappingBones = {}
+		vertexSetBones = {}
+		for vertexSet in set(equipresentVertices.values()):
+			key = tuple(self.boneIndices(vertexSet))
+			if key not in mappingBones:
+				mappingBones[key] = self.ancestorBones([meshBones.bones[boneIndex] for boneIndex in key], parentBones)
+			vertexSetBones[vertexSet] = mappingBones[key]
+		
+		faceBoneLists = {}
+		for face in encodedFaceIndices.keys():
+			(first, second, third) = [vertexSetBones[equipresentVertices[vertex]] for vertex in face.vertices]
+			if first is second and first is third:
+				bones = first
+			else:
+				key = frozenset(first + second + third)
+				if key not in faceBoneLists:
+					faceBoneLists[key] = list(key)
+				bones = faceBoneLists[key]
+			for bone in bones:
+				self.itemsPerBone[bone].faces.add(face)
+			self.faceBones[face] = bones
+		
+		for vertexSet in looseVertexSets:
+			bones = vertexSetBones[vertexSet]
+			for bone in bones:
+				self.itemsPerBone[bone].looseVertices.add(vertexSet)
+			self.looseVertexBones[vertexSet] = bones
+		
+		for (bone, items) in self.itemsPerBone.items():
+			view = StorableItems()
+			view.faces = SetView(items.faces)
+			view.looseVertices = SetView(items.looseVertices)
+			self.views[bone] = view
+	
+	#
+	# The bones in $mappingBones and all their ancestors, including the root
+	# bone None.
+	#
+	@staticmethod
+	def ancestorBones(mappingBones, parentBones):
+		bones = [None]
+		for bone in mappingBones:
+			currentBone = bone
+			while currentBone is not None and currentBone not in bones:
+				bones.append(currentBone)
+				currentBone = parentBones[currentBone]
+		return bones
+	
+	def boneIndices(self, vertexSet):
+		if self.meshBones is None:
+			return []
+		if vertexSet not in self.vertexSetBoneIndices:
+			self.vertexSetBoneIndices[vertexSet] = self.meshBones.usedBoneIndices(vertexSet)
+		return self.vertexSetBoneIndices[vertexSet]
 	
 	def get(self, bone):
-		items = StorableItems()
-		items.faces = self.itemsPerBone[bone].faces.copy()
-		items.looseVertices = self.itemsPerBone[bone].looseVertices.copy()
-		return items
+		return self.views[bone]
+	
+	def faceCount(self, bone):
+		return len(self.itemsPerBone[bone].faces)
+	
+	def looseVertexCount(self, bone):
+		return len(self.itemsPerBone[bone].looseVertices)
+	
+	#
+	# A Counter of the VertexSets used by $faces and $looseVertexSets.
+	#
+	def vertexSetCounts(self, faces, looseVertexSets):
+		counts = collections.Counter(map(
+			self.equipresentVertices.__getitem__,
+			itertools.chain.from_iterable(map(operator.attrgetter('vertices'), faces))
+		))
+		counts.update(looseVertexSets)
+		return counts
+	
+	def statistics(self, bone):
+		if bone not in self.statisticsPerBone:
+			items = self.itemsPerBone[bone]
+			self.statisticsPerBone[bone] = StorableItemStatistics(self.vertexSetCounts(items.faces, items.looseVertices), self.boneIndices)
+		return self.statisticsPerBone[bone]
 	
 	def remove(self, storedItems):
-		for key in self.itemsPerBone.keys():
-			self.itemsPerBone[key].faces -= storedItems.faces
-			self.itemsPerBone[key].looseVertices -= storedItems.looseVertices
+		#
+		# Only a few bones have statistics, so it is cheaper to find the
+		# removed items of each of those than to collect them per bone
+		# while removing. When most of the items of a bone are removed,
+		# its statistics are recomputed from the remaining items when
+		# next needed instead.
+		#
+		for (bone, statistics) in list(self.statisticsPerBone.items()):
+			items = self.itemsPerBone[bone]
+			faces = items.faces & storedItems.faces
+			looseVertices = items.looseVertices & storedItems.looseVertices
+			removedCount = len(faces) + len(looseVertices)
+			if removedCount == 0:
+				continue
+			if 2 * removedCount > len(items.faces) + len(items.looseVertices):
+				del self.statisticsPerBone[bone]
+			else:
+				statistics.remove(self.vertexSetCounts(faces, looseVertices))
+		
+		for face in storedItems.faces:
+			for bone in self.faceBones.pop(face):
+				self.itemsPerBone[bone].faces.discard(face)
+		for vertexSet in storedItems.looseVertices:
+			for bone in self.looseVertexBones.pop(vertexSet):
+				self.itemsPerBone[bone].looseVertices.discard(vertexSet)
 
 #
 # Vertex sequences with the same splitVertexKey need to preserve their relative
@@ -198,11 +411,13 @@ def computeEquipresentVertexSets(mesh):
 	#
 	output = {}
 	
-	for vertexEncoding in mesh.vertexEncoding:
+	vertexEncodings = mesh.vertexEncoding
+	for row in range(len(vertexEncodings)):
+		vertexEncoding = vertexEncodings[row]
 		encoding = splitVertexKey(vertexEncoding, mesh.vertexFields)
 		if encoding not in equipresentVertices:
 			equipresentVertices[encoding] = [vertexEncoding]
-			output[vertexEncoding] = VertexSet(equipresentVertices[encoding])
+			output[vertexEncoding] = VertexSet(equipresentVertices[encoding], len(equipresentVertices) - 1, row)
 		else:
 			equipresentVertices[encoding].append(vertexEncoding)
 			output[vertexEncoding] = output[equipresentVertices[encoding][0]]
@@ -221,7 +436,7 @@ def makeStorableItems(encodedVertices, equipresentVertices, faces):
 	equipresentVerticesRemaining = set(equipresentVertices.values())
 	encodedFaces = {}
 	for face in faces:
-		encodedFace = EncodedFace([vertexEncoding[vertex] for vertex in face.vertices])
+		encodedFace = EncodedFace([vertexEncoding[vertex] for vertex in face.vertices], len(encodedFaces))
 		encodedFaces[encodedFace] = len(encodedFaces)
 		for encodedVertex in encodedFace.vertices:
 			equipresentVerticesRemaining.discard(equipresentVertices[encodedVertex])
@@ -272,8 +487,7 @@ def selectSubmeshBaseBone(parentBones, storableItemsPerBone):
 				continue
 			triedBones.add(bone)
 			
-			storableItems = storableItemsPerBone.get(bone)
-			if len(storableItems.faces) == 0 and len(storableItems.looseVertices) == 0:
+			if storableItemsPerBone.faceCount(bone) == 0 and storableItemsPerBone.looseVertexCount(bone) == 0:
 				queue.append(parentBones[bone])
 				continue
 			
@@ -281,16 +495,14 @@ def selectSubmeshBaseBone(parentBones, storableItemsPerBone):
 	
 	return None
 
-def fitsInSubmesh(storableItems, equipresentVertices, vertexFields):
-	if len(storableItems.faces) > FACE_LIMIT_SOFT:
+def fitsInSubmesh(storableItemsPerBone, bone):
+	if storableItemsPerBone.faceCount(bone) > FACE_LIMIT_SOFT:
 		return False
-	equipresentVertices = set(equipresentVertices[vertex] for face in storableItems.faces for vertex in face.vertices) | storableItems.looseVertices
-	if sum(len(vertexSet.vertices) for vertexSet in equipresentVertices) > VERTEX_LIMIT_SOFT:
+	statistics = storableItemsPerBone.statistics(bone)
+	if statistics.vertexCount > VERTEX_LIMIT_SOFT:
+		return False
+	if statistics.boneCount() > BONE_LIMIT_SOFT:
 		return False
-	if vertexFields.hasBoneMapping:
-		bones = set(bone for vertexSet in equipresentVertices for (bone, weight) in vertexSet.vertices[0].boneMapping)
-		if len(bones) > BONE_LIMIT_SOFT:
-			return False
 	return True
 
 def computeSortVector(storableItems, bone):
@@ -299,8 +511,8 @@ def computeSortVector(storableItems, bone):
 	# storableItems, and order vertices on distance along this vector.
 	#
 	encodedVertices = (
-		  [vertex for face in storableItems.faces for vertex in face.vertices]
-		+ [vertexSet.vertices[0] for vertexSet in storableItems.looseVertices]
+		  [vertex for face in sorted(storableItems.faces, key = indexKey) for vertex in face.vertices]
+		+ [vertexSet.vertices[0] for vertexSet in sorted(storableItems.looseVertices, key = indexKey)]
 	)
 	coordinates = numpy.array([(v.vertex.position.x, v.vertex.position.y, v.vertex.position.z) for v in encodedVertices])
 	coordinateMeans = numpy.mean(coordinates, axis = 0)
@@ -335,26 +547,25 @@ def computeSortVector(storableItems, bone):
 #
 # Split off a subset of storable items into a new mesh object.
 #
-def buildSubmesh(mesh, parentBones, storableItemsPerBone, equipresentVertices, encodedFaceIndices):
+def buildSubmesh(mesh, parentBones, storableItemsPerBone, equipresentVertices, encodedFaceIndices, meshBones):
 	baseBone = selectSubmeshBaseBone(parentBones, storableItemsPerBone)
 	storableItems = storableItemsPerBone.get(baseBone)
 	
-	if fitsInSubmesh(storableItems, equipresentVertices, mesh.vertexFields):
+	if fitsInSubmesh(storableItemsPerBone, baseBone):
 		#
 		# Find the highest up ancestor bone that still fits a single submesh
 		#
 		while baseBone is not None:
 			childBone = parentBones[baseBone]
-			childStorableItems = storableItemsPerBone.get(childBone)
-			if not fitsInSubmesh(childStorableItems, equipresentVertices, mesh.vertexFields):
+			if not fitsInSubmesh(storableItemsPerBone, childBone):
 				break
 			baseBone = childBone
-			storableItems = childStorableItems
 		
-		storedItems = storableItems
-		selectedEquipresentVertices = set(equipresentVertices[vertex] for face in storedItems.faces for vertex in face.vertices) | storedItems.looseVertices
-		if mesh.vertexFields.hasBoneMapping:
-			selectedBones = set(bone for vertexSet in selectedEquipresentVertices for (bone, weight) in vertexSet.vertices[0].boneMapping)
+		storedItems = storableItemsPerBone.get(baseBone).copy()
+		statistics = storableItemsPerBone.statistics(baseBone)
+		selectedEquipresentVertices = set(statistics.vertexSetReferences.keys())
+		if meshBones is not None:
+			selectedBones = meshBones.maskBones(statistics.boneMask)
 		else:
 			selectedBones = set()
 	else:
@@ -373,7 +584,7 @@ def buildSubmesh(mesh, parentBones, storableItemsPerBone, equipresentVertices, e
 			return sum(vector[i] * sortVector[i] for i in range(len(vector)))
 		
 		for face in sorted(storableItems.faces, reverse = True, key = lambda face :
-			max(vectorScore(v) for v in face.vertices)
+			(max(vectorScore(v) for v in face.vertices), -face.index)
 		):
 			if len(selectedFaces) >= FACE_LIMIT_SOFT:
 				break
@@ -389,9 +600,9 @@ def buildSubmesh(mesh, parentBones, storableItemsPerBone, equipresentVertices, e
 				):
 					addedEquipresentVertices.add(equipresentVertex)
 					addedVertexCount += len(equipresentVertex.vertices)
-					for (bone, weight) in (encodedVertex.boneMapping or []):
-						if bone not in selectedBones:
-							addedBones.add(bone)
+					for boneIndex in storableItemsPerBone.boneIndices(equipresentVertex):
+						if meshBones.bones[boneIndex] not in selectedBones:
+							addedBones.add(meshBones.bones[boneIndex])
 			
 			if (
 				    len(selectedBones) + len(addedBones) <= BONE_LIMIT_SOFT
@@ -402,16 +613,14 @@ def buildSubmesh(mesh, parentBones, storableItemsPerBone, equipresentVertices, e
 				selectedEquipresentVertices |= addedEquipresentVertices
 				totalVertexCount += addedVertexCount
 		
-		for looseVertex in sorted(storableItems.looseVertices, reverse = True, key = lambda vertex : vectorScore(vertex)):
+		for looseVertex in sorted(storableItems.looseVertices, reverse = True, key = lambda vertexSet : (vectorScore(vertexSet.vertices[0]), -vertexSet.index)):
 			if totalVertexCount >= VERTEX_LIMIT_SOFT:
 				break
 			
-			encodedVertex = looseVertex.vertices[0]
-			
 			addedBones = set()
-			for (bone, weight) in (encodedVertex.boneMapping or []):
-				if bone not in selectedBones:
-					addedBones.add(bone)
+			for boneIndex in storableItemsPerBone.boneIndices(looseVertex):
+				if meshBones.bones[boneIndex] not in selectedBones:
+					addedBones.add(meshBones.bones[boneIndex])
 			addedVertexCount = len(looseVertex.vertices)
 			
 			if (
@@ -427,6 +636,19 @@ def buildSubmesh(mesh, parentBones, storableItemsPerBone, equipresentVertices, e
 		storedItems.faces = selectedFaces
 		storedItems.looseVertices = selectedLooseVertices
 	
+	submesh = makeSubmesh(
+		mesh,
+		selectedEquipresentVertices,
+		selectedBones,
+		sorted(storedItems.faces, key = lambda face : encodedFaceIndices[face])
+	)
+	return (submesh, storedItems)
+
+#
+# Make a submesh of $mesh containing the VertexSets $equipresentVertexSets,
+# in mesh order, and the EncodedFaces $faces, using the bones in $bones.
+#
+def makeSubmesh(mesh, equipresentVertexSets, bones, faces):
 	submesh = FmdlFile.FmdlFile.Mesh()
 	submesh.materialInstance = mesh.materialInstance
 	submesh.alphaFlags = mesh.alphaFlags
@@ -434,15 +656,14 @@ def buildSubmesh(mesh, parentBones, storableItemsPerBone, equipresentVertices, e
 	submesh.vertexFields = mesh.vertexFields
 	submesh.extensionHeaders = mesh.extensionHeaders.copy()
 	submesh.boneGroup = FmdlFile.FmdlFile.BoneGroup()
-	submesh.boneGroup.bones = [bone for bone in mesh.boneGroup.bones if bone in selectedBones]
-	submesh.vertexEncoding = [vertex for vertexSet in selectedEquipresentVertices for vertex in vertexSet.vertices]
+	submesh.boneGroup.bones = [bone for bone in mesh.boneGroup.bones if bone in bones]
+	submesh.vertexEncoding = [vertex for vertexSet in sorted(equipresentVertexSets, key = indexKey) for vertex in vertexSet.vertices]
 	submesh.vertices = [encodedVertex.vertex for encodedVertex in submesh.vertexEncoding]
 	submesh.faces = [
 		FmdlFile.FmdlFile.Face(*(encodedVertex.vertex for encodedVertex in face.vertices))
-		for face in sorted(storedItems.faces, key = lambda face : encodedFaceIndices[face])
+		for face in faces
 	]
-	
-	return (submesh, storedItems)
+	return submesh
 
 #
 # Splits a mesh into a collection of submeshes that each fit within an fmdl
@@ -452,11 +673,12 @@ def splitMesh(mesh, parentBones, descendentBones):
 	equipresentVertices = computeEquipresentVertexSets(mesh)
 	(encodedFaceIndices, looseVertexSets) = makeStorableItems(mesh.vertexEncoding, equipresentVertices, mesh.faces)
 	
-	storableItemsPerBone = BoneDescendentStorableItems(parentBones if mesh.vertexFields.hasBoneMapping else None, encodedFaceIndices, looseVertexSets)
+	meshBones = MeshBones(mesh) if mesh.vertexFields.hasBoneMapping else None
+	storableItemsPerBone = BoneDescendentStorableItems(parentBones if mesh.vertexFields.hasBoneMapping else None, encodedFaceIndices, looseVertexSets, equipresentVertices, meshBones)
 	
 	submeshes = []
-	while len(storableItemsPerBone.get(None).faces) > 0 or len(storableItemsPerBone.get(None).looseVertices) > 0:
-		(submesh, storedItems) = buildSubmesh(mesh, parentBones, storableItemsPerBone, equipresentVertices, encodedFaceIndices)
+	while storableItemsPerBone.faceCount(None) > 0 or storableItemsPerBone.looseVertexCount(None) > 0:
+		(submesh, storedItems) = buildSubmesh(mesh, parentBones, storableItemsPerBone, equipresentVertices, encodedFaceIndices, meshBones)
 		storableItemsPerBone.remove(storedItems)
 		submeshes.append(submesh)
 	
@@ -474,7 +696,12 @@ def computeParentBones(bones):
 	for bone in bones:
 		namedBones[bone.name] = bone
 	
-	parents = {}
+	#
+	# Ordered in the order of $bones, which is the order in which
+	# selectSubmeshBaseBone() falls back to trying all bones, also on pythons
+	# whose dicts do not keep their order.
+	#
+	parents = collections.OrderedDict()
 	for bone in bones:
 		if bone.parent != None:
 			parent = bone.parent
@@ -554,20 +781,614 @@ def computeDescendentBones(parentBones):
 	
 	return descendentBones
 
+
+
+#
+# Alternative splitting strategy that ignores the bone hierarchy, and instead
+# partitions the mesh so as to minimize the number of vertices that need to be
+# stored in more than one submesh. Such duplicated vertices cost vertex memory,
+# and long seams tend to result in more submeshes than necessary.
+#
+# The mesh is treated as a graph, with faces as nodes, connected by the
+# VertexSets they share. Since all vertices of a VertexSet are stored together,
+# the cost of a VertexSet stored in more than one submesh is the number of
+# vertices in it, for each submesh beyond the first.
+#
+# Submeshes are grown one at a time from a seed face, always adding the
+# neighbouring face that adds the fewest new vertices, and then the fewest new
+# bones, until the submesh is full. Seeds are taken in order of a breadth first
+# sweep starting from a peripheral face, so that the remaining part of the mesh
+# stays in one piece as far as possible. This is followed by a few passes of
+# boundary refinement, which moves faces at the boundary between submeshes to
+# the submesh where they duplicate fewer vertices. Loose vertices are added to
+# the submeshes last.
+#
+# Submeshes stay within the same soft limits as with the default strategy, and
+# each contains entire VertexSets in their original order, so the result can
+# be reassembled by decodeFmdlSplitMeshes() as usual.
+#
+
+SPLIT_METHOD_BONES = 'bones'
+SPLIT_METHOD_PARTITION = 'partition'
+
+SPLIT_METHODS = [SPLIT_METHOD_BONES, SPLIT_METHOD_PARTITION]
+
+REFINEMENT_PASSES = 4
+
+#
+# The faces and VertexSets of a mesh, numbered in mesh order, with for each
+# face the distinct VertexSets it uses, and for each VertexSet the faces that
+# use it, its number of vertices, and its bones as a bitmask over bone group
+# indices.
+#
+class MeshGraph:
+	def __init__(self, mesh, meshBones):
+		equipresentVertices = computeEquipresentVertexSets(mesh)
+		(encodedFaceIndices, looseVertexSets) = makeStorableItems(mesh.vertexEncoding, equipresentVertices, mesh.faces)
+		
+		self.vertexSets = []
+		vertexSetIndices = {}
+		for encodedVertex in mesh.vertexEncoding:
+			vertexSet = equipresentVertices[encodedVertex]
+			if vertexSet not in vertexSetIndices:
+				vertexSetIndices[vertexSet] = len(self.vertexSets)
+				self.vertexSets.append(vertexSet)
+		
+		self.vertexSetSizes = [len(vertexSet.vertices) for vertexSet in self.vertexSets]
+		self.vertexSetBoneIndices = []
+		self.vertexSetBoneMasks = []
+		for vertexSet in self.vertexSets:
+			if meshBones is None:
+				boneIndices = []
+			else:
+				boneIndices = meshBones.usedBoneIndices(vertexSet)
+			boneMask = 0
+			for boneIndex in boneIndices:
+				boneMask |= 1 << boneIndex
+			self.vertexSetBoneIndices.append(boneIndices)
+			self.vertexSetBoneMasks.append(boneMask)
+		
+		self.faces = list(encodedFaceIndices.keys())
+		self.faceVertexSets = []
+		self.vertexSetFaces = [[] for vertexSet in self.vertexSets]
+		for i in range(len(self.faces)):
+			faceVertexSets = []
+			for encodedVertex in self.faces[i].vertices:
+				vertexSetIndex = vertexSetIndices[equipresentVertices[encodedVertex]]
+				if vertexSetIndex not in faceVertexSets:
+					faceVertexSets.append(vertexSetIndex)
+					self.vertexSetFaces[vertexSetIndex].append(i)
+			self.faceVertexSets.append(faceVertexSets)
+		
+		self.looseVertexSets = sorted(vertexSetIndices[vertexSet] for vertexSet in looseVertexSets)
+	
+	#
+	# Breadth first traversal of the faces connected to face $start, marking
+	# them with $stamp in $marks.
+	#
+	def traverse(self, start, marks, stamp):
+		order = [start]
+		marks[start] = stamp
+		position = 0
+		while position < len(order):
+			for vertexSet in self.faceVertexSets[order[position]]:
+				for face in self.vertexSetFaces[vertexSet]:
+					if marks[face] != stamp:
+						marks[face] = stamp
+						order.append(face)
+			position += 1
+		return order
+	
+	#
+	# All faces, ordered by a breadth first sweep of each connected part of
+	# the mesh, starting from a face that is approximately as far as possible
+	# from the first face of the part.
+	#
+	def sweepOrder(self):
+		marks = [0] * len(self.faces)
+		order = []
+		for face in range(len(self.faces)):
+			if marks[face] != 0:
+				continue
+			peripheralFace = self.traverse(face, marks, 1)[-1]
+			order += self.traverse(peripheralFace, marks, 2)
+		return order
+
+#
+# A set of faces and loose VertexSets that make up a single submesh, with
+# reference counts of the VertexSets used by the faces and of the bones used
+# by the VertexSets.
+#
+class Partition:
+	def __init__(self):
+		self.faceCount = 0
+		self.vertexCount = 0
+		self.vertexSetReferences = {}
+		self.boneReferences = {}
+	
+	def boneCount(self):
+		return len(self.boneReferences)
+	
+	def addVertexSet(self, graph, vertexSet):
+		if vertexSet in self.vertexSetReferences:
+			self.vertexSetReferences[vertexSet] += 1
+			return
+		self.vertexSetReferences[vertexSet] = 1
+		self.vertexCount += graph.vertexSetSizes[vertexSet]
+		for boneIndex in graph.vertexSetBoneIndices[vertexSet]:
+			self.boneReferences[boneIndex] = self.boneReferences.get(boneIndex, 0) + 1
+	
+	def removeVertexSet(self, graph, vertexSet):
+		if self.vertexSetReferences[vertexSet] > 1:
+			self.vertexSetReferences[vertexSet] -= 1
+			return
+		del self.vertexSetReferences[vertexSet]
+		self.vertexCount -= graph.vertexSetSizes[vertexSet]
+		for boneIndex in graph.vertexSetBoneIndices[vertexSet]:
+			if self.boneReferences[boneIndex] > 1:
+				self.boneReferences[boneIndex] -= 1
+			else:
+				del self.boneReferences[boneIndex]
+	
+	#
+	# The number of vertices and the number of bones that storing $vertexSets
+	# in this partition would add to it.
+	#
+	def addedCounts(self, graph, vertexSets):
+		addedVertexCount = 0
+		addedBones = set()
+		for vertexSet in vertexSets:
+			if vertexSet not in self.vertexSetReferences:
+				addedVertexCount += graph.vertexSetSizes[vertexSet]
+				for boneIndex in graph.vertexSetBoneIndices[vertexSet]:
+					if boneIndex not in self.boneReferences:
+						addedBones.add(boneIndex)
+		return (addedVertexCount, len(addedBones))
+	
+	def fits(self, addedFaceCount, addedVertexCount, addedBoneCount):
+		return (
+			    self.faceCount + addedFaceCount <= FACE_LIMIT_SOFT
+			and self.vertexCount + addedVertexCount <= VERTEX_LIMIT_SOFT
+			and self.boneCount() + addedBoneCount <= BONE_LIMIT_SOFT
+		)
+
+#
+# Grow partitions from seed faces taken in $sweepOrder, until all faces are
+# assigned. Returns the partition index of each face.
+#
+def growPartitions(graph, sweepOrder):
+	faceCount = len(graph.faces)
+	facePartitions = [-1] * faceCount
+	sweepPositions = [0] * faceCount
+	for i in range(faceCount):
+		sweepPositions[sweepOrder[i]] = i
+	
+	#
+	# During growth, a VertexSet is in the current partition if its stamp
+	# is the index of the current partition.
+	#
+	vertexSetStamps = [-1] * len(graph.vertexSets)
+	vertexSetSizes = graph.vertexSetSizes
+	vertexSetBoneMasks = graph.vertexSetBoneMasks
+	faceVertexSets = graph.faceVertexSets
+	
+	partitionIndex = -1
+	partitionBoneMask = 0
+	
+	#
+	# The number of vertices and bones that adding $face would add to the
+	# current partition.
+	#
+	def addedCounts(face):
+		addedVertexCount = 0
+		boneMask = 0
+		for vertexSet in faceVertexSets[face]:
+			if vertexSetStamps[vertexSet] != partitionIndex:
+				addedVertexCount += vertexSetSizes[vertexSet]
+				boneMask |= vertexSetBoneMasks[vertexSet]
+		return (addedVertexCount, bin(boneMask & ~partitionBoneMask).count('1'))
+	
+	sweepPosition = 0
+	assignedFaceCount = 0
+	while assignedFaceCount < faceCount:
+		partitionIndex += 1
+		partitionFaceCount = 0
+		partitionVertexCount = 0
+		partitionBoneMask = 0
+		
+		#
+		# Candidate faces, as (added vertices, added bones, sweep position,
+		# face). The counts of a face only drop as the partition grows.
+		# Faces are pushed again when one of their VertexSets is added;
+		# entries that are still outdated when popped are pushed again
+		# with their current counts.
+		#
+		candidates = []
+		while partitionFaceCount < FACE_LIMIT_SOFT:
+			if len(candidates) > 0:
+				(addedVertexCount, addedBoneCount, position, face) = heapq.heappop(candidates)
+				if facePartitions[face] != -1:
+					continue
+				counts = addedCounts(face)
+				if counts != (addedVertexCount, addedBoneCount):
+					heapq.heappush(candidates, counts + (position, face))
+					continue
+				isSeed = False
+			else:
+				while sweepPosition < faceCount and facePartitions[sweepOrder[sweepPosition]] != -1:
+					sweepPosition += 1
+				if sweepPosition == faceCount:
+					break
+				face = sweepOrder[sweepPosition]
+				(addedVertexCount, addedBoneCount) = addedCounts(face)
+				isSeed = True
+			
+			if partitionFaceCount > 0 and (
+				   partitionVertexCount + addedVertexCount > VERTEX_LIMIT_SOFT
+				or bin(partitionBoneMask).count('1') + addedBoneCount > BONE_LIMIT_SOFT
+			):
+				if isSeed:
+					break
+				continue
+			
+			facePartitions[face] = partitionIndex
+			partitionFaceCount += 1
+			assignedFaceCount += 1
+			for vertexSet in faceVertexSets[face]:
+				if vertexSetStamps[vertexSet] == partitionIndex:
+					continue
+				vertexSetStamps[vertexSet] = partitionIndex
+				partitionVertexCount += vertexSetSizes[vertexSet]
+				partitionBoneMask |= vertexSetBoneMasks[vertexSet]
+				for neighbour in graph.vertexSetFaces[vertexSet]:
+					if facePartitions[neighbour] == -1:
+						heapq.heappush(candidates, addedCounts(neighbour) + (sweepPositions[neighbour], neighbour))
+	
+	return facePartitions
+
+#
+# Move faces at the boundary between partitions to a neighbouring partition,
+# where doing so reduces the number of duplicated vertices.
+#
+def refinePartitions(graph, partitions, facePartitions):
+	vertexSetPartitions = [[] for vertexSet in graph.vertexSets]
+	for i in range(len(partitions)):
+		for vertexSet in partitions[i].vertexSetReferences:
+			vertexSetPartitions[vertexSet].append(i)
+	
+	for refinementPass in range(REFINEMENT_PASSES):
+		boundaryFaces = set()
+		for vertexSet in range(len(graph.vertexSets)):
+			if len(vertexSetPartitions[vertexSet]) > 1:
+				boundaryFaces.update(graph.vertexSetFaces[vertexSet])
+		
+		movedFaceCount = 0
+		for face in sorted(boundaryFaces):
+			vertexSets = graph.faceVertexSets[face]
+			source = partitions[facePartitions[face]]
+			
+			removedVertexCount = 0
+			neighbours = set()
+			for vertexSet in vertexSets:
+				if source.vertexSetReferences[vertexSet] == 1:
+					removedVertexCount += graph.vertexSetSizes[vertexSet]
+				neighbours.update(vertexSetPartitions[vertexSet])
+			neighbours.discard(facePartitions[face])
+			if removedVertexCount == 0 or len(neighbours) == 0:
+				continue
+			
+			bestGain = 0
+			bestNeighbour = None
+			for neighbour in sorted(neighbours):
+				(addedVertexCount, addedBoneCount) = partitions[neighbour].addedCounts(graph, vertexSets)
+				gain = removedVertexCount - addedVertexCount
+				if gain > bestGain and partitions[neighbour].fits(1, addedVertexCount, addedBoneCount):
+					bestGain = gain
+					bestNeighbour = neighbour
+			if bestNeighbour is None:
+				continue
+			
+			destination = partitions[bestNeighbour]
+			for vertexSet in vertexSets:
+				source.removeVertexSet(graph, vertexSet)
+				if vertexSet not in source.vertexSetReferences:
+					vertexSetPartitions[vertexSet].remove(facePartitions[face])
+				if vertexSet not in destination.vertexSetReferences:
+					vertexSetPartitions[vertexSet].append(bestNeighbour)
+				destination.addVertexSet(graph, vertexSet)
+			source.faceCount -= 1
+			destination.faceCount += 1
+			facePartitions[face] = bestNeighbour
+			movedFaceCount += 1
+		
+		if movedFaceCount == 0:
+			break
+
+#
+# Splits a mesh into a collection of submeshes that each fit within an fmdl
+# mesh object, minimizing the number of duplicated vertices.
+#
+def partitionMesh(mesh):
+	meshBones = MeshBones(mesh) if mesh.vertexFields.hasBoneMapping else None
+	graph = MeshGraph(mesh, meshBones)
+	
+	facePartitions = growPartitions(graph, graph.sweepOrder())
+	partitions = [Partition() for i in range(max(facePartitions, default = -1) + 1)]
+	for face in range(len(graph.faces)):
+		partition = partitions[facePartitions[face]]
+		partition.faceCount += 1
+		for vertexSet in graph.faceVertexSets[face]:
+			partition.addVertexSet(graph, vertexSet)
+	refinePartitions(graph, partitions, facePartitions)
+	
+	#
+	# Add each loose VertexSet to the first partition it fits in without
+	# adding bones, or else the first partition it fits in at all.
+	#
+	partitionLooseVertexSets = [[] for partition in partitions]
+	for vertexSet in graph.looseVertexSets:
+		selectedPartition = None
+		for i in range(len(partitions)):
+			(addedVertexCount, addedBoneCount) = partitions[i].addedCounts(graph, [vertexSet])
+			if not partitions[i].fits(0, addedVertexCount, addedBoneCount):
+				continue
+			if addedBoneCount == 0:
+				selectedPartition = i
+				break
+			if selectedPartition is None:
+				selectedPartition = i
+		if selectedPartition is None:
+			selectedPartition = len(partitions)
+			partitions.append(Partition())
+			partitionLooseVertexSets.append([])
+		partitions[selectedPartition].addVertexSet(graph, vertexSet)
+		partitionLooseVertexSets[selectedPartition].append(vertexSet)
+	
+	partitionFaces = [[] for partition in partitions]
+	for face in range(len(graph.faces)):
+		partitionFaces[facePartitions[face]].append(graph.faces[face])
+	
+	submeshes = []
+	for i in range(len(partitions)):
+		if len(partitionFaces[i]) == 0 and len(partitionLooseVertexSets[i]) == 0:
+			continue
+		if meshBones is None:
+			bones = set()
+		else:
+			boneMask = 0
+			for boneIndex in partitions[i].boneReferences:
+				boneMask |= 1 << boneIndex
+			bones = meshBones.maskBones(boneMask)
+		submeshes.append(makeSubmesh(
+			mesh,
+			[graph.vertexSets[vertexSet] for vertexSet in sorted(partitions[i].vertexSetReferences)],
+			bones,
+			partitionFaces[i]
+		))
+	return submeshes
+
+
+
 def meshNeedsSplitting(mesh):
 	return (
 		   len(mesh.boneGroup.bones) > BONE_LIMIT_HARD
-		or len(mesh.vertices) > VERTEX_LIMIT_HARD
-		or len(mesh.faces) > FACE_LIMIT_HARD
+		or mesh.vertexCount() > VERTEX_LIMIT_HARD
+		or mesh.faceCount() > FACE_LIMIT_HARD
 	)
 
-def encodeFmdlSplitMeshes(fmdl):
+
+
+#
+# Oversized meshes are split independently of each other, so they can be split
+# in parallel, in a pool of worker processes.
+#
+# A mesh is sent to a worker as a MeshPayload of arrays and bone indices,
+# rather than as its object graph, which is slow to pickle. The worker rebuilds
+# as much of the mesh as splitting looks at, splits it, and sends back each
+# submesh as the indices of its vertices in the original mesh, its faces as
+# indices into its own vertices, and the indices of its bones in the bone
+# group of the original mesh. Splitting does not depend on the identity of any
+# objects, so the submeshes rebuilt from these are identical to those of
+# splitting the mesh in the calling process.
+#
+
+class MeshPayload:
+	def __init__(self, mesh, bones, parentBones):
+		boneIndices = {}
+		for i in range(len(bones)):
+			boneIndices[bones[i]] = i
+		
+		self.boneNames = [bone.name for bone in bones]
+		self.boneGlobalPositions = [
+			(bone.globalPosition.x, bone.globalPosition.y, bone.globalPosition.z, bone.globalPosition.w)
+			for bone in bones
+		]
+		self.parentBoneIndices = [
+			-1 if parentBones[bone] is None else boneIndices[parentBones[bone]]
+			for bone in bones
+		]
+		
+		if isinstance(mesh, FmdlArrays.MeshArrays):
+			self.positions = numpy.array(mesh.positions, dtype = numpy.float64)
+			self.positionEncodings = mesh.positions.astype('<f4').tobytes()
+			self.faces = numpy.array(mesh.faceIndices, dtype = numpy.int32).reshape(-1, 3)
+		else:
+			vertexEncoding = mesh.vertexEncoding
+			vertexIndices = {}
+			for i in range(len(vertexEncoding)):
+				vertexIndices[vertexEncoding[i].vertex] = i
+			
+			self.positions = numpy.array(
+				[(encodedVertex.vertex.position.x, encodedVertex.vertex.position.y, encodedVertex.vertex.position.z) for encodedVertex in vertexEncoding],
+				dtype = numpy.float64
+			).reshape(-1, 3)
+			self.positionEncodings = b''.join(encodedVertex.position for encodedVertex in vertexEncoding)
+			self.faces = numpy.array(
+				[[vertexIndices[vertex] for vertex in face.vertices] for face in mesh.faces],
+				dtype = numpy.int32
+			).reshape(-1, 3)
+		
+		self.hasBoneMapping = mesh.vertexFields.hasBoneMapping
+		if self.hasBoneMapping:
+			self.meshBoneIndices = [boneIndices[bone] for bone in mesh.boneGroup.bones]
+			boneInfluences = FmdlArrays.meshBoneArrays(mesh)
+			self.boneIndices = boneInfluences.boneIndices
+			self.boneWeights = boneInfluences.boneWeights
+		else:
+			self.meshBoneIndices = []
+	
+	#
+	# Rebuild the bones, effective parent bones, and the parts of the mesh
+	# that splitting uses.
+	#
+	def rebuild(self):
+		bones = []
+		for i in range(len(self.boneNames)):
+			bone = FmdlFile.FmdlFile.Bone()
+			bone.name = self.boneNames[i]
+			bone.globalPosition = FmdlFile.FmdlFile.Vector4(*self.boneGlobalPositions[i])
+			bones.append(bone)
+		parentBones = collections.OrderedDict()
+		for i in range(len(self.parentBoneIndices)):
+			parentBones[bones[i]] = None if self.parentBoneIndices[i] == -1 else bones[self.parentBoneIndices[i]]
+		
+		mesh = FmdlFile.FmdlFile.Mesh()
+		mesh.vertexFields = FmdlFile.FmdlFile.VertexFields()
+		mesh.vertexFields.hasBoneMapping = self.hasBoneMapping
+		mesh.boneGroup = FmdlFile.FmdlFile.BoneGroup()
+		mesh.boneGroup.bones = [bones[i] for i in self.meshBoneIndices]
+		
+		positions = self.positions.tolist()
+		if self.hasBoneMapping:
+			boneInfluences = FmdlArrays.BoneInfluences(mesh.boneGroup.bones, self.boneIndices, self.boneWeights)
+			boneMappings = boneInfluences.encodedBoneMappings()
+		positionSize = len(self.positionEncodings) // max(len(positions), 1)
+		vertices = []
+		vertexEncoding = []
+		for i in range(len(positions)):
+			vertex = FmdlFile.FmdlFile.Vertex()
+			vertex.position = FmdlFile.FmdlFile.Vector3(*positions[i])
+			encodedVertex = FmdlFile.FmdlFile.VertexEncoding()
+			encodedVertex.vertex = vertex
+			encodedVertex.position = self.positionEncodings[i * positionSize : (i + 1) * positionSize]
+			if self.hasBoneMapping:
+				encodedVertex.boneMapping = boneMappings[i]
+			vertices.append(vertex)
+			vertexEncoding.append(encodedVertex)
+		mesh.vertices = vertices
+		mesh.vertexEncoding = vertexEncoding
+		mesh.faces = [FmdlFile.FmdlFile.Face(*(vertices[index] for index in face)) for face in self.faces.tolist()]
+		if self.hasBoneMapping:
+			mesh.boneInfluences = boneInfluences
+		
+		return (mesh, parentBones)
+
+#
+# Split the mesh in $payload, in a worker process. Returns a list of
+# (vertex indices, face indices, bone group indices) for each submesh.
+#
+def splitMeshPayload(payload, method):
+	(mesh, parentBones) = payload.rebuild()
+	if method == SPLIT_METHOD_PARTITION:
+		submeshes = partitionMesh(mesh)
+	else:
+		submeshes = splitMesh(mesh, parentBones, computeDescendentBones(parentBones))
+	
+	encodedVertexIndices = {}
+	for i in range(len(mesh.vertexEncoding)):
+		encodedVertexIndices[mesh.vertexEncoding[i]] = i
+	boneGroupIndices = {}
+	for i in range(len(mesh.boneGroup.bones)):
+		boneGroupIndices[mesh.boneGroup.bones[i]] = i
+	
+	output = []
+	for submesh in submeshes:
+		submeshVertexIndices = {}
+		for i in range(len(submesh.vertices)):
+			submeshVertexIndices[submesh.vertices[i]] = i
+		output.append((
+			numpy.array([encodedVertexIndices[encodedVertex] for encodedVertex in submesh.vertexEncoding], dtype = numpy.int32),
+			numpy.array([[submeshVertexIndices[vertex] for vertex in face.vertices] for face in submesh.faces], dtype = numpy.int32).reshape(-1, 3),
+			[boneGroupIndices[bone] for bone in submesh.boneGroup.bones],
+		))
+	return output
+
+#
+# Build a submesh of $mesh from the output of splitMeshPayload(). The submeshes
+# of a MeshArrays are MeshArrays.
+#
+def rebuildSubmesh(mesh, vertexIndices, faceIndices, boneGroupIndices):
+	if isinstance(mesh, FmdlArrays.MeshArrays):
+		submesh = mesh.select(vertexIndices, faceIndices)
+	else:
+		submesh = FmdlFile.FmdlFile.Mesh()
+		submesh.materialInstance = mesh.materialInstance
+		submesh.alphaFlags = mesh.alphaFlags
+		submesh.shadowFlags = mesh.shadowFlags
+		submesh.vertexFields = mesh.vertexFields
+		submesh.extensionHeaders = mesh.extensionHeaders.copy()
+		submesh.vertexEncoding = [mesh.vertexEncoding[i] for i in vertexIndices.tolist()]
+		submesh.vertices = [encodedVertex.vertex for encodedVertex in submesh.vertexEncoding]
+		submesh.faceIndices = faceIndices
+	submesh.boneGroup = FmdlFile.FmdlFile.BoneGroup()
+	submesh.boneGroup.bones = [mesh.boneGroup.bones[i] for i in boneGroupIndices]
+	if mesh.vertexFields.hasBoneMapping:
+		submesh.boneInfluences = FmdlArrays.meshBoneArrays(mesh).select(vertexIndices).remap(submesh.boneGroup.bones)
+	return submesh
+
+#
+# Split $meshes using a pool of $workers worker processes. Returns the list of
+# submeshes of each mesh, in order.
+#
+def splitMeshesInParallel(meshes, bones, parentBones, method, workers):
+	payloads = [MeshPayload(mesh, bones, parentBones) for mesh in meshes]
+	with concurrent.futures.ProcessPoolExecutor(max_workers = min(workers, len(meshes))) as executor:
+		results = list(executor.map(splitMeshPayload, payloads, [method] * len(payloads)))
+	return [
+		[rebuildSubmesh(mesh, *submesh) for submesh in submeshes]
+		for (mesh, submeshes) in zip(meshes, results)
+	]
+
+
+#
+# $method is one of SPLIT_METHODS: SPLIT_METHOD_BONES splits meshes along the
+# bone hierarchy, SPLIT_METHOD_PARTITION minimizes duplicated vertices.
+# If $workers is more than 1, oversized meshes are split in parallel in that
+# many worker processes; None uses one worker per cpu.
+#
+def encodeFmdlSplitMeshes(fmdl, method = SPLIT_METHOD_BONES, workers = 1):
+	if method not in SPLIT_METHODS:
+		raise ValueError("Unknown mesh splitting method '%s'" % method)
 	fmdl.precomputeVertexEncoding()
 	
-	didSplitFmdl = False
 	parentBones = computeParentBones(fmdl.bones)
 	descendentBones = computeDescendentBones(parentBones)
+	
+	splitMeshes = [mesh for mesh in fmdl.meshes if meshNeedsSplitting(mesh)]
+	if len(splitMeshes) == 0:
+		return fmdl
+	
+	if workers is None:
+		workers = os.cpu_count() or 1
+	if workers > 1 and len(splitMeshes) > 1:
+		submeshes = splitMeshesInParallel(splitMeshes, fmdl.bones, parentBones, method, workers)
+	else:
+		submeshes = []
+		for mesh in splitMeshes:
+			if isinstance(mesh, FmdlArrays.MeshArrays):
+				#
+				# Splitting works on FmdlFile objects. Build only the parts of
+				# the mesh it looks at, as a worker process would.
+				#
+				payload = MeshPayload(mesh, fmdl.bones, parentBones)
+				submeshes.append([rebuildSubmesh(mesh, *submesh) for submesh in splitMeshPayload(payload, method)])
+			elif method == SPLIT_METHOD_PARTITION:
+				submeshes.append(partitionMesh(mesh))
+			else:
+				submeshes.append(splitMesh(mesh, parentBones, descendentBones))
 	replacedMeshes = {}
+	for i in range(len(splitMeshes)):
+		replacedMeshes[splitMeshes[i]] = submeshes[i]
 	
 	output = FmdlFile.FmdlFile()
 	output.bones = fmdl.bones
@@ -575,17 +1396,10 @@ def encodeFmdlSplitMeshes(fmdl):
 	output.extensionHeaders = fmdl.extensionHeaders.copy()
 	output.meshes = []
 	for mesh in fmdl.meshes:
-		if not meshNeedsSplitting(mesh):
+		if mesh in replacedMeshes:
+			output.meshes += replacedMeshes[mesh]
+		else:
 			output.meshes.append(mesh)
-			continue
-		
-		didSplitFmdl = True
-		meshes = splitMesh(mesh, parentBones, descendentBones)
-		output.meshes += meshes
-		replacedMeshes[mesh] = meshes
-	
-	if not didSplitFmdl:
-		return fmdl
 	
 	meshGroupMap = {}
 	for meshGroup in fmdl.meshGroups:
@@ -677,8 +1491,12 @@ def combineMeshes(meshes, bones):
 	
 	output.boneGroup = FmdlFile.FmdlFile.BoneGroup()
 	if output.vertexFields.hasBoneMapping:
-		selectedBones = set(bone for encodedVertex in output.vertexEncoding for (bone, weight) in encodedVertex.boneMapping)
-		output.boneGroup.bones = [bone for bone in bones if bone in selectedBones]
+		boneIndices = {}
+		for i in range(len(bones)):
+			boneIndices[bones[i]] = i
+		boneInfluences = FmdlArrays.BoneInfluences(bones, *FmdlArrays.encodedBoneArrays([encodedVertex.boneMapping for encodedVertex in output.vertexEncoding], boneIndices))
+		output.boneGroup.bones = [bones[i] for i in FmdlArrays.usedBoneIndices(boneInfluences.boneIndices, boneInfluences.boneWeights).tolist()]
+		output.boneInfluences = boneInfluences.remap(output.boneGroup.bones)
 	return output
 
 def decodeFmdlSplitMeshes(fmdl):
@@ -67,6 +67,10 @@ from . import FmdlFile
 # the `X-FMDL-Extensions: vertex-loop-preservation` extension header.
 #
 
+#
+# Parsed vertices that share a position encoding or bone weighting share the
+# same bytes and tuple objects for them, so these keys compare by identity.
+#
 def topologicalKey(encodedVertex, vertexFields):
 	if vertexFields.hasBoneMapping:
 		return (encodedVertex.position, tuple(encodedVertex.boneMapping))
@@ -95,9 +99,14 @@ def replaceFaceVertices(faces, replacedVertices):
 
 #
 # Consider all FMDL vertices to be loops of the same vertex when they share a
-# position object pointer.
+# position object pointer. FmdlArrays.MeshArrays meshes are encoded on their
+# arrays instead, where loops of the same vertex share a position ID.
 #
 def encodeMeshVertexLoopPreservation(mesh):
+	arrays = FmdlFile.arraysModule()
+	if arrays is not None and isinstance(mesh, arrays.MeshArrays):
+		return mesh.encodeVertexLoopPreservation()
+	
 	#
 	# Map from topological keys to lists of position objects
 	#
@@ -106,8 +115,13 @@ def encodeMeshVertexLoopPreservation(mesh):
 	# Map from position objects to lists of encoded vertices
 	#
 	splitVertices = {}
+	#
+	# Map from encoded vertices to their index in the mesh
+	#
+	vertexRows = {}
 	
 	for encodedVertex in mesh.vertexEncoding:
+		vertexRows[encodedVertex] = len(vertexRows)
 		key = topologicalKey(encodedVertex, mesh.vertexFields)
 		
 		if encodedVertex.vertex.position not in splitVertices:
@@ -161,6 +175,8 @@ def encodeMeshVertexLoopPreservation(mesh):
 	output.faces = replaceFaceVertices(mesh.faces, replacedVertices)
 	output.vertexEncoding = encodedVertices
 	output.extensionHeaders = mesh.extensionHeaders.copy()
+	if mesh.boneInfluences is not None:
+		output.boneInfluences = mesh.boneInfluences.select([vertexRows[encodedVertex] for encodedVertex in encodedVertices])
 	
 	return output
 
@@ -257,6 +273,7 @@ def decodeMeshVertexLoopPreservation(mesh):
 	output.faces = replaceFaceVertices(mesh.faces, replacedVertices)
 	output.vertexEncoding = vertexEncoding
 	output.extensionHeaders = mesh.extensionHeaders.copy()
+	output.boneInfluences = mesh.boneInfluences
 	
 	return output
 
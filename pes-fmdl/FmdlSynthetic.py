@@ -0,0 +1,296 @@
+from . import FmdlFile, PesSkeletonData
+from struct import pack
+import math
+import random
+import zlib
+
+#
+# Synthetic models and textures, for benchmarking.
+#
+# A synthetic model consists of tubes wrapped around the bones of the PES
+# skeleton. Each ring of vertices is weighted to the bone it surrounds, blended
+# with the neighbouring bone towards the ends of the bone, so that bone
+# weights are spatially coherent the way they are in real models. Each ring
+# has a UV seam, where two loops share a single position, as vertex loop
+# preservation expects.
+#
+# Generation is deterministic for a given seed.
+#
+
+
+
+def skeletonBoneNames():
+	names = []
+	for part in ['body', 'face', 'hand_l', 'hand_r', 'boots']:
+		for name in PesSkeletonData.skeletonBones['PES2019'][part]:
+			if name not in names:
+				names.append(name)
+	return names
+
+def syntheticBones(boneCount):
+	names = skeletonBoneNames()
+	if boneCount > len(names):
+		raise ValueError("Cannot make more than %d synthetic bones" % len(names))
+	names = names[:boneCount]
+	
+	bones = {}
+	orderedBones = []
+	def addBone(name):
+		if name in bones:
+			return bones[name]
+		pesBone = PesSkeletonData.bones[name]
+		if pesBone.sklParent is not None and pesBone.sklParent in names:
+			parent = addBone(pesBone.sklParent)
+		else:
+			parent = None
+		bone = FmdlFile.FmdlFile.Bone()
+		bone.name = name
+		bone.parent = parent
+		if parent is not None:
+			parent.children.append(bone)
+		(x, y, z) = pesBone.startPosition
+		bone.globalPosition = FmdlFile.FmdlFile.Vector4(x, y, z, 1.0)
+		bone.localPosition = FmdlFile.FmdlFile.Vector4(0.0, 0.0, 0.0, 0.0)
+		bones[name] = bone
+		orderedBones.append(bone)
+		return bone
+	for name in names:
+		addBone(name)
+	return ([bones[name] for name in names], orderedBones)
+
+def syntheticMaterialInstance(name):
+	texture = FmdlFile.FmdlFile.Texture()
+	texture.filename = name + '_bsm.ftex'
+	texture.directory = '/Assets/pes16/model/character/synthetic/sourceimages/'
+	
+	materialInstance = FmdlFile.FmdlFile.MaterialInstance()
+	materialInstance.name = name
+	materialInstance.technique = 'fox3DDF_Blin'
+	materialInstance.shader = 'fox3ddf_blin'
+	materialInstance.textures = [('Base_Tex_SRGB', texture)]
+	materialInstance.parameters = [('MatParamIndex_0', (0.0, 0.0, 0.0, 0.0))]
+	return materialInstance
+
+def boundingBox(positions):
+	if len(positions) == 0:
+		return FmdlFile.FmdlFile.BoundingBox(
+			FmdlFile.FmdlFile.Vector4(0.0, 0.0, 0.0, 1.0),
+			FmdlFile.FmdlFile.Vector4(0.0, 0.0, 0.0, 1.0)
+		)
+	return FmdlFile.FmdlFile.BoundingBox(
+		FmdlFile.FmdlFile.Vector4(
+			min(position.x for position in positions),
+			min(position.y for position in positions),
+			min(position.z for position in positions),
+			1.0
+		),
+		FmdlFile.FmdlFile.Vector4(
+			max(position.x for position in positions),
+			max(position.y for position in positions),
+			max(position.z for position in positions),
+			1.0
+		)
+	)
+
+#
+# Make a tube of $ringCount rings of $ringSize positions, following the bones
+# in $bones in order. Returns a mesh with ($ringSize + 1) * $ringCount
+# vertices and 2 * $ringSize * ($ringCount - 1) faces, truncated to
+# $faceCount faces if set.
+#
+def syntheticMesh(ringCount, ringSize, faceCount, bones, vertexFields, materialInstance, offset, rng):
+	radius = 0.04
+	rings = []
+	for ring in range(ringCount):
+		if len(bones) == 0:
+			boneMapping = {}
+			center = (offset, ring / max(ringCount - 1, 1), 0.0)
+		else:
+			t = ring * len(bones) / ringCount
+			boneIndex = int(t)
+			fraction = t - boneIndex
+			pesBone = PesSkeletonData.bones[bones[boneIndex].name]
+			center = tuple(
+				offset + pesBone.startPosition[i] + fraction * (pesBone.endPosition[i] - pesBone.startPosition[i])
+				for i in range(3)
+			)
+			
+			boneMapping = { bones[boneIndex]: 1.0 }
+			if fraction > 0.5 and boneIndex + 1 < len(bones):
+				boneMapping[bones[boneIndex + 1]] = fraction - 0.5
+			elif fraction < 0.5 and boneIndex > 0:
+				boneMapping[bones[boneIndex - 1]] = 0.5 - fraction
+			if bones[boneIndex].parent is not None and bones[boneIndex].parent not in boneMapping and rng.random() < 0.3:
+				boneMapping[bones[boneIndex].parent] = 0.1
+			totalWeight = sum(boneMapping.values())
+			boneMapping = { bone: weight / totalWeight for (bone, weight) in boneMapping.items() }
+		
+		vertices = []
+		for i in range(ringSize + 1):
+			angle = 2 * math.pi * i / ringSize
+			(cosine, sine) = (math.cos(angle), math.sin(angle))
+			if i == ringSize:
+				# UV seam: the last loop shares the position of the first.
+				position = vertices[0].position
+			else:
+				position = FmdlFile.FmdlFile.Vector3(
+					center[0] + radius * cosine,
+					center[1] + rng.uniform(-0.002, 0.002),
+					center[2] + radius * sine,
+				)
+			
+			vertex = FmdlFile.FmdlFile.Vertex()
+			vertex.position = position
+			if vertexFields.hasNormal:
+				vertex.normal = FmdlFile.FmdlFile.Vector4(cosine, 0.0, sine, 1.0)
+			if vertexFields.hasTangent:
+				vertex.tangent = FmdlFile.FmdlFile.Vector4(-sine, 0.0, cosine, 1.0)
+			if vertexFields.hasColor:
+				vertex.color = [rng.random(), rng.random(), rng.random(), 1.0]
+			if vertexFields.hasBoneMapping:
+				vertex.boneMapping = boneMapping
+			vertex.uv = [
+				FmdlFile.FmdlFile.Vector2(i / ringSize + uv, ring / max(ringCount - 1, 1))
+				for uv in range(vertexFields.uvCount)
+			]
+			vertices.append(vertex)
+		rings.append(vertices)
+	
+	faces = []
+	for ring in range(ringCount - 1):
+		for i in range(ringSize):
+			a = rings[ring][i]
+			b = rings[ring][i + 1]
+			c = rings[ring + 1][i]
+			d = rings[ring + 1][i + 1]
+			faces.append(FmdlFile.FmdlFile.Face(a, c, b))
+			faces.append(FmdlFile.FmdlFile.Face(b, c, d))
+	if faceCount is not None:
+		if faceCount > len(faces):
+			raise ValueError("Cannot make %d faces out of %d vertices" % (faceCount, ringCount * (ringSize + 1)))
+		faces = faces[:faceCount]
+	
+	mesh = FmdlFile.FmdlFile.Mesh()
+	mesh.vertices = [vertex for vertices in rings for vertex in vertices]
+	mesh.faces = faces
+	mesh.boneGroup = FmdlFile.FmdlFile.BoneGroup()
+	mesh.boneGroup.bones = list(bones)
+	mesh.materialInstance = materialInstance
+	mesh.alphaFlags = 0
+	mesh.shadowFlags = 0
+	mesh.vertexFields = vertexFields
+	return mesh
+
+#
+# Make a synthetic model of about $vertexCount vertices, divided over
+# $meshCount meshes. $faceCount limits the number of faces; by default, each
+# mesh has about twice as many faces as vertices.
+#
+# The result is a model as produced by an export from blender, before any
+# extensions are encoded. Meshes that are too large to store in an fmdl file
+# need to be split by FmdlMeshSplitting before they can be written.
+#
+def syntheticFmdl(vertexCount, faceCount = None, uvCount = 1, highPrecisionUvs = False, hasColor = False, boneCount = 30, meshCount = 1, seed = 0):
+	if uvCount < 0 or uvCount > 4:
+		raise ValueError("Invalid UV count %d" % uvCount)
+	rng = random.Random(seed)
+	
+	(bones, orderedBones) = syntheticBones(boneCount)
+	materialInstances = [syntheticMaterialInstance('synthetic_%d' % i) for i in range(min(meshCount, 2))]
+	
+	rootMeshGroup = FmdlFile.FmdlFile.MeshGroup()
+	rootMeshGroup.name = 'synthetic'
+	rootMeshGroup.visible = True
+	
+	meshes = []
+	for i in range(meshCount):
+		meshVertexCount = vertexCount // meshCount + (1 if i < vertexCount % meshCount else 0)
+		ringSize = max(3, int(math.sqrt(meshVertexCount / 4)))
+		ringCount = max(2, meshVertexCount // (ringSize + 1))
+		if faceCount is None:
+			meshFaceCount = None
+		else:
+			meshFaceCount = faceCount // meshCount + (1 if i < faceCount % meshCount else 0)
+		
+		vertexFields = FmdlFile.FmdlFile.VertexFields()
+		vertexFields.hasNormal = True
+		vertexFields.hasTangent = True
+		vertexFields.hasColor = hasColor
+		vertexFields.hasBoneMapping = boneCount > 0
+		vertexFields.uvCount = uvCount
+		vertexFields.uvEqualities = { uv: [] for uv in range(uvCount) }
+		vertexFields.highPrecisionUv = highPrecisionUvs
+		
+		mesh = syntheticMesh(ringCount, ringSize, meshFaceCount, bones, vertexFields, materialInstances[i % len(materialInstances)], 0.2 * i, rng)
+		meshes.append(mesh)
+		rootMeshGroup.meshes.append(mesh)
+	
+	bonePositions = { bone: [] for bone in orderedBones }
+	for mesh in meshes:
+		for vertex in mesh.vertices:
+			if vertex.boneMapping is not None:
+				for bone in vertex.boneMapping:
+					bonePositions[bone].append(vertex.position)
+	for bone in orderedBones:
+		bone.boundingBox = boundingBox(bonePositions[bone])
+	rootMeshGroup.boundingBox = boundingBox([vertex.position for mesh in meshes for vertex in mesh.vertices])
+	
+	fmdlFile = FmdlFile.FmdlFile()
+	fmdlFile.bones = orderedBones
+	fmdlFile.materialInstances = materialInstances
+	fmdlFile.meshes = meshes
+	fmdlFile.meshGroups = [rootMeshGroup]
+	return fmdlFile
+
+#
+# Make an uncompressed RGBA ftex texture with a full mipmap chain, with the
+# mipmaps stored in zlib-compressed chunks like the game's textures.
+#
+def syntheticFtex(width, height, seed = 0):
+	rng = random.Random(seed)
+	chunkSize = 0x4000
+	
+	mipmaps = []
+	(mipmapWidth, mipmapHeight) = (width, height)
+	while True:
+		row = bytes(rng.randrange(256) for i in range(4 * mipmapWidth))
+		pixels = b''.join(row[i:] + row[:i] for i in range(mipmapHeight))
+		mipmaps.append(pixels)
+		if mipmapWidth == 1 and mipmapHeight == 1:
+			break
+		(mipmapWidth, mipmapHeight) = (max(mipmapWidth // 2, 1), max(mipmapHeight // 2, 1))
+	
+	imageOffset = 64 + 16 * len(mipmaps)
+	mipmapHeaders = bytearray()
+	images = bytearray()
+	for i in range(len(mipmaps)):
+		pixels = mipmaps[i]
+		chunks = [zlib.compress(pixels[j : j + chunkSize]) for j in range(0, len(pixels), chunkSize)]
+		chunkHeaders = bytearray()
+		chunkOffset = 8 * len(chunks)
+		for j in range(len(chunks)):
+			chunkHeaders += pack('< HH I', len(chunks[j]), min(chunkSize, len(pixels) - j * chunkSize), chunkOffset)
+			chunkOffset += len(chunks[j])
+		image = chunkHeaders + b''.join(chunks)
+		mipmapHeaders += pack('< I I I BB H', imageOffset + len(images), len(pixels), len(image), i, 0, len(chunks))
+		images += image
+	
+	header = pack('< 4s f HHHH  BB HIII  BB 14x  8s 8s',
+		b'FTEX',
+		2.03,
+		0, # R8G8B8A8
+		width,
+		height,
+		1, # depth
+		len(mipmaps),
+		2, # nrt
+		0, # flags
+		1,
+		0,
+		1, # texture type
+		0, # ftexs count
+		0,
+		b'\0' * 8,
+		b'\0' * 8,
+	)
+	return header + mipmapHeaders + images
@@ -0,0 +1,383 @@
+from . import FmdlFile
+import struct
+
+#
+# Pure-Python vertex buffer codecs, specialized per vertex format.
+#
+# Without NumPy, vertex buffers are decoded and encoded one vertex at a time.
+# Rather than interpreting the vertex format entries again for every vertex,
+# this module generates a decoder and an encoder function for each distinct
+# vertex format, compiles it once, and caches it. A generated function reads
+# or writes all data of a vertex in a buffer with a single precompiled
+# struct.Struct, and contains no per-datum branching.
+#
+# The generated functions produce exactly the same objects and bytes as the
+# generic implementations they replace.
+#
+
+
+
+#
+# For each vertex datum type, the allowed datum formats, and the struct format
+# of the values of a single datum in each format.
+#
+DATUM_FORMATS = {
+	FmdlFile.FmdlFile.FmdlVertexDatumType.position: {
+		FmdlFile.FmdlFile.FmdlVertexDatumFormat.tripleFloat32: '3f',
+	},
+	FmdlFile.FmdlFile.FmdlVertexDatumType.boneWeights: {
+		FmdlFile.FmdlFile.FmdlVertexDatumFormat.quadFloat8: '4B',
+	},
+	FmdlFile.FmdlFile.FmdlVertexDatumType.normal: {
+		FmdlFile.FmdlFile.FmdlVertexDatumFormat.quadFloat16: '4H',
+	},
+	FmdlFile.FmdlFile.FmdlVertexDatumType.color: {
+		FmdlFile.FmdlFile.FmdlVertexDatumFormat.quadFloat8: '4B',
+	},
+	FmdlFile.FmdlFile.FmdlVertexDatumType.boneIndices: {
+		FmdlFile.FmdlFile.FmdlVertexDatumFormat.quadInt8: '4B',
+	},
+	FmdlFile.FmdlFile.FmdlVertexDatumType.uv0: {
+		FmdlFile.FmdlFile.FmdlVertexDatumFormat.doubleFloat16: '2H',
+		FmdlFile.FmdlFile.FmdlVertexDatumFormat.doubleFloat32: '2f',
+	},
+	FmdlFile.FmdlFile.FmdlVertexDatumType.uv1: {
+		FmdlFile.FmdlFile.FmdlVertexDatumFormat.doubleFloat16: '2H',
+		FmdlFile.FmdlFile.FmdlVertexDatumFormat.doubleFloat32: '2f',
+	},
+	FmdlFile.FmdlFile.FmdlVertexDatumType.uv2: {
+		FmdlFile.FmdlFile.FmdlVertexDatumFormat.doubleFloat16: '2H',
+		FmdlFile.FmdlFile.FmdlVertexDatumFormat.doubleFloat32: '2f',
+	},
+	FmdlFile.FmdlFile.FmdlVertexDatumType.uv3: {
+		FmdlFile.FmdlFile.FmdlVertexDatumFormat.doubleFloat16: '2H',
+		FmdlFile.FmdlFile.FmdlVertexDatumFormat.doubleFloat32: '2f',
+	},
+	FmdlFile.FmdlFile.FmdlVertexDatumType.tangent: {
+		FmdlFile.FmdlFile.FmdlVertexDatumFormat.quadFloat16: '4H',
+	},
+}
+
+UV_DATUM_TYPES = FmdlFile.FmdlFile.UV_DATUM_TYPES
+
+def datumStructFormat(datumType, datumFormat):
+	return FmdlFile.FmdlFile.vertexDatumFormat(DATUM_FORMATS, datumType, datumFormat)
+
+def datumSize(datumType, datumFormat):
+	return struct.calcsize('<' + datumStructFormat(datumType, datumFormat))
+
+def compileFunction(name, lines, namespace):
+	source = '\n'.join(lines) + '\n'
+	exec(compile(source, '<fmdl vertex codec %s>' % name, 'exec'), namespace)
+	function = namespace[name]
+	function.source = source
+	return function
+
+
+
+#
+# Decoding, for FmdlFile.parseVertices().
+#
+
+decoders = {}
+
+#
+# Split a mesh format, as returned by FmdlFile.parseMeshFormatAssignments(),
+# into the buffers it reads from. Datums in the same buffer share their
+# increment, and lie within one increment of the first of them. Returns
+# (signature, baseOffsets), where signature is a tuple of
+# (increment, datums) per buffer, with datums a tuple of
+# (datumType, datumFormat, offset relative to the buffer base), and
+# baseOffsets lists the base offset of each buffer.
+#
+def splitMeshFormat(format):
+	buffers = []
+	for (datumType, datumFormat, offset, increment) in sorted(format, key = (lambda entry: entry[2])):
+		for (baseOffset, bufferIncrement, datums) in buffers:
+			if bufferIncrement == increment and offset < baseOffset + increment:
+				datums.append((datumType, datumFormat, offset - baseOffset))
+				break
+		else:
+			buffers.append((offset, increment, [(datumType, datumFormat, 0)]))
+	
+	signature = tuple((increment, tuple(datums)) for (baseOffset, increment, datums) in buffers)
+	baseOffsets = [baseOffset for (baseOffset, increment, datums) in buffers]
+	return (signature, baseOffsets)
+
+#
+# The byte ranges a buffer record consists of: the union of the byte ranges
+# of its datums, as a sorted list of (start, end) pairs. Datums normally do not
+# overlap, but uv maps that are equal to another uv map share its bytes.
+#
+def recordRanges(datums):
+	ranges = []
+	for (start, end) in sorted((offset, offset + datumSize(datumType, datumFormat)) for (datumType, datumFormat, offset) in datums):
+		if len(ranges) > 0 and start < ranges[-1][1]:
+			ranges[-1] = (ranges[-1][0], max(ranges[-1][1], end))
+		else:
+			ranges.append((start, end))
+	return ranges
+
+def recordStruct(ranges):
+	structFormat = '<'
+	position = 0
+	for (start, end) in ranges:
+		if start > position:
+			structFormat += '%dx' % (start - position)
+		structFormat += '%ds' % (end - start)
+		position = end
+	return struct.Struct(structFormat)
+
+def generateDecoder(signature):
+	# Make sure the float16 table is built.
+	FmdlFile.FmdlFile.parseFloat16(0)
+	
+	namespace = {
+		'Vertex': FmdlFile.FmdlFile.Vertex,
+		'VertexEncoding': FmdlFile.FmdlFile.VertexEncoding,
+		'Vector2': FmdlFile.FmdlFile.Vector2,
+		'Vector3': FmdlFile.FmdlFile.Vector3,
+		'Vector4': FmdlFile.FmdlFile.Vector4,
+		'BoneMapping': FmdlFile.FmdlFile.BoneMapping,
+		'float16': FmdlFile.FmdlFile.float16Table,
+		'boneWeightValues': [i / 255.0 for i in range(256)],
+	}
+	
+	lines = []
+	lines.append('def decode(buffer, baseOffsets, vertexCount, bones):')
+	lines.append('\tvertices = []')
+	lines.append('\tvertexEncodings = []')
+	lines.append('\tboneCount = len(bones)')
+	lines.append('\tpositionEncodings = {}')
+	lines.append('\tboneMappings = {}')
+	for bufferIndex in range(len(signature)):
+		lines.append('\tbase%d = baseOffsets[%d]' % (bufferIndex, bufferIndex))
+	lines.append('\tfor vertexIndex in range(vertexCount):')
+	
+	#
+	# Read the records of the vertex in each buffer, and find the expression
+	# for the bytes of each datum.
+	#
+	datumEncodings = {}
+	datumFormats = {}
+	for bufferIndex in range(len(signature)):
+		(increment, datums) = signature[bufferIndex]
+		ranges = recordRanges(datums)
+		namespace['unpackRecord%d' % bufferIndex] = recordStruct(ranges).unpack_from
+		rangeNames = ['record%d_%d' % (bufferIndex, i) for i in range(len(ranges))]
+		lines.append('\t\t(%s, ) = unpackRecord%d(buffer, base%d + vertexIndex * %d)' % (', '.join(rangeNames), bufferIndex, bufferIndex, increment))
+		
+		for (datumType, datumFormat, offset) in datums:
+			size = datumSize(datumType, datumFormat)
+			for i in range(len(ranges)):
+				(start, end) = ranges[i]
+				if start <= offset and offset + size <= end:
+					break
+			if (start, end) == (offset, offset + size):
+				datumEncodings[datumType] = rangeNames[i]
+			else:
+				datumEncodings[datumType] = '%s[%d : %d]' % (rangeNames[i], offset - start, offset - start + size)
+			datumFormats[datumType] = datumStructFormat(datumType, datumFormat)
+			namespace['unpack%s' % datumFormats[datumType]] = struct.Struct('<' + datumFormats[datumType]).unpack
+	
+	lines.append('\t\tvertex = Vertex()')
+	lines.append('\t\tencoding = VertexEncoding()')
+	lines.append('\t\tencoding.vertex = vertex')
+	
+	def float16Values(count):
+		return ', '.join('float16[value%d]' % i for i in range(count))
+	def values(count):
+		return ', '.join('value%d' % i for i in range(count))
+	
+	position = FmdlFile.FmdlFile.FmdlVertexDatumType.position
+	if position in datumEncodings:
+		#
+		# Loops of the same vertex share their position encoding; keep a
+		# single copy of each. The positions themselves are not shared, see
+		# FmdlArrays.parseVertices().
+		#
+		lines.append('\t\tpositionEncoding = %s' % datumEncodings[position])
+		lines.append('\t\tencoding.position = positionEncodings.setdefault(positionEncoding, positionEncoding)')
+		lines.append('\t\t(%s) = unpack3f(encoding.position)' % values(3))
+		lines.append('\t\tvertex.position = Vector3(%s)' % values(3))
+	
+	for (datumType, attribute) in [
+		(FmdlFile.FmdlFile.FmdlVertexDatumType.normal, 'normal'),
+		(FmdlFile.FmdlFile.FmdlVertexDatumType.tangent, 'tangent'),
+	]:
+		if datumType in datumEncodings:
+			lines.append('\t\tencoding.%s = %s' % (attribute, datumEncodings[datumType]))
+			lines.append('\t\t(%s) = unpack4H(encoding.%s)' % (values(4), attribute))
+			lines.append('\t\tvertex.%s = Vector4(%s)' % (attribute, float16Values(4)))
+	
+	color = FmdlFile.FmdlFile.FmdlVertexDatumType.color
+	if color in datumEncodings:
+		lines.append('\t\tencoding.color = %s' % datumEncodings[color])
+		lines.append('\t\tvertex.color = [x / 255.0 for x in encoding.color]')
+	
+	for datumType in UV_DATUM_TYPES:
+		if datumType not in datumEncodings:
+			continue
+		lines.append('\t\tuvEncoding = %s' % datumEncodings[datumType])
+		lines.append('\t\t(%s) = unpack%s(uvEncoding)' % (values(2), datumFormats[datumType]))
+		if datumFormats[datumType] == '2H':
+			lines.append('\t\tvertex.uv.append(Vector2(%s))' % float16Values(2))
+		else:
+			lines.append('\t\tvertex.uv.append(Vector2(%s))' % values(2))
+		lines.append('\t\tencoding.uv.append(uvEncoding)')
+	
+	boneWeights = FmdlFile.FmdlFile.FmdlVertexDatumType.boneWeights
+	boneIndices = FmdlFile.FmdlFile.FmdlVertexDatumType.boneIndices
+	if boneWeights in datumEncodings and boneIndices in datumEncodings:
+		#
+		# Most vertices share their bone weighting with many others, so each
+		# distinct weighting is decoded only once, into a bone mapping shared
+		# by all those vertices.
+		#
+		lines.append('\t\tboneMappingKey = %s + %s' % (datumEncodings[boneWeights], datumEncodings[boneIndices]))
+		lines.append('\t\tif boneMappingKey in boneMappings:')
+		lines.append('\t\t\t(vertex.boneMapping, encoding.boneMapping) = boneMappings[boneMappingKey]')
+		lines.append('\t\telse:')
+		lines.append('\t\t\t(%s) = unpack4B(%s)' % (', '.join('weight%d' % i for i in range(4)), datumEncodings[boneWeights]))
+		lines.append('\t\t\t(%s) = unpack4B(%s)' % (', '.join('index%d' % i for i in range(4)), datumEncodings[boneIndices]))
+		lines.append('\t\t\tboneMapping = {}')
+		lines.append('\t\t\tboneMappingEncoding = []')
+		#
+		# Bone indices outside of the bone group happen a fair few times in
+		# real models. Ignore the bone weighting instead.
+		#
+		for i in range(4):
+			lines.append('\t\t\tif weight%d > 0 and index%d < boneCount:' % (i, i))
+			lines.append('\t\t\t\tbone = bones[index%d]' % i)
+			lines.append('\t\t\t\tboneMapping[bone] = boneWeightValues[weight%d]' % i)
+			lines.append('\t\t\t\tboneMappingEncoding.append((bone, weight%d))' % i)
+		lines.append('\t\t\tboneMappings[boneMappingKey] = (BoneMapping(boneMapping), tuple(boneMappingEncoding))')
+		lines.append('\t\t\t(vertex.boneMapping, encoding.boneMapping) = boneMappings[boneMappingKey]')
+		namespace['unpack4B'] = struct.Struct('<4B').unpack
+	
+	lines.append('\t\tvertices.append(vertex)')
+	lines.append('\t\tvertexEncodings.append(encoding)')
+	lines.append('\treturn (vertices, vertexEncodings)')
+	
+	return compileFunction('decode', lines, namespace)
+
+#
+# Decode the vertices of a mesh, like FmdlFile.parseVertices(). Returns
+# (vertices, vertexEncodings).
+#
+def decodeVertices(vertexBuffer, format, boneGroup, vertexCount):
+	(signature, baseOffsets) = splitMeshFormat(format)
+	if signature not in decoders:
+		decoders[signature] = generateDecoder(signature)
+	
+	if vertexCount > 0:
+		for bufferIndex in range(len(signature)):
+			(increment, datums) = signature[bufferIndex]
+			recordEnd = max(offset + datumSize(datumType, datumFormat) for (datumType, datumFormat, offset) in datums)
+			if baseOffsets[bufferIndex] + (vertexCount - 1) * increment + recordEnd > len(vertexBuffer):
+				raise FmdlFile.InvalidFmdl("Vertex buffer too small for %d vertices" % vertexCount)
+	
+	bones = boneGroup.bones if boneGroup is not None else []
+	return decoders[signature](vertexBuffer, baseOffsets, vertexCount, bones)
+
+
+
+#
+# Encoding, for FmdlFile.addVertices().
+#
+
+encoders = {}
+
+def generateEncoder(formatEntries, entrySizes):
+	namespace = {}
+	
+	lines = []
+	lines.append('def encode(encodedVertices, boneGroupIndices, buffer, offset0, offset1):')
+	lines.append('\tvertexIndices = {}')
+	lines.append('\tfor vertexIndex in range(len(encodedVertices)):')
+	lines.append('\t\tencoding = encodedVertices[vertexIndex]')
+	lines.append('\t\tvertexIndices[encoding.vertex] = vertexIndex')
+	
+	datumTypes = [datumType for (bufferID, datumType, datumFormat, offset) in formatEntries]
+	if FmdlFile.FmdlFile.FmdlVertexDatumType.boneWeights in datumTypes or FmdlFile.FmdlFile.FmdlVertexDatumType.boneIndices in datumTypes:
+		lines.append('\t\tboneMapping = encoding.boneMapping')
+		lines.append('\t\tboneWeights = [weight for (bone, weight) in boneMapping] + [0, 0, 0, 0]')
+		lines.append('\t\tboneIndices = [boneGroupIndices[bone] for (bone, weight) in boneMapping] + [0, 0, 0, 0]')
+	
+	def datumArguments(datumType):
+		if datumType == FmdlFile.FmdlFile.FmdlVertexDatumType.position:
+			return ['encoding.position']
+		if datumType == FmdlFile.FmdlFile.FmdlVertexDatumType.normal:
+			return ['encoding.normal']
+		if datumType == FmdlFile.FmdlFile.FmdlVertexDatumType.tangent:
+			return ['encoding.tangent']
+		if datumType == FmdlFile.FmdlFile.FmdlVertexDatumType.color:
+			return ['encoding.color']
+		if datumType in UV_DATUM_TYPES:
+			return ['encoding.uv[%d]' % UV_DATUM_TYPES.index(datumType)]
+		if datumType == FmdlFile.FmdlFile.FmdlVertexDatumType.boneWeights:
+			return ['boneWeights[%d]' % i for i in range(4)]
+		if datumType == FmdlFile.FmdlFile.FmdlVertexDatumType.boneIndices:
+			return ['boneIndices[%d]' % i for i in range(4)]
+	
+	def datumField(datumType, datumFormat):
+		if datumType in [FmdlFile.FmdlFile.FmdlVertexDatumType.boneWeights, FmdlFile.FmdlFile.FmdlVertexDatumType.boneIndices]:
+			return '4B'
+		return '%ds' % datumSize(datumType, datumFormat)
+	
+	for bufferID in range(2):
+		datums = sorted(
+			[(offset, datumType, datumFormat) for (entryBufferID, datumType, datumFormat, offset) in formatEntries if entryBufferID == bufferID],
+			key = (lambda datum: datum[0]),
+		)
+		if len(datums) == 0:
+			continue
+		
+		overlapping = False
+		position = 0
+		for (offset, datumType, datumFormat) in datums:
+			if offset < position:
+				overlapping = True
+			position = offset + datumSize(datumType, datumFormat)
+		
+		recordPosition = 'offset%d + vertexIndex * %d' % (bufferID, entrySizes[bufferID])
+		if not overlapping:
+			structFormat = '<'
+			position = 0
+			arguments = []
+			for (offset, datumType, datumFormat) in datums:
+				if offset > position:
+					structFormat += '%dx' % (offset - position)
+				structFormat += datumField(datumType, datumFormat)
+				arguments += datumArguments(datumType)
+				position = offset + datumSize(datumType, datumFormat)
+			namespace['packRecord%d' % bufferID] = struct.Struct(structFormat).pack_into
+			lines.append('\t\tpackRecord%d(buffer, %s, %s)' % (bufferID, recordPosition, ', '.join(arguments)))
+		else:
+			#
+			# Overlapping datums cannot be expressed as a single struct. Write
+			# them one by one in format order, so that later datums overwrite
+			# earlier ones, as the generic implementation did.
+			#
+			for (bufferEntryID, datumType, datumFormat, offset) in formatEntries:
+				if bufferEntryID != bufferID:
+					continue
+				name = 'packDatum%d_%d' % (bufferID, len(namespace))
+				namespace[name] = struct.Struct('<' + datumField(datumType, datumFormat)).pack_into
+				lines.append('\t\t%s(buffer, %s + %d, %s)' % (name, recordPosition, offset, ', '.join(datumArguments(datumType))))
+	
+	lines.append('\treturn vertexIndices')
+	
+	return compileFunction('encode', lines, namespace)
+
+#
+# Encode vertices into the vertex buffers of an fmdl file, like
+# FmdlFile.addVertices(). Returns a map from vertex to vertex index.
+#
+def encodeVertices(encodedVertices, formatEntries, positionBufferEntrySize, dataBufferEntrySize, boneGroupIndices, buffer, positionBufferOffset, dataBufferOffset):
+	key = (tuple(formatEntries), positionBufferEntrySize, dataBufferEntrySize)
+	if key not in encoders:
+		for (bufferID, datumType, datumFormat, offset) in formatEntries:
+			datumStructFormat(datumType, datumFormat)
+		encoders[key] = generateEncoder(formatEntries, [positionBufferEntrySize, dataBufferEntrySize])
+	return encoders[key](encodedVertices, boneGroupIndices, buffer, positionBufferOffset, dataBufferOffset)
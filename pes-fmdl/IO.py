@@ -1,11 +1,13 @@
 import bpy
 import mathutils
 import itertools
+import multiprocessing
+import numpy
 import os
 import os.path
 import re
 
-from . import FmdlFile, FmdlAntiBlur, FmdlMeshSplitting, FmdlSplitVertexEncoding, Ftex, PesSkeletonData
+from . import FmdlArrays, FmdlFile, FmdlAntiBlur, FmdlMeshSplitting, FmdlSplitVertexEncoding, Ftex, PesSkeletonData, Tracing
 
 
 class UnsupportedFmdl(Exception):
@@ -33,6 +35,8 @@ class ExportSettings:
 		self.enableAntiblur = True
 		self.enableVertexLoopPreservation = True
 		self.enableMeshSplitting = True
+		self.meshSplittingMethod = FmdlMeshSplitting.SPLIT_METHOD_BONES
+		self.meshSplittingWorkers = 1
 
 
 
@@ -119,6 +123,7 @@ def createTextureSlot(blenderMaterial, blenderTexture, uvMapColor, uvMapNormals)
 	
 	return blenderTextureSlot
 
+@Tracing.traced('IO.importFmdl')
 def importFmdl(context, fmdl, filename, importSettings = None):
 	UV_MAP_COLOR = 'UVMap'
 	UV_MAP_NORMALS = 'normal_map'
@@ -338,27 +343,45 @@ def importFmdl(context, fmdl, filename, importSettings = None):
 		# mesh.vertices does not correspond either to the blenderMesh.vertices
 		# nor the blenderMesh.loops, but rather the unique values of blenderMesh.loops.
 		# The blenderMesh.vertices correspond to the unique vertex.position values in mesh.vertices.
+		# Position objects hash by identity, not by value: two fmdl vertices at the same coordinates
+		# but with distinct position objects become distinct blender vertices.
 		#
 		
 		vertexIndices = {}
 		vertexVertices = []
+		vertexRows = []
+		vertexPositionIndices = []
 		for vertex in mesh.vertices:
 			if vertex.position not in vertexIndices:
 				vertexIndices[vertex.position] = len(vertexIndices)
 				vertexVertices.append(vertex)
-		loopVertices = list(itertools.chain.from_iterable([reversed(face.vertices) for face in mesh.faces]))
+				vertexRows.append(len(vertexPositionIndices))
+			vertexPositionIndices.append(vertexIndices[vertex.position])
+		
+		if mesh.faceIndices is not None:
+			#
+			# Parsed meshes store their faces as an array of vertex indices.
+			# Use it directly, rather than building Face objects.
+			#
+			loopVertexIndices = numpy.asarray(mesh.faceIndices, dtype = numpy.int32).reshape((-1, 3))[:, ::-1].reshape((-1, ))
+			loopVertices = [mesh.vertices[i] for i in loopVertexIndices.tolist()]
+			loopPositionIndices = numpy.asarray(vertexPositionIndices, dtype = numpy.int32)[loopVertexIndices]
+		else:
+			loopVertices = list(itertools.chain.from_iterable([reversed(face.vertices) for face in mesh.faces]))
+			loopPositionIndices = tuple([vertexIndices[vertex.position] for vertex in loopVertices])
+		faceCount = len(loopVertices) // 3
 		
 		blenderMesh.vertices.add(len(vertexVertices))
 		blenderMesh.vertices.foreach_set("co", tuple(itertools.chain.from_iterable([
 			(vertex.position.x, -vertex.position.z, vertex.position.y) for vertex in vertexVertices
 		])))
 		
-		blenderMesh.loops.add(len(mesh.faces) * 3)
-		blenderMesh.loops.foreach_set("vertex_index", tuple([vertexIndices[vertex.position] for vertex in loopVertices]))
+		blenderMesh.loops.add(faceCount * 3)
+		blenderMesh.loops.foreach_set("vertex_index", loopPositionIndices)
 		
-		blenderMesh.polygons.add(len(mesh.faces))
-		blenderMesh.polygons.foreach_set("loop_start", tuple(range(0, 3 * len(mesh.faces), 3)))
-		blenderMesh.polygons.foreach_set("loop_total", [3 for face in mesh.faces])
+		blenderMesh.polygons.add(faceCount)
+		blenderMesh.polygons.foreach_set("loop_start", tuple(range(0, 3 * faceCount, 3)))
+		blenderMesh.polygons.foreach_set("loop_total", [3 for i in range(faceCount)])
 		
 		blenderMesh.update(calc_edges = True)
 		
@@ -427,10 +450,15 @@ def importFmdl(context, fmdl, filename, importSettings = None):
 		
 		if mesh.vertexFields.hasBoneMapping:
 			vertexGroupIDs = addSkeletonMeshModifier(blenderMeshObject, mesh.boneGroup, armatureObjectID, boneIDs)
-			for i in range(len(vertexVertices)):
-				for bone in vertexVertices[i].boneMapping:
-					weight = vertexVertices[i].boneMapping[bone]
-					blenderMeshObject.vertex_groups[vertexGroupIDs[bone]].add((i, ), weight, 'REPLACE')
+			
+			#
+			# Add all vertices with the same weight for the same bone in a
+			# single call.
+			#
+			boneInfluences = FmdlArrays.meshBoneArrays(mesh).select(vertexRows)
+			for (boneIndex, weight, vertexIndices) in FmdlArrays.groupBoneInfluences(boneInfluences.boneIndices, boneInfluences.boneWeights):
+				bone = boneInfluences.bones[boneIndex]
+				blenderMeshObject.vertex_groups[vertexGroupIDs[bone]].add(vertexIndices, weight / 255.0, 'REPLACE')
 		
 		return meshObjectID
 	
@@ -447,7 +475,8 @@ def importFmdl(context, fmdl, filename, importSettings = None):
 		
 		meshObjectIDs = {}
 		for mesh in fmdl.meshes:
-			meshObjectIDs[mesh] = importMesh(mesh, meshNames[mesh], fmdl, materialIDs, armatureObjectID, boneIDs)
+			with Tracing.span('importMesh', name = meshNames[mesh], vertices = len(mesh.vertices), faces = mesh.faceCount()):
+				meshObjectIDs[mesh] = importMesh(mesh, meshNames[mesh], fmdl, materialIDs, armatureObjectID, boneIDs)
 		
 		return meshObjectIDs
 	
@@ -533,11 +562,14 @@ def importFmdl(context, fmdl, filename, importSettings = None):
 	
 	
 	if importSettings.enableExtensions and importSettings.enableMeshSplitting:
-		fmdl = FmdlMeshSplitting.decodeFmdlSplitMeshes(fmdl)
+		with Tracing.stage('decodeFmdlSplitMeshes'):
+			fmdl = FmdlMeshSplitting.decodeFmdlSplitMeshes(fmdl)
 	if importSettings.enableExtensions and importSettings.enableVertexLoopPreservation:
-		fmdl = FmdlSplitVertexEncoding.decodeFmdlVertexLoopPreservation(fmdl)
+		with Tracing.stage('decodeFmdlVertexLoopPreservation'):
+			fmdl = FmdlSplitVertexEncoding.decodeFmdlVertexLoopPreservation(fmdl)
 	if importSettings.enableExtensions and importSettings.enableAntiblur:
-		fmdl = FmdlAntiBlur.decodeFmdlAntiBlur(fmdl)
+		with Tracing.stage('decodeFmdlAntiBlur'):
+			fmdl = FmdlAntiBlur.decodeFmdlAntiBlur(fmdl)
 	
 	if importSettings.enableImportAllBoundingBoxes:
 		importBoundingBoxMode = 'ALL'
@@ -561,16 +593,20 @@ def importFmdl(context, fmdl, filename, importSettings = None):
 	]:
 		if os.path.isdir(directory):
 			textureSearchPath.append(directory)
-	materialIDs = importMaterials(fmdl, textureSearchPath, importSettings.enableLoadTextures)
+	with Tracing.span('importMaterials'):
+		materialIDs = importMaterials(fmdl, textureSearchPath, importSettings.enableLoadTextures)
 	
 	if len(fmdl.bones) > 0:
-		(armatureObjectID, boneIDs) = importSkeleton(context, fmdl)
+		with Tracing.span('importSkeleton'):
+			(armatureObjectID, boneIDs) = importSkeleton(context, fmdl)
 	else:
 		(armatureObjectID, boneIDs) = (None, [])
 	
-	meshObjectIDs = importMeshes(context, fmdl, materialIDs, armatureObjectID, boneIDs)
+	with Tracing.stage('importMeshes'):
+		meshObjectIDs = importMeshes(context, fmdl, materialIDs, armatureObjectID, boneIDs)
 	
-	rootMeshGroupID = importMeshTree(context, fmdl, meshObjectIDs, armatureObjectID, filename, importBoundingBoxMode)
+	with Tracing.span('importMeshTree'):
+		rootMeshGroupID = importMeshTree(context, fmdl, meshObjectIDs, armatureObjectID, filename, importBoundingBoxMode)
 	
 	
 	
@@ -587,6 +623,17 @@ def simplifyBlenderObjectName(name):
 		return name[:-4]
 	return name
 
+#
+# multiprocessing starts worker processes with sys.executable where it cannot
+# fork them, which inside blender is blender itself rather than its bundled
+# python.
+#
+def setWorkerExecutable():
+	executable = getattr(bpy.app, 'binary_path_python', '')
+	if executable != '':
+		multiprocessing.set_executable(executable)
+
+@Tracing.traced('IO.exportFmdl')
 def exportFmdl(context, rootObjectName, exportSettings = None):
 	def exportMaterial(blenderMaterial, textureFmdlObjects):
 		materialInstance = FmdlFile.FmdlFile.MaterialInstance()
@@ -648,12 +695,18 @@ def exportFmdl(context, rootObjectName, exportSettings = None):
 				return (boneName, pesBone.sklParent, pesBone.startPosition)
 			return (boneName, None, (0, 0, 0))
 		
+		#
+		# Bones are exported in the order they are first used, rather than in
+		# dict order, which is hash order on the python of older blenders.
+		#
 		bones = {}
+		usedBoneNames = []
 		for blenderMeshObject in blenderMeshObjects:
 			boneNames = [vertexGroup.name for vertexGroup in blenderMeshObject.vertex_groups]
 			for boneName in boneNames:
 				if boneName not in bones:
 					bones[boneName] = findBone(boneName)
+					usedBoneNames.append(boneName)
 		
 		orderedBones = []
 		bonesByName = {}
@@ -671,7 +724,7 @@ def exportFmdl(context, rootObjectName, exportSettings = None):
 			bone = exportBone(name, parent, location)
 			orderedBones.append(bone)
 			bonesByName[boneName] = bone
-		for boneName in bones.keys():
+		for boneName in usedBoneNames:
 			addOrderedBone(boneName)
 		
 		return (orderedBones, bonesByName)
@@ -694,19 +747,21 @@ def exportFmdl(context, rootObjectName, exportSettings = None):
 			# calc_tangents() only works on triangulated meshes
 			#
 			
-			modifiedBlenderObject = bpy.data.objects.new('triangulation', modifiedBlenderMesh)
-			modifiedBlenderObject.modifiers.new('triangulation', 'TRIANGULATE')
-			newBlenderMesh = modifiedBlenderObject.to_mesh(scene, True, 'PREVIEW', calc_undeformed = True)
-			bpy.data.objects.remove(modifiedBlenderObject)
-			bpy.data.meshes.remove(modifiedBlenderMesh)
-			modifiedBlenderMesh = newBlenderMesh
+			with Tracing.span('triangulate', polygons = len(loopTotals)):
+				modifiedBlenderObject = bpy.data.objects.new('triangulation', modifiedBlenderMesh)
+				modifiedBlenderObject.modifiers.new('triangulation', 'TRIANGULATE')
+				newBlenderMesh = modifiedBlenderObject.to_mesh(scene, True, 'PREVIEW', calc_undeformed = True)
+				bpy.data.objects.remove(modifiedBlenderObject)
+				bpy.data.meshes.remove(modifiedBlenderMesh)
+				modifiedBlenderMesh = newBlenderMesh
 		
 		modifiedBlenderMesh.use_auto_smooth = True
 		if uvLayerNormal is None:
 			uvLayerTangent = uvLayerColor
 		else:
 			uvLayerTangent = uvLayerNormal
-		modifiedBlenderMesh.calc_tangents(uvLayerTangent)
+		with Tracing.span('calcTangents', loops = len(modifiedBlenderMesh.loops)):
+			modifiedBlenderMesh.calc_tangents(uvLayerTangent)
 		
 		
 		
@@ -782,87 +837,145 @@ def exportFmdl(context, rootObjectName, exportSettings = None):
 					remaining = skipped
 				return averageTangent
 		
-		vertices = []
-		for i in range(len(modifiedBlenderMesh.vertices)):
-			blenderVertex = modifiedBlenderMesh.vertices[i]
-			vertex = Vertex()
-			vertex.position = FmdlFile.FmdlFile.Vector3(
-				blenderVertex.co.x,
-				blenderVertex.co.z,
-				-blenderVertex.co.y,
-			)
-			for group in blenderVertex.groups:
-				if group.group >= len(boneVector):
-					continue
-				vertex.boneMapping[boneVector[group.group]] = group.weight
-			vertices.append(vertex)
-		
-		for i in range(len(modifiedBlenderMesh.loops)):
-			blenderLoop = modifiedBlenderMesh.loops[i]
-			vertex = vertices[blenderLoop.vertex_index]
-			
-			loop = Loop()
-			loop.normal = blenderLoop.normal
-			loop.tangents = [blenderLoop.tangent]
-			loop.loopIndices = [i]
+		with Tracing.span('exportVertices', vertices = len(modifiedBlenderMesh.vertices)):
+			vertices = []
+			vertexGroupCounts = []
+			vertexGroupIndices = []
+			vertexGroupWeights = []
+			for i in range(len(modifiedBlenderMesh.vertices)):
+				blenderVertex = modifiedBlenderMesh.vertices[i]
+				vertex = Vertex()
+				vertex.position = FmdlFile.FmdlFile.Vector3(
+					blenderVertex.co.x,
+					blenderVertex.co.z,
+					-blenderVertex.co.y,
+				)
+				groupCount = 0
+				for group in blenderVertex.groups:
+					if group.group >= len(boneVector):
+						continue
+					vertexGroupIndices.append(group.group)
+					vertexGroupWeights.append(group.weight)
+					groupCount += 1
+				vertexGroupCounts.append(groupCount)
+				vertices.append(vertex)
 			
-			if colorLayer is not None:
-				loop.color = [c for c in modifiedBlenderMesh.vertex_colors[colorLayer].data[i].color] + [1.0]
-			loop.uv.append(FmdlFile.FmdlFile.Vector2(
-				modifiedBlenderMesh.uv_layers[uvLayerColor].data[i].uv[0],
-				1.0 - modifiedBlenderMesh.uv_layers[uvLayerColor].data[i].uv[1],
-			))
-			if uvLayerNormal != None:
+			boneInfluences = None
+			if len(boneVector) > 0:
+				width = max([1] + vertexGroupCounts)
+				(groupIndices, groupWeights) = FmdlArrays.influenceArrays(vertexGroupCounts, vertexGroupIndices, vertexGroupWeights, width, FmdlArrays.boneIndexDtype(len(boneVector)), numpy.float64)
+				
+				#
+				# Blender normalizes the bone weights of a vertex when deforming
+				# the mesh, but fmdl files store them as they are. Normalize the
+				# vertices whose weights add up to more than an fmdl file can
+				# represent.
+				#
+				overweighted = numpy.trunc(groupWeights.sum(axis = 1) * 255 + 0.5) > 255
+				groupWeights[overweighted] = FmdlArrays.normalizeBoneWeights(groupWeights[overweighted])
+				
+				#
+				# Many vertices share the same bone weighting. Give all of those the
+				# same boneMapping object.
+				#
+				(mappingIDs, mappingCount) = FmdlArrays.groupRows(numpy.concatenate((
+					numpy.array(vertexGroupCounts, dtype = numpy.uint32).reshape((-1, 1)).view(numpy.uint8),
+					groupIndices.view(numpy.uint8),
+					groupWeights.view(numpy.uint8),
+				), axis = 1))
+				boneMappings = [None for i in range(mappingCount)]
+				for (vertex, mappingID, count, indices, weights) in zip(vertices, mappingIDs.tolist(), vertexGroupCounts, groupIndices.tolist(), groupWeights.tolist()):
+					if boneMappings[mappingID] is None:
+						boneMappings[mappingID] = {}
+						for i in range(count):
+							boneMappings[mappingID][boneVector[indices[i]]] = weights[i]
+					vertex.boneMapping = boneMappings[mappingID]
+				
+				#
+				# Encode the bone mappings of all vertices at once, like
+				# FmdlFile.encodeBoneMapping() does: keep the 4 largest weights
+				# of each vertex, and round them to 8 bits.
+				#
+				nameRanks = {}
+				for name in sorted(set(bone.name for bone in boneVector)):
+					nameRanks[name] = len(nameRanks)
+				(selectedIndices, selectedWeights) = FmdlArrays.selectBoneWeights(groupIndices, groupWeights, width, [nameRanks[bone.name] for bone in boneVector], vertexGroupCounts)
+				boneInfluences = FmdlArrays.BoneInfluences(boneVector, *FmdlArrays.quantizeBoneWeights(selectedIndices, selectedWeights, vertexGroupCounts))
+		
+		with Tracing.span('exportLoops', loops = len(modifiedBlenderMesh.loops)):
+			for i in range(len(modifiedBlenderMesh.loops)):
+				blenderLoop = modifiedBlenderMesh.loops[i]
+				vertex = vertices[blenderLoop.vertex_index]
+				
+				loop = Loop()
+				loop.normal = blenderLoop.normal
+				loop.tangents = [blenderLoop.tangent]
+				loop.loopIndices = [i]
+				
+				if colorLayer is not None:
+					loop.color = [c for c in modifiedBlenderMesh.vertex_colors[colorLayer].data[i].color] + [1.0]
 				loop.uv.append(FmdlFile.FmdlFile.Vector2(
-					modifiedBlenderMesh.uv_layers[uvLayerNormal].data[i].uv[0],
-					1.0 - modifiedBlenderMesh.uv_layers[uvLayerNormal].data[i].uv[1],
+					modifiedBlenderMesh.uv_layers[uvLayerColor].data[i].uv[0],
+					1.0 - modifiedBlenderMesh.uv_layers[uvLayerColor].data[i].uv[1],
+				))
+				if uvLayerNormal != None:
+					loop.uv.append(FmdlFile.FmdlFile.Vector2(
+						modifiedBlenderMesh.uv_layers[uvLayerNormal].data[i].uv[0],
+						1.0 - modifiedBlenderMesh.uv_layers[uvLayerNormal].data[i].uv[1],
+					))
+				
+				found = False
+				for otherLoop in vertex.loops:
+					if otherLoop.matches(loop):
+						otherLoop.add(loop)
+						found = True
+						break
+				if not found:
+					vertex.loops.append(loop)
+		
+		with Tracing.span('exportFmdlVertices'):
+			fmdlVertices = []
+			fmdlVertexRows = []
+			fmdlLoopVertices = {}
+			for i in range(len(vertices)):
+				vertex = vertices[i]
+				for loop in vertex.loops:
+					fmdlVertex = FmdlFile.FmdlFile.Vertex()
+					fmdlVertex.position = vertex.position
+					fmdlVertex.boneMapping = vertex.boneMapping
+					fmdlVertex.normal = FmdlFile.FmdlFile.Vector4(
+						loop.normal.x,
+						loop.normal.z,
+						-loop.normal.y,
+						1.0,
+					)
+					tangent = loop.computeTangent()
+					fmdlVertex.tangent = FmdlFile.FmdlFile.Vector4(
+						tangent.x,
+						tangent.z,
+						-tangent.y,
+						1.0,
+					)
+					fmdlVertex.color = loop.color
+					fmdlVertex.uv = loop.uv
+					fmdlVertices.append(fmdlVertex)
+					fmdlVertexRows.append(i)
+					for loopIndex in loop.loopIndices:
+						fmdlLoopVertices[loopIndex] = fmdlVertex
+			
+			fmdlFaces = []
+			for face in modifiedBlenderMesh.polygons:
+				fmdlFaces.append(FmdlFile.FmdlFile.Face(
+					fmdlLoopVertices[face.loop_start + 2],
+					fmdlLoopVertices[face.loop_start + 1],
+					fmdlLoopVertices[face.loop_start + 0],
 				))
 			
-			found = False
-			for otherLoop in vertex.loops:
-				if otherLoop.matches(loop):
-					otherLoop.add(loop)
-					found = True
-					break
-			if not found:
-				vertex.loops.append(loop)
-		
-		fmdlVertices = []
-		fmdlLoopVertices = {}
-		for vertex in vertices:
-			for loop in vertex.loops:
-				fmdlVertex = FmdlFile.FmdlFile.Vertex()
-				fmdlVertex.position = vertex.position
-				fmdlVertex.boneMapping = vertex.boneMapping
-				fmdlVertex.normal = FmdlFile.FmdlFile.Vector4(
-					loop.normal.x,
-					loop.normal.z,
-					-loop.normal.y,
-					1.0,
-				)
-				tangent = loop.computeTangent()
-				fmdlVertex.tangent = FmdlFile.FmdlFile.Vector4(
-					tangent.x,
-					tangent.z,
-					-tangent.y,
-					1.0,
-				)
-				fmdlVertex.color = loop.color
-				fmdlVertex.uv = loop.uv
-				fmdlVertices.append(fmdlVertex)
-				for loopIndex in loop.loopIndices:
-					fmdlLoopVertices[loopIndex] = fmdlVertex
-		
-		fmdlFaces = []
-		for face in modifiedBlenderMesh.polygons:
-			fmdlFaces.append(FmdlFile.FmdlFile.Face(
-				fmdlLoopVertices[face.loop_start + 2],
-				fmdlLoopVertices[face.loop_start + 1],
-				fmdlLoopVertices[face.loop_start + 0],
-			))
+			if boneInfluences is not None:
+				boneInfluences = boneInfluences.select(fmdlVertexRows)
 		
 		bpy.data.meshes.remove(modifiedBlenderMesh)
-		return (fmdlVertices, fmdlFaces)
+		return (fmdlVertices, fmdlFaces, boneInfluences)
 	
 	def exportMesh(blenderMeshObject, materialFmdlObjects, bonesByName, scene):
 		blenderMesh = blenderMeshObject.data
@@ -944,11 +1057,12 @@ def exportFmdl(context, rootObjectName, exportSettings = None):
 		if len(boneVector) > 0:
 			vertexFields.hasBoneMapping = True
 		
-		(vertices, faces) = exportMeshGeometry(blenderMeshObject, colorLayer, uvLayerColor, uvLayerNormal, boneVector, scene)
+		(vertices, faces, boneInfluences) = exportMeshGeometry(blenderMeshObject, colorLayer, uvLayerColor, uvLayerNormal, boneVector, scene)
 		
 		mesh = FmdlFile.FmdlFile.Mesh()
 		mesh.vertices = vertices
 		mesh.faces = faces
+		mesh.boneInfluences = boneInfluences
 		mesh.boneGroup = FmdlFile.FmdlFile.BoneGroup()
 		mesh.boneGroup.bones = boneVector
 		mesh.materialInstance = materialFmdlObjects[blenderMaterial]
@@ -1221,27 +1335,35 @@ def exportFmdl(context, rootObjectName, exportSettings = None):
 	
 	
 	
-	(blenderMeshObjects, blenderRootObject) = listMeshObjects(context, rootObjectName)
+	with Tracing.span('listMeshObjects'):
+		(blenderMeshObjects, blenderRootObject) = listMeshObjects(context, rootObjectName)
 	
-	(materialInstances, materialFmdlObjects) = exportMaterials(blenderMeshObjects)
+	with Tracing.span('exportMaterials'):
+		(materialInstances, materialFmdlObjects) = exportMaterials(blenderMeshObjects)
 	
-	(bones, bonesByName) = exportBones(blenderMeshObjects)
+	with Tracing.span('exportBones'):
+		(bones, bonesByName) = exportBones(blenderMeshObjects)
 	
 	meshFmdlObjects = {}
 	meshCustomBoundingBoxes = {}
-	for blenderMeshObject in blenderMeshObjects:
-		mesh = exportMesh(blenderMeshObject, materialFmdlObjects, bonesByName, context.scene)
-		meshFmdlObjects[blenderMeshObject] = mesh
-		
-		boundingBox = exportCustomBoundingBox(blenderMeshObject, mesh)
-		if boundingBox is not None:
-			meshCustomBoundingBoxes[mesh] = boundingBox
+	with Tracing.stage('exportMeshes'):
+		for blenderMeshObject in blenderMeshObjects:
+			with Tracing.span('exportMesh', name = blenderMeshObject.name) as span:
+				mesh = exportMesh(blenderMeshObject, materialFmdlObjects, bonesByName, context.scene)
+				span.set(vertices = len(mesh.vertices), faces = len(mesh.faces))
+			meshFmdlObjects[blenderMeshObject] = mesh
+			
+			boundingBox = exportCustomBoundingBox(blenderMeshObject, mesh)
+			if boundingBox is not None:
+				meshCustomBoundingBoxes[mesh] = boundingBox
 	
-	meshGroups = exportMeshGroups(blenderMeshObjects, meshFmdlObjects, blenderRootObject)
+	with Tracing.span('exportMeshGroups'):
+		meshGroups = exportMeshGroups(blenderMeshObjects, meshFmdlObjects, blenderRootObject)
 	
 	meshes = sortMeshes(meshGroups)
 	
-	calculateBoundingBoxes(meshGroups, bones, meshes, meshCustomBoundingBoxes)
+	with Tracing.span('calculateBoundingBoxes'):
+		calculateBoundingBoxes(meshGroups, bones, meshes, meshCustomBoundingBoxes)
 	
 	fmdlFile = FmdlFile.FmdlFile()
 	fmdlFile.bones = bones
@@ -1250,11 +1372,17 @@ def exportFmdl(context, rootObjectName, exportSettings = None):
 	fmdlFile.meshGroups = meshGroups
 	
 	if exportSettings.enableExtensions and exportSettings.enableAntiblur:
-		fmdlFile = FmdlAntiBlur.encodeFmdlAntiBlur(fmdlFile)
+		with Tracing.stage('encodeFmdlAntiBlur'):
+			fmdlFile = FmdlAntiBlur.encodeFmdlAntiBlur(fmdlFile)
 	if exportSettings.enableExtensions and exportSettings.enableVertexLoopPreservation:
-		fmdlFile = FmdlSplitVertexEncoding.encodeFmdlVertexLoopPreservation(fmdlFile)
+		with Tracing.stage('encodeFmdlVertexLoopPreservation'):
+			fmdlFile = FmdlSplitVertexEncoding.encodeFmdlVertexLoopPreservation(fmdlFile)
 	if exportSettings.enableExtensions and exportSettings.enableMeshSplitting:
-		fmdlFile = FmdlMeshSplitting.encodeFmdlSplitMeshes(fmdlFile)
+		with Tracing.stage('encodeFmdlSplitMeshes') as span:
+			if exportSettings.meshSplittingWorkers != 1:
+				setWorkerExecutable()
+			fmdlFile = FmdlMeshSplitting.encodeFmdlSplitMeshes(fmdlFile, exportSettings.meshSplittingMethod, exportSettings.meshSplittingWorkers)
+			span.set(meshes = len(fmdlFile.meshes))
 	
 	errors = []
 	for mesh in fmdlFile.meshes:
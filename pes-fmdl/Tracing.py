@@ -0,0 +1,351 @@
+import functools
+import json
+import os
+import sys
+import threading
+import time
+import tracemalloc
+
+#
+# Lightweight tracing of the stages of importing and exporting.
+#
+# Code marks a stage with
+#
+#   with Tracing.span('stage name', vertices = 123):
+#       ...
+#
+# or decorates a function with @Tracing.traced('stage name'). While tracing is
+# disabled, which is the default, span() returns a shared object that does
+# nothing, so the cost of a span is a single function call. While tracing is
+# enabled, every span records its start and end time, and the resulting events
+# can be written as a Chrome trace-event file, for viewing in chrome://tracing
+# or https://ui.perfetto.dev, or summarized per stage.
+#
+# Tracing is enabled for the duration of a Session. In blender, import and
+# export operations run in a session when the PES_FMDL_TRACE environment
+# variable names a trace file to write.
+#
+# In memory mode, every span also records, using tracemalloc, the peak memory
+# allocated during the span and the memory it retained at its end, relative to
+# its start. Spans opened with stage() rather than span() mark the major stages
+# of a pipeline, and additionally record the source lines that allocated the
+# memory the stage retained, by comparing tracemalloc snapshots taken around
+# it. Memory mode slows everything down considerably, and only covers memory
+# allocated through the Python allocator, which excludes most of blender's own
+# data. Memory mode is enabled in blender by setting PES_FMDL_TRACE_MEMORY=1.
+#
+
+enabled = False
+events = []
+
+memory = False
+memoryStack = []
+startedTracemalloc = False
+
+# Number of allocation sites recorded per stage.
+SITE_COUNT = 8
+
+
+
+class NullSpan:
+	def __enter__(self):
+		return self
+	
+	def __exit__(self, excType, excValue, traceback):
+		return False
+	
+	def set(self, **arguments):
+		pass
+
+NULL_SPAN = NullSpan()
+
+class Span:
+	__slots__ = ('name', 'arguments', 'startTime', 'recordSites')
+	
+	def __init__(self, name, arguments, recordSites = False):
+		self.name = name
+		self.arguments = arguments
+		self.startTime = None
+		self.recordSites = recordSites
+	
+	def __enter__(self):
+		if memory:
+			enterMemory(self.recordSites)
+		self.startTime = time.perf_counter()
+		return self
+	
+	def __exit__(self, excType, excValue, traceback):
+		endTime = time.perf_counter()
+		if memory:
+			exitMemory(self.arguments)
+		if excType is not None:
+			self.arguments['error'] = excType.__name__
+		events.append((self.name, self.startTime, endTime, self.arguments, os.getpid(), threading.get_ident()))
+		return False
+	
+	#
+	# Add arguments that are only known once the span has started, such as
+	# the size of something parsed during the span.
+	#
+	def set(self, **arguments):
+		self.arguments.update(arguments)
+
+def span(name, **arguments):
+	if not enabled:
+		return NULL_SPAN
+	return Span(name, arguments)
+
+def stage(name, **arguments):
+	if not enabled:
+		return NULL_SPAN
+	return Span(name, arguments, True)
+
+def traced(name):
+	def decorator(function):
+		@functools.wraps(function)
+		def tracedFunction(*args, **kwargs):
+			if not enabled:
+				return function(*args, **kwargs)
+			with Span(name, {}):
+				return function(*args, **kwargs)
+		return tracedFunction
+	return decorator
+
+def start(memoryMode = False):
+	global enabled, memory, startedTracemalloc
+	del events[:]
+	del memoryStack[:]
+	if memoryMode and not tracemalloc.is_tracing():
+		tracemalloc.start()
+		startedTracemalloc = True
+	memory = memoryMode
+	enabled = True
+
+#
+# Stop tracing, and return the recorded events as a list of
+# (name, start time, end time, arguments, process id, thread id) tuples,
+# with times in seconds. In memory mode, the arguments of each event include
+# peakBytes and retainedBytes, and those of stages allocationSites.
+#
+def stop():
+	global enabled, memory, startedTracemalloc
+	enabled = False
+	memory = False
+	if startedTracemalloc:
+		tracemalloc.stop()
+		startedTracemalloc = False
+	output = list(events)
+	del events[:]
+	return output
+
+
+
+class MemoryFrame:
+	__slots__ = ('startBytes', 'peakBytes', 'snapshot', 'overheadBytes')
+
+#
+# Allocations by tracemalloc and by this module are left out of the
+# allocation sites. They are skipped after grouping the snapshot by line,
+# which is much faster than Snapshot.filter_traces().
+#
+IGNORED_FILENAMES = (tracemalloc.__file__, __file__, '<frozen importlib._bootstrap>', '<frozen importlib._bootstrap_external>')
+
+#
+# tracemalloc keeps a single peak for the whole process. Where
+# tracemalloc.reset_peak() is available, the peak is reset at the start and
+# end of every span, and the peak of a span is combined with those of the
+# spans nested in it. Otherwise, the peak of a span is only known if the
+# span raised the overall peak, and is None if it did not.
+#
+# Snapshots taken for stages take up memory themselves. That memory is part
+# of the starting point of the stage, and is left out of the peak passed on
+# to the enclosing span.
+#
+def enterMemory(recordSites):
+	(currentBytes, peakBytes) = tracemalloc.get_traced_memory()
+	if len(memoryStack) > 0:
+		memoryStack[-1].peakBytes = max(memoryStack[-1].peakBytes, peakBytes)
+	
+	frame = MemoryFrame()
+	frame.snapshot = tracemalloc.take_snapshot() if recordSites else None
+	if hasattr(tracemalloc, 'reset_peak'):
+		tracemalloc.reset_peak()
+	(frame.startBytes, frame.peakBytes) = tracemalloc.get_traced_memory()
+	frame.overheadBytes = frame.startBytes - currentBytes
+	memoryStack.append(frame)
+
+def exitMemory(arguments):
+	(currentBytes, peakBytes) = tracemalloc.get_traced_memory()
+	frame = memoryStack.pop()
+	if hasattr(tracemalloc, 'reset_peak'):
+		peakBytes = max(frame.peakBytes, peakBytes)
+		arguments['peakBytes'] = peakBytes - frame.startBytes
+	elif peakBytes > frame.peakBytes:
+		arguments['peakBytes'] = peakBytes - frame.startBytes
+	else:
+		arguments['peakBytes'] = None
+	arguments['retainedBytes'] = currentBytes - frame.startBytes
+	
+	if frame.snapshot is not None:
+		differences = [
+			difference
+			for difference in tracemalloc.take_snapshot().compare_to(frame.snapshot, 'lineno')
+			if difference.size_diff > 0 and difference.traceback[0].filename not in IGNORED_FILENAMES
+		]
+		frame.snapshot = None
+		arguments['allocationSites'] = [
+			('%s:%d' % (difference.traceback[0].filename, difference.traceback[0].lineno), difference.size_diff, difference.count_diff)
+			for difference in differences[:SITE_COUNT]
+		]
+		del differences
+	
+	if hasattr(tracemalloc, 'reset_peak'):
+		if len(memoryStack) > 0:
+			memoryStack[-1].peakBytes = max(memoryStack[-1].peakBytes, peakBytes - frame.overheadBytes)
+		tracemalloc.reset_peak()
+
+
+
+def chromeTrace(traceEvents):
+	return {
+		'displayTimeUnit': 'ms',
+		'traceEvents': [
+			{
+				'name': name,
+				'ph': 'X',
+				'ts': startTime * 1000000,
+				'dur': (endTime - startTime) * 1000000,
+				'pid': pid,
+				'tid': tid,
+				'args': arguments,
+			}
+			for (name, startTime, endTime, arguments, pid, tid) in traceEvents
+		],
+	}
+
+def writeChromeTrace(filename, traceEvents):
+	with open(filename, 'w') as stream:
+		json.dump(chromeTrace(traceEvents), stream)
+
+#
+# Total time spent per stage, as a list of (name, count, total seconds,
+# maximum seconds), in order of first occurrence.
+#
+def summary(traceEvents):
+	stages = {}
+	order = []
+	for (name, startTime, endTime, arguments, pid, tid) in sorted(traceEvents, key = (lambda event: event[1])):
+		duration = endTime - startTime
+		if name not in stages:
+			stages[name] = [0, 0.0, 0.0]
+			order.append(name)
+		stage = stages[name]
+		stage[0] += 1
+		stage[1] += duration
+		stage[2] = max(stage[2], duration)
+	return [(name, stages[name][0], stages[name][1], stages[name][2]) for name in order]
+
+#
+# Memory use per stage, for events recorded in memory mode, as a list of
+# (name, maximum peak bytes, total retained bytes, allocation sites), in order
+# of first occurrence. The peak is None if it is unknown for all occurrences.
+# Allocation sites are (site, bytes, count) tuples, summed over all
+# occurrences, largest first.
+#
+def memorySummary(traceEvents):
+	stages = {}
+	order = []
+	for (name, startTime, endTime, arguments, pid, tid) in sorted(traceEvents, key = (lambda event: event[1])):
+		if 'retainedBytes' not in arguments:
+			continue
+		if name not in stages:
+			stages[name] = [None, 0, {}]
+			order.append(name)
+		stage = stages[name]
+		if arguments['peakBytes'] is not None:
+			stage[0] = arguments['peakBytes'] if stage[0] is None else max(stage[0], arguments['peakBytes'])
+		stage[1] += arguments['retainedBytes']
+		for (site, size, count) in arguments.get('allocationSites', []):
+			(previousSize, previousCount) = stage[2].get(site, (0, 0))
+			stage[2][site] = (previousSize + size, previousCount + count)
+	
+	output = []
+	for name in order:
+		(peakBytes, retainedBytes, sites) = stages[name]
+		siteList = sorted(
+			[(site, size, count) for (site, (size, count)) in sites.items()],
+			key = (lambda site: (-site[1], site[0]))
+		)
+		output.append((name, peakBytes, retainedBytes, siteList[:SITE_COUNT]))
+	return output
+
+def formatBytes(size):
+	if size is None:
+		return '-'
+	if abs(size) < 1024 * 1024:
+		return '%.1f KB' % (size / 1024)
+	return '%.1f MB' % (size / (1024 * 1024))
+
+def formatSummary(traceEvents):
+	lines = ["%-40s %7s %10s %10s\n" % ("stage", "count", "total", "max")]
+	for (name, count, totalSeconds, maximumSeconds) in summary(traceEvents):
+		lines.append("%-40s %7d %9.3fs %9.3fs\n" % (name, count, totalSeconds, maximumSeconds))
+	
+	stages = memorySummary(traceEvents)
+	if len(stages) > 0:
+		lines.append("\n%-40s %12s %12s\n" % ("stage", "peak", "retained"))
+		for (name, peakBytes, retainedBytes, sites) in stages:
+			lines.append("%-40s %12s %12s\n" % (name, formatBytes(peakBytes), formatBytes(retainedBytes)))
+		for (name, peakBytes, retainedBytes, sites) in stages:
+			if len(sites) == 0:
+				continue
+			lines.append("\nallocation sites retained by %s:\n" % name)
+			for (site, size, count) in sites:
+				lines.append("  %12s %9d blocks  %s\n" % (formatBytes(size), count, site))
+	return ''.join(lines)
+
+
+
+#
+# Trace everything run inside the session, if $filename is set. On exit,
+# write the trace to $filename and print a per-stage summary. A session
+# inside another session does nothing.
+#
+class Session:
+	def __init__(self, filename, stream = None, memoryMode = False):
+		self.filename = filename
+		self.stream = stream
+		self.memoryMode = memoryMode
+		self.active = False
+	
+	def __enter__(self):
+		if self.filename is not None and not enabled:
+			self.active = True
+			start(self.memoryMode)
+		return self
+	
+	def __exit__(self, excType, excValue, traceback):
+		if not self.active:
+			return False
+		self.active = False
+		traceEvents = stop()
+		writeChromeTrace(self.filename, traceEvents)
+		stream = self.stream if self.stream is not None else sys.stdout
+		stream.write(formatSummary(traceEvents))
+		return False
+
+def environmentTraceFilename():
+	filename = os.environ.get('PES_FMDL_TRACE', '')
+	if filename == '':
+		return None
+	return filename
+
+def environmentMemoryMode():
+	return os.environ.get('PES_FMDL_TRACE_MEMORY', '') not in ('', '0')
+
+#
+# The session configured by the PES_FMDL_TRACE and PES_FMDL_TRACE_MEMORY
+# environment variables.
+#
+def environmentSession():
+	return Session(environmentTraceFilename(), memoryMode = environmentMemoryMode())
@@ -3,7 +3,7 @@ import bpy
 import bpy.props
 import bpy_extras.io_utils
 
-from . import FmdlFile, Ftex, IO, MaterialPresets, PesSkeletonData
+from . import FmdlFile, FmdlMeshSplitting, Ftex, IO, MaterialPresets, PesSkeletonData, Tracing
 
 
 
@@ -219,6 +219,11 @@ def showExportSummary(area, objectName):
 
 
 
+meshSplittingMethods = [
+	(FmdlMeshSplitting.SPLIT_METHOD_BONES, "Along bones", "Split overlarge meshes along the bone hierarchy"),
+	(FmdlMeshSplitting.SPLIT_METHOD_PARTITION, "Fewest seams", "Split overlarge meshes so as to store as few vertices as possible in more than one piece"),
+]
+
 class FMDL_Scene_Import(bpy.types.Operator, bpy_extras.io_utils.ImportHelper):
 	"""Load a PES FMDL file"""
 	bl_idname = "import_scene.fmdl"
@@ -257,10 +262,11 @@ class FMDL_Scene_Import(bpy.types.Operator, bpy_extras.io_utils.ImportHelper):
 		importSettings.enableLoadTextures = self.load_textures
 		importSettings.enableImportAllBoundingBoxes = self.import_all_bounding_boxes
 		
-		fmdlFile = FmdlFile.FmdlFile()
-		fmdlFile.readFile(filename)
-		
-		rootObject = IO.importFmdl(context, fmdlFile, filename, importSettings)
+		with Tracing.environmentSession():
+			fmdlFile = FmdlFile.FmdlFile()
+			fmdlFile.readFile(filename)
+			
+			rootObject = IO.importFmdl(context, fmdlFile, filename, importSettings)
 		
 		rootObject.fmdl_export_extensions_enabled = importSettings.enableExtensions
 		rootObject.fmdl_export_antiblur = importSettings.enableAntiblur
@@ -279,6 +285,8 @@ class FMDL_Scene_Export_Scene(bpy.types.Operator, bpy_extras.io_utils.ExportHelp
 	antiblur = bpy.props.BoolProperty("Automatic antiblur meshes", default = True)
 	loop_preservation = bpy.props.BoolProperty(name = "Preserve split vertices", default = True)
 	mesh_splitting = bpy.props.BoolProperty(name = "Autosplit overlarge meshes", default = True)
+	mesh_splitting_method = bpy.props.EnumProperty(name = "Splitting method", items = meshSplittingMethods, default = FmdlMeshSplitting.SPLIT_METHOD_BONES)
+	mesh_splitting_jobs = bpy.props.IntProperty(name = "Splitting processes", description = "Number of processes to split overlarge meshes in, in parallel", default = 1, min = 1, max = 64)
 	
 	export_label = "PES FMDL (.fmdl)"
 	
@@ -295,15 +303,18 @@ class FMDL_Scene_Export_Scene(bpy.types.Operator, bpy_extras.io_utils.ExportHelp
 		exportSettings.enableAntiblur = self.antiblur
 		exportSettings.enableVertexLoopPreservation = self.loop_preservation
 		exportSettings.enableMeshSplitting = self.mesh_splitting
+		exportSettings.meshSplittingMethod = self.mesh_splitting_method
+		exportSettings.meshSplittingWorkers = self.mesh_splitting_jobs
 		
-		try:
-			fmdlFile = IO.exportFmdl(context, None, exportSettings)
-		except IO.FmdlExportError as error:
-			self.report({'ERROR'}, "Error exporting Fmdl: " + "; ".join(error.errors))
-			print("Error exporting Fmdl:\n" + "\n".join(error.errors))
-			return {'CANCELLED'}
-		
-		fmdlFile.writeFile(self.filepath)
+		with Tracing.environmentSession():
+			try:
+				fmdlFile = IO.exportFmdl(context, None, exportSettings)
+			except IO.FmdlExportError as error:
+				self.report({'ERROR'}, "Error exporting Fmdl: " + "; ".join(error.errors))
+				print("Error exporting Fmdl:\n" + "\n".join(error.errors))
+				return {'CANCELLED'}
+			
+			fmdlFile.writeFile(self.filepath)
 		
 		self.report({'INFO'}, "Fmdl exported successfully.") 
 		
@@ -320,6 +331,8 @@ class FMDL_Scene_Export_Object(bpy.types.Operator, bpy_extras.io_utils.ExportHel
 	antiblur = bpy.props.BoolProperty(name = "Automatic antiblur meshes", default = True)
 	loop_preservation = bpy.props.BoolProperty(name = "Preserve split vertices", default = True)
 	mesh_splitting = bpy.props.BoolProperty(name = "Autosplit overlarge meshes", default = True)
+	mesh_splitting_method = bpy.props.EnumProperty(name = "Splitting method", items = meshSplittingMethods, default = FmdlMeshSplitting.SPLIT_METHOD_BONES)
+	mesh_splitting_jobs = bpy.props.IntProperty(name = "Splitting processes", description = "Number of processes to split overlarge meshes in, in parallel", default = 1, min = 1, max = 64)
 	
 	export_label = "PES FMDL (.fmdl)"
 	
@@ -336,6 +349,8 @@ class FMDL_Scene_Export_Object(bpy.types.Operator, bpy_extras.io_utils.ExportHel
 		self.antiblur = context.active_object.fmdl_export_antiblur
 		self.loop_preservation = context.active_object.fmdl_export_loop_preservation
 		self.mesh_splitting = context.active_object.fmdl_export_mesh_splitting
+		self.mesh_splitting_method = context.active_object.fmdl_export_mesh_splitting_method
+		self.mesh_splitting_jobs = context.active_object.fmdl_export_mesh_splitting_jobs
 		if context.active_object.fmdl_filename != "":
 			self.filepath = context.active_object.fmdl_filename
 		return bpy_extras.io_utils.ExportHelper.invoke(self, context, event)
@@ -350,15 +365,18 @@ class FMDL_Scene_Export_Object(bpy.types.Operator, bpy_extras.io_utils.ExportHel
 		exportSettings.enableAntiblur = self.antiblur
 		exportSettings.enableVertexLoopPreservation = self.loop_preservation
 		exportSettings.enableMeshSplitting = self.mesh_splitting
+		exportSettings.meshSplittingMethod = self.mesh_splitting_method
+		exportSettings.meshSplittingWorkers = self.mesh_splitting_jobs
 		
-		try:
-			fmdlFile = IO.exportFmdl(context, self.objectName, exportSettings)
-		except IO.FmdlExportError as error:
-			self.report({'ERROR'}, "Error exporting Fmdl: " + "; ".join(error.errors))
-			print("Error exporting Fmdl:\n" + "\n".join(error.errors))
-			return {'CANCELLED'}
-		
-		fmdlFile.writeFile(self.filepath)
+		with Tracing.environmentSession():
+			try:
+				fmdlFile = IO.exportFmdl(context, self.objectName, exportSettings)
+			except IO.FmdlExportError as error:
+				self.report({'ERROR'}, "Error exporting Fmdl: " + "; ".join(error.errors))
+				print("Error exporting Fmdl:\n" + "\n".join(error.errors))
+				return {'CANCELLED'}
+			
+			fmdlFile.writeFile(self.filepath)
 		
 		self.report({'INFO'}, "Fmdl exported successfully.") 
 		
@@ -450,6 +468,12 @@ class FMDL_Scene_Panel_FMDL_Export_Settings(bpy.types.Menu):
 		row = self.layout.row()
 		row.prop(context.active_object, 'fmdl_export_mesh_splitting')
 		row.enabled = context.active_object.fmdl_export_extensions_enabled
+		row = self.layout.row()
+		row.prop(context.active_object, 'fmdl_export_mesh_splitting_method')
+		row.enabled = context.active_object.fmdl_export_extensions_enabled and context.active_object.fmdl_export_mesh_splitting
+		row = self.layout.row()
+		row.prop(context.active_object, 'fmdl_export_mesh_splitting_jobs')
+		row.enabled = context.active_object.fmdl_export_extensions_enabled and context.active_object.fmdl_export_mesh_splitting
 
 class FMDL_Scene_Panel_FMDL_Select_Filename(bpy.types.Operator):
 	"""Select a filename to export this FMDL file"""
@@ -527,6 +551,8 @@ class FMDL_Scene_Panel(bpy.types.Panel):
 			exportSettings.antiblur = object.fmdl_export_antiblur
 			exportSettings.loop_preservation = object.fmdl_export_loop_preservation
 			exportSettings.mesh_splitting = object.fmdl_export_mesh_splitting
+			exportSettings.mesh_splitting_method = object.fmdl_export_mesh_splitting_method
+			exportSettings.mesh_splitting_jobs = object.fmdl_export_mesh_splitting_jobs
 			if object.fmdl_filename == "":
 				subrow.enabled = False
 			row.operator(FMDL_Scene_Export_Object_Summary.bl_idname, text = "", icon = 'INFO').objectName = object.name
@@ -1607,6 +1633,8 @@ def register():
 	bpy.types.Object.fmdl_export_antiblur = bpy.props.BoolProperty("Automatic antiblur meshes", default = True)
 	bpy.types.Object.fmdl_export_loop_preservation = bpy.props.BoolProperty(name = "Preserve split vertices", default = True)
 	bpy.types.Object.fmdl_export_mesh_splitting = bpy.props.BoolProperty(name = "Autosplit overlarge meshes", default = True)
+	bpy.types.Object.fmdl_export_mesh_splitting_method = bpy.props.EnumProperty(name = "Splitting method", items = meshSplittingMethods, default = FmdlMeshSplitting.SPLIT_METHOD_BONES)
+	bpy.types.Object.fmdl_export_mesh_splitting_jobs = bpy.props.IntProperty(name = "Splitting processes", description = "Number of processes to split overlarge meshes in, in parallel", default = 1, min = 1, max = 64)
 	bpy.types.Scene.fmdl_import_extensions_enabled = bpy.props.BoolProperty(name = "Enable blender-pes-fmdl extensions", default = True)
 	bpy.types.Scene.fmdl_import_antiblur = bpy.props.BoolProperty(name = "Automatic antiblur meshes", default = True)
 	bpy.types.Scene.fmdl_import_loop_preservation = bpy.props.BoolProperty(name = "Preserve split vertices", default = True)
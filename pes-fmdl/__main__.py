@@ -0,0 +1,182 @@
+from . import FmdlBatch, FmdlBenchmark, FmdlDeterminism, FmdlFile, FmdlMeshSplitting, FmdlSplitVertexEncoding, FmdlSynthetic
+import argparse
+import os
+import sys
+
+#
+# Command line interface to the parts of the add-on that do not need blender:
+#
+#   python -m pes-fmdl info model.fmdl
+#   python -m pes-fmdl roundtrip -o output/ models/
+#   python -m pes-fmdl determinism --runs 10 models/
+#
+# Commands that process files accept any number of files and directories, and
+# process them in parallel; see FmdlBatch.
+#
+
+
+
+def printSummary(filename, summary, stream):
+	materialIndices = {}
+	for i in range(len(summary.materialInstances)):
+		materialIndices[summary.materialInstances[i]] = i
+	
+	stream.write("%s\n" % filename)
+	if summary.extensionHeaders is not None and 'x-fmdl-extensions' in summary.extensionHeaders:
+		stream.write("  extensions: %s\n" % ', '.join(summary.extensionHeaders['x-fmdl-extensions']))
+	stream.write("  bones: %d\n" % len(summary.bones))
+	stream.write("  materials: %d\n" % len(summary.materialInstances))
+	for i in range(len(summary.materialInstances)):
+		materialInstance = summary.materialInstances[i]
+		stream.write("    %d: %s (%s)\n" % (i, materialInstance.name, materialInstance.shader))
+	stream.write("  meshes: %d\n" % len(summary.meshes))
+	for i in range(len(summary.meshes)):
+		mesh = summary.meshes[i]
+		if mesh.boneGroup is None:
+			boneCount = 0
+		else:
+			boneCount = len(mesh.boneGroup.bones)
+		stream.write("    %d: %d vertices, %d faces, %d bones, material %d%s\n" % (
+			i,
+			mesh.vertexCount,
+			mesh.faceCount,
+			boneCount,
+			materialIndices[mesh.materialInstance],
+			''.join(' [%s]' % header for header in sorted(mesh.extensionHeaders)),
+		))
+	stream.write("  mesh groups: %d\n" % len(summary.meshGroups))
+
+def infoCommand(arguments):
+	failed = 0
+	for (root, filename) in FmdlBatch.findFiles(arguments.paths):
+		try:
+			summary = FmdlFile.FmdlFile.probe(filename)
+		except (OSError, FmdlFile.InvalidFmdl) as error:
+			sys.stdout.write("%s\n  error: %s\n" % (filename, error))
+			failed += 1
+			continue
+		printSummary(filename, summary, sys.stdout)
+	return failed
+
+def batchCommand(arguments):
+	settings = FmdlBatch.batchSettings(arguments)
+	if arguments.operation == 'antiblur' and len(arguments.material) > 0:
+		settings.antiblurMaterials = arguments.material
+	
+	outputDirectory = getattr(arguments, 'output_dir', None)
+	jobs = FmdlBatch.makeOperationJobs(arguments.operation, arguments.paths, outputDirectory)
+	if arguments.operation == 'ftex2dds' and outputDirectory is None:
+		jobs = [(inputFilename, os.path.splitext(inputFilename)[0] + '.dds') for (inputFilename, outputFilename) in jobs]
+	return FmdlBatch.runBatchCommand(arguments.operation, jobs, settings, arguments.report, traceFilename = arguments.trace)
+
+def generateCommand(arguments):
+	fmdlFile = FmdlSynthetic.syntheticFmdl(
+		vertexCount = arguments.vertices,
+		faceCount = arguments.faces,
+		uvCount = arguments.uvs,
+		highPrecisionUvs = arguments.high_precision_uvs,
+		hasColor = arguments.colors,
+		boneCount = arguments.bones,
+		meshCount = arguments.meshes,
+		seed = arguments.seed,
+	)
+	fmdlFile = FmdlSplitVertexEncoding.encodeFmdlVertexLoopPreservation(fmdlFile)
+	fmdlFile = FmdlMeshSplitting.encodeFmdlSplitMeshes(fmdlFile)
+	fmdlFile.writeFile(arguments.output)
+	if arguments.texture is not None:
+		with open(arguments.texture, 'wb') as stream:
+			stream.write(FmdlSynthetic.syntheticFtex(FmdlBenchmark.TEXTURE_SIZE, FmdlBenchmark.TEXTURE_SIZE, arguments.seed))
+	return 0
+
+def benchmarkCommand(arguments):
+	def progress(result):
+		sys.stdout.write("%s\n" % FmdlBenchmark.formatResult(result))
+		sys.stdout.flush()
+	
+	results = FmdlBenchmark.runBenchmarks(arguments.model, arguments.benchmark, arguments.repeat, progress)
+	if arguments.output is not None:
+		FmdlBenchmark.writeResults(arguments.output, results)
+	
+	if arguments.compare is None:
+		return 0
+	regressions = FmdlBenchmark.regressions(FmdlBenchmark.readResults(arguments.compare), results, arguments.tolerance)
+	for (benchmark, model, metric, baselineValue, currentValue) in regressions:
+		sys.stdout.write("regression: %s %s %s %g -> %g\n" % (benchmark, model, metric, baselineValue, currentValue))
+	return len(regressions)
+
+def determinismCommand(arguments):
+	return FmdlDeterminism.checkDeterminism(
+		arguments.paths,
+		runs = arguments.runs,
+		splitMethod = arguments.split_method,
+		splitWorkers = arguments.split_jobs,
+		antiblurMaterials = arguments.material if len(arguments.material) > 0 else None,
+	)
+
+def main(argv = None):
+	parser = argparse.ArgumentParser(prog = 'python -m pes-fmdl', description = "Inspect and convert PES fmdl and ftex files without blender.")
+	subparsers = parser.add_subparsers(dest = 'operation', metavar = 'COMMAND')
+	
+	infoParser = subparsers.add_parser('info', help = "summarize fmdl files")
+	infoParser.add_argument('paths', nargs = '+', metavar = 'PATH', help = "fmdl files, or directories to search for fmdl files")
+	infoParser.set_defaults(command = infoCommand)
+	
+	commands = [
+		('validate', "read fmdl files and decode their extensions", False),
+		('roundtrip', "read fmdl files and write them again", True),
+		('split', "write fmdl files with mesh splitting for oversized meshes", True),
+		('unsplit', "write fmdl files with split meshes combined again", True),
+		('antiblur', "write fmdl files with antiblur meshes for constant-shader materials", True),
+		('ftex2dds', "convert ftex textures to dds", False),
+	]
+	for (name, description, needsOutput) in commands:
+		commandParser = subparsers.add_parser(name, help = description)
+		FmdlBatch.addBatchArguments(commandParser)
+		if needsOutput:
+			commandParser.add_argument('--output-dir', '-o', required = True, metavar = 'DIRECTORY', help = "directory to write output files to")
+		elif name == 'ftex2dds':
+			commandParser.add_argument('--output-dir', '-o', default = None, metavar = 'DIRECTORY', help = "directory to write output files to (default: next to the input files)")
+		if name == 'antiblur':
+			commandParser.add_argument('--material', action = 'append', default = [], metavar = 'NAME', help = "add antiblur meshes for meshes with material NAME instead of all constant-shader meshes; can be repeated")
+		commandParser.set_defaults(command = batchCommand)
+	
+	generateParser = subparsers.add_parser('generate', help = "write a synthetic fmdl file")
+	generateParser.add_argument('output', metavar = 'FILE', help = "fmdl file to write")
+	generateParser.add_argument('--vertices', type = int, default = 10000, help = "approximate number of vertices (default: 10000)")
+	generateParser.add_argument('--faces', type = int, default = None, help = "number of faces (default: about twice the number of vertices)")
+	generateParser.add_argument('--uvs', type = int, default = 1, help = "number of UV maps (default: 1)")
+	generateParser.add_argument('--high-precision-uvs', action = 'store_true', help = "store UVs as 32-bit floats")
+	generateParser.add_argument('--colors', action = 'store_true', help = "add vertex colors")
+	generateParser.add_argument('--bones', type = int, default = 30, help = "number of PES skeleton bones (default: 30)")
+	generateParser.add_argument('--meshes', type = int, default = 1, help = "number of meshes (default: 1)")
+	generateParser.add_argument('--seed', type = int, default = 0, help = "random seed (default: 0)")
+	generateParser.add_argument('--texture', default = None, metavar = 'FILE', help = "also write a synthetic ftex texture to FILE")
+	generateParser.set_defaults(command = generateCommand)
+	
+	benchmarkParser = subparsers.add_parser('benchmark', help = "time parsing, encoding and splitting of synthetic models")
+	benchmarkParser.add_argument('--model', action = 'append', default = None, choices = [name for (name, parameters) in FmdlBenchmark.MODELS], help = "model to benchmark; can be repeated (default: all)")
+	benchmarkParser.add_argument('--benchmark', action = 'append', default = None, choices = [name for (name, setup, run) in FmdlBenchmark.BENCHMARKS], help = "benchmark to run; can be repeated (default: all)")
+	benchmarkParser.add_argument('--repeat', type = int, default = 5, help = "number of timed runs per benchmark (default: 5)")
+	benchmarkParser.add_argument('--output', '-o', default = None, metavar = 'FILE', help = "write results as JSON to FILE")
+	benchmarkParser.add_argument('--compare', default = None, metavar = 'FILE', help = "report regressions against the JSON results in FILE")
+	benchmarkParser.add_argument('--tolerance', type = float, default = 1.2, help = "factor by which a result may exceed the baseline (default: 1.2)")
+	benchmarkParser.set_defaults(command = benchmarkCommand)
+	
+	determinismParser = subparsers.add_parser('determinism', help = "check that exporting gives identical output under different hash seeds")
+	determinismParser.add_argument('paths', nargs = '*', metavar = 'PATH', help = "fmdl files, or directories to search for fmdl files (default: a synthetic model)")
+	determinismParser.add_argument('--runs', type = int, default = 5, help = "number of exports, each with a different PYTHONHASHSEED (default: 5)")
+	determinismParser.add_argument('--split-method', default = FmdlMeshSplitting.SPLIT_METHOD_BONES, choices = FmdlMeshSplitting.SPLIT_METHODS, help = "how to split oversized meshes (default: %(default)s)")
+	determinismParser.add_argument('--split-jobs', type = int, default = 1, metavar = 'N', help = "number of worker processes for splitting the oversized meshes of a single file (default: 1)")
+	determinismParser.add_argument('--material', action = 'append', default = [], metavar = 'NAME', help = "add antiblur meshes for meshes with material NAME instead of all constant-shader meshes; can be repeated")
+	determinismParser.set_defaults(command = determinismCommand)
+	
+	arguments = parser.parse_args(argv)
+	if arguments.operation is None:
+		parser.print_help()
+		return 2
+	
+	failed = arguments.command(arguments)
+	return 1 if failed > 0 else 0
+
+if __name__ == '__main__':
+	sys.exit(main())
@@ -0,0 +1,137 @@
+import hashlib
+import importlib
+import io
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import unittest
+
+FmdlAntiBlur = importlib.import_module('pes-fmdl.FmdlAntiBlur')
+FmdlDeterminism = importlib.import_module('pes-fmdl.FmdlDeterminism')
+FmdlMeshSplitting = importlib.import_module('pes-fmdl.FmdlMeshSplitting')
+FmdlSplitVertexEncoding = importlib.import_module('pes-fmdl.FmdlSplitVertexEncoding')
+FmdlSynthetic = importlib.import_module('pes-fmdl.FmdlSynthetic')
+
+#
+# Exports in separate processes with different hash seeds must produce the
+# same bytes; see FmdlDeterminism.
+#
+
+
+
+RUNS = 3
+
+ENCODERS = {
+	'antiblur': FmdlAntiBlur.encodeFmdlAntiBlur,
+	'loop-preservation': FmdlSplitVertexEncoding.encodeFmdlVertexLoopPreservation,
+}
+
+#
+# A model with a mesh with bones, and a mesh without any.
+#
+def bonelessMeshModel():
+	fmdlFile = FmdlSynthetic.syntheticFmdl(3000, uvCount = 2, hasColor = True, boneCount = 30)
+	bonelessMesh = FmdlSynthetic.syntheticFmdl(3000, uvCount = 2, hasColor = True, boneCount = 0, seed = 1).meshes[0]
+	bonelessMesh.materialInstance = fmdlFile.materialInstances[0]
+	fmdlFile.meshes.append(bonelessMesh)
+	fmdlFile.meshGroups[0].meshes.append(bonelessMesh)
+	return fmdlFile
+
+def fmdlDigest(fmdlFile, directory):
+	filename = os.path.join(directory, 'digest.fmdl')
+	fmdlFile.writeFile(filename)
+	with open(filename, 'rb') as stream:
+		digest = hashlib.sha256(stream.read()).hexdigest()
+	os.remove(filename)
+	return digest
+
+#
+# Digest of the model with a boneless mesh, with antiblur meshes for all of its
+# meshes, encoded with the ENCODERS named in $encoderNames in that order.
+#
+def encodedModelDigest(encoderNames):
+	fmdlFile = bonelessMeshModel()
+	for mesh in fmdlFile.meshes:
+		mesh.extensionHeaders.add('Has-Antiblur-Meshes')
+	for name in encoderNames:
+		fmdlFile = ENCODERS[name](fmdlFile)
+	directory = tempfile.mkdtemp(prefix = 'fmdl-test-')
+	try:
+		return fmdlDigest(fmdlFile, directory)
+	finally:
+		shutil.rmtree(directory, ignore_errors = True)
+
+#
+# Run encodedModelDigest in a new python process for each of RUNS hash seeds.
+#
+def encodedModelDigests(encoderNames):
+	rootDirectory = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+	script = 'import sys; from tests import test_determinism; print(test_determinism.encodedModelDigest(sys.argv[1:]))'
+	digests = []
+	for seed in range(1, RUNS + 1):
+		environment = dict(os.environ)
+		environment['PYTHONHASHSEED'] = str(seed)
+		output = subprocess.check_output([sys.executable, '-c', script] + encoderNames, cwd = rootDirectory, env = environment)
+		digests.append(output.decode('ascii').strip())
+	return digests
+
+class DeterminismTest(unittest.TestCase):
+	def checkDeterminism(self, paths, **arguments):
+		output = io.StringIO()
+		differences = FmdlDeterminism.checkDeterminism(paths, runs = RUNS, stream = output, **arguments)
+		self.assertEqual(differences, 0, output.getvalue())
+		self.assertNotIn('DIFFERENT', output.getvalue())
+	
+	def testSyntheticModelSplitByBones(self):
+		self.checkDeterminism([], splitMethod = FmdlMeshSplitting.SPLIT_METHOD_BONES)
+	
+	def testSyntheticModelSplitByPartition(self):
+		self.checkDeterminism([], splitMethod = FmdlMeshSplitting.SPLIT_METHOD_PARTITION)
+	
+	def testBonelessMesh(self):
+		directory = tempfile.mkdtemp(prefix = 'fmdl-test-')
+		try:
+			filename = os.path.join(directory, 'boneless.fmdl')
+			bonelessMeshModel().writeFile(filename)
+			for splitMethod in [FmdlMeshSplitting.SPLIT_METHOD_BONES, FmdlMeshSplitting.SPLIT_METHOD_PARTITION]:
+				with self.subTest(splitMethod = splitMethod):
+					self.checkDeterminism([filename], splitMethod = splitMethod, antiblurMaterials = ['synthetic_0'])
+		finally:
+			shutil.rmtree(directory, ignore_errors = True)
+	
+	def checkEncodedModel(self, encoderNames):
+		digests = encodedModelDigests(encoderNames)
+		self.assertEqual(len(set(digests)), 1, digests)
+	
+	def testAntiblur(self):
+		self.checkEncodedModel(['antiblur'])
+	
+	def testLoopPreservation(self):
+		self.checkEncodedModel(['loop-preservation'])
+	
+	def testAntiblurAndLoopPreservation(self):
+		self.checkEncodedModel(['antiblur', 'loop-preservation'])
+	
+	#
+	# Splitting oversized meshes in worker processes produces the same file as
+	# splitting them one after another.
+	#
+	def testParallelSplitting(self):
+		directory = tempfile.mkdtemp(prefix = 'fmdl-test-')
+		try:
+			for splitMethod in [FmdlMeshSplitting.SPLIT_METHOD_BONES, FmdlMeshSplitting.SPLIT_METHOD_PARTITION]:
+				with self.subTest(splitMethod = splitMethod):
+					digests = []
+					for workers in [1, 2]:
+						fmdlFile = FmdlSynthetic.syntheticFmdl(30000, boneCount = 80, meshCount = 3)
+						self.assertTrue(all(FmdlMeshSplitting.meshNeedsSplitting(mesh) for mesh in fmdlFile.meshes))
+						fmdlFile = FmdlMeshSplitting.encodeFmdlSplitMeshes(fmdlFile, splitMethod, workers)
+						digests.append(fmdlDigest(fmdlFile, directory))
+					self.assertEqual(digests[0], digests[1])
+		finally:
+			shutil.rmtree(directory, ignore_errors = True)
+
+if __name__ == '__main__':
+	unittest.main()
@@ -0,0 +1,113 @@
+import hashlib
+import importlib
+import os
+import shutil
+import tempfile
+import unittest
+
+FmdlArrays = importlib.import_module('pes-fmdl.FmdlArrays')
+FmdlFile = importlib.import_module('pes-fmdl.FmdlFile')
+FmdlMeshSplitting = importlib.import_module('pes-fmdl.FmdlMeshSplitting')
+FmdlSplitVertexEncoding = importlib.import_module('pes-fmdl.FmdlSplitVertexEncoding')
+FmdlSynthetic = importlib.import_module('pes-fmdl.FmdlSynthetic')
+
+#
+# Meshes read and processed as MeshArrays must produce the same files as the
+# same meshes processed as FmdlFile.Mesh objects.
+#
+
+
+
+def loopPreservation(fmdlFile):
+	return FmdlSplitVertexEncoding.encodeFmdlVertexLoopPreservation(fmdlFile)
+
+def splitByBones(fmdlFile):
+	return FmdlMeshSplitting.encodeFmdlSplitMeshes(loopPreservation(fmdlFile), FmdlMeshSplitting.SPLIT_METHOD_BONES)
+
+def splitByPartition(fmdlFile):
+	return FmdlMeshSplitting.encodeFmdlSplitMeshes(loopPreservation(fmdlFile), FmdlMeshSplitting.SPLIT_METHOD_PARTITION)
+
+ENCODERS = {
+	'none': lambda fmdlFile: fmdlFile,
+	'loop-preservation': loopPreservation,
+	'split-by-bones': splitByBones,
+	'split-by-partition': splitByPartition,
+}
+
+#
+# A model with a mesh that has too many faces for a single fmdl mesh, but can
+# still be written without splitting.
+#
+def oversizedModel():
+	return FmdlSynthetic.syntheticFmdl(30000, faceCount = 40000, uvCount = 2, hasColor = True)
+
+def meshArraysModel(fmdlFile):
+	meshArrays = {}
+	for mesh in fmdlFile.meshes:
+		meshArrays[mesh] = FmdlArrays.MeshArrays.fromMesh(mesh)
+	fmdlFile.meshes = [meshArrays[mesh] for mesh in fmdlFile.meshes]
+	for meshGroup in fmdlFile.meshGroups:
+		meshGroup.meshes = [meshArrays[mesh] for mesh in meshGroup.meshes]
+	return fmdlFile
+
+class MeshArraysTest(unittest.TestCase):
+	def setUp(self):
+		self.directory = tempfile.mkdtemp(prefix = 'fmdl-test-')
+	
+	def tearDown(self):
+		shutil.rmtree(self.directory, ignore_errors = True)
+	
+	def fmdlDigest(self, fmdlFile):
+		filename = os.path.join(self.directory, 'digest.fmdl')
+		fmdlFile.writeFile(filename)
+		with open(filename, 'rb') as stream:
+			return hashlib.sha256(stream.read()).hexdigest()
+	
+	def readFile(self, filename, arrays):
+		fmdlFile = FmdlFile.FmdlFile()
+		fmdlFile.readFile(filename, arrays = arrays)
+		if fmdlFile.extensionHeaders is None:
+			fmdlFile.extensionHeaders = {}
+		return fmdlFile
+	
+	def testParsedMeshes(self):
+		filename = os.path.join(self.directory, 'oversized.fmdl')
+		oversizedModel().writeFile(filename)
+		for (name, encoder) in ENCODERS.items():
+			with self.subTest(encoder = name):
+				self.assertEqual(
+					self.fmdlDigest(encoder(self.readFile(filename, False))),
+					self.fmdlDigest(encoder(self.readFile(filename, True))),
+				)
+	
+	def testConvertedMeshes(self):
+		for (name, encoder) in ENCODERS.items():
+			with self.subTest(encoder = name):
+				self.assertEqual(
+					self.fmdlDigest(encoder(oversizedModel())),
+					self.fmdlDigest(encoder(meshArraysModel(oversizedModel()))),
+				)
+	
+	#
+	# Code that does not know about MeshArrays sees the same vertices and
+	# faces as it would in a parsed FmdlFile.Mesh.
+	#
+	def testObjectAdapters(self):
+		filename = os.path.join(self.directory, 'encoded.fmdl')
+		splitByBones(oversizedModel()).writeFile(filename)
+		def vertexValues(vertex):
+			boneMapping = sorted((bone.name, weight) for (bone, weight) in vertex.boneMapping.items())
+			return (vertex.position.x, vertex.position.y, vertex.position.z, vertex.normal, vertex.tangent, vertex.color, vertex.uv, boneMapping)
+		def encodingValues(encodedVertex):
+			boneMapping = [(bone.name, weight) for (bone, weight) in encodedVertex.boneMapping]
+			return (encodedVertex.position, encodedVertex.normal, encodedVertex.tangent, encodedVertex.color, encodedVertex.uv, boneMapping)
+		for (mesh, meshArrays) in zip(self.readFile(filename, False).meshes, self.readFile(filename, True).meshes):
+			self.assertEqual([vertexValues(vertex) for vertex in mesh.vertices], [vertexValues(vertex) for vertex in meshArrays.vertices])
+			self.assertEqual([encodingValues(encodedVertex) for encodedVertex in mesh.vertexEncoding], [encodingValues(encodedVertex) for encodedVertex in meshArrays.vertexEncoding])
+			self.assertEqual(
+				[[vertexValues(vertex) for vertex in face.vertices] for face in mesh.faces],
+				[[vertexValues(vertex) for vertex in face.vertices] for face in meshArrays.faces],
+			)
+
+if __name__ == '__main__':
+	unittest.main()